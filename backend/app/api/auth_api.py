@@ -11,14 +11,14 @@ router = APIRouter(
 )
 
 @router.post("/register")
-def register_user(request: AuthUserRequest, db: DbSession) -> dict[str, str]:
-    auth_service.register_user(request, db)
+async def register_user(request: AuthUserRequest, db: DbSession) -> dict[str, str]:
+    await auth_service.register_user(request, db)
     return {"message" : "user registered"}
 
 
 @router.post("/login")
-def login(response: Response, request: AuthUserRequest, db: DbSession) -> dict[str, str]:
-    token, user = auth_service.login(request, db)
+async def login(response: Response, request: AuthUserRequest, db: DbSession) -> dict[str, str]:
+    token, user = await auth_service.login(request, db)
     response.set_cookie(
         key="access_token",
         value=f"Bearer {token.access_token}",
@@ -1,26 +1,43 @@
+import asyncio
 import logging
 import os
-from fastapi import APIRouter, HTTPException, status, UploadFile
+from typing import AsyncIterator
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile
 from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
 from uuid import uuid4
 
+from app.core.admission import admission_limiters
 from app.core.config import config
-from app.core.ml_models import ml_models
+from app.core.executors import run_inference
+from app.core.ml_models import ml_models, require_models_ready
 from app.core.s3 import S3Client
 from app.core.qdrant import QdrantClient
 from app.core.openai import OpenAIClient
-from app.services.document_service import s3_get_documents, s3_upload_document, s3_delete_document
+from app.services.document_service import s3_get_documents, s3_upload_document, s3_delete_document, s3_delete_documents, s3_get_object_stream
+from app.services.document_service import upload_document_revision as service_upload_document_revision
 from app.services.document_service import report_based_search as service_report_based_search
 from app.services.document_service import report_points_based_search as service_report_points_based_search
+from app.services.document_service import library_points_based_search as service_library_points_based_search
+from app.services.document_service import report_points_based_search_batch as service_report_points_based_search_batch
 from app.services.document_service import pager_process_document as service_pager_process_document
 from app.services.document_service import pymupdf_full_process_document as service_pymupdf_full_process_document 
 from app.services.document_service import pymupdf_partial_process_document as service_pymupdf_partial_process_document
 from app.services.document_service import mineru_process_document as service_mineru_process_document
-from app.services.report_service import delete_reports
-from app.db.schema import DbSession, Document, Report
-from app.models.document_models import DocumentStatus
+from app.services.document_service import resume_process_document as service_resume_process_document
+from app.services.document_service import reindex_process_document as service_reindex_process_document
+from app.services.report_service import delete_reports, get_report_outline_key
+from app.services.evidence_service import pack_evidence
+from app.services.llm_service import get_completion, llm_cache_stats, sse_event, stream_search_events
+from app.services.profiling_service import profile_request
+from app.services.processing_run_service import get_document_processing_runs, get_processing_stats
+from app.services.rerank_service import rerank_points_batch
+from app.db.schema import DbSession, Document, Report, SessionLocal
+from app.models.document_models import BatchSearchRequest, DocumentStatus
 from app.models.report_models import PyMuPdfPartialReportJson
 from app.services.auth_service import AuthUserData
+from app.models.auth_models import UserData
 
 router = APIRouter(
     prefix="/document"
@@ -33,8 +50,14 @@ SUPPORTED_FILE_TYPES = {
     "application/pdf": "pdf"
 }
 
+# keeps reverse proxies from buffering the event stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
 
-@router.post("/upload")
+@router.post("/upload", dependencies=[Depends(require_models_ready)])
 def upload_document(user_data: AuthUserData, s3_client: S3Client, db: DbSession, file: UploadFile | None = None):
 
     if not file:
@@ -68,6 +91,47 @@ def upload_document(user_data: AuthUserData, s3_client: S3Client, db: DbSession,
     return {"message": "file uploaded successfuly", "id": document_id}
 
 
+@router.post("/upload_revision", dependencies=[Depends(require_models_ready)])
+async def upload_document_revision(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client, db: DbSession, file: UploadFile | None = None):
+    document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
+    if document is None or document.owner_id != user_data.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document is not found"
+        )
+    if document.status == DocumentStatus.PROCESSING.value:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Document is being processed"
+        )
+
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="No file was provided",
+        )
+    
+    if not 0 < file.size <= 250 * MB:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Supported max file size is 250 mb"
+        )
+    
+    content = await file.read()
+    identifier = await run_inference(ml_models["magika"].identify_bytes, content)
+    mime_type = identifier.output.mime_type
+
+    if SUPPORTED_FILE_TYPES.get(mime_type) != document.s3_mime_type:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Revision must be of the same type as the document: {document.s3_mime_type}"
+        )
+
+    await service_upload_document_revision(content, document, qdrant_client, s3_client, db)
+
+    return {"message": "revision uploaded successfuly", "id": document.id}
+
+
 @router.post("/delete")
 async def delete_document(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client, db: DbSession):
     document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
@@ -86,6 +150,31 @@ async def delete_document(id: int, user_data: AuthUserData, qdrant_client: Qdran
 
     return {"message": "file successfuly deleted"}
 
+@router.post("/delete_bulk")
+async def delete_documents(user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client, db: DbSession, ids: list[int] = Query()):
+    ids = list(set(ids))
+    if not 0 < len(ids) <= config.bulk_delete_max_documents:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Bulk delete supports 1 to {config.bulk_delete_max_documents} documents"
+        )
+
+    documents = await run_in_threadpool(lambda: db.query(Document).filter(Document.id.in_(ids), Document.owner_id == user_data.user_id).all())
+    if len(documents) != len(ids):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document is not found"
+        )
+    if any(document.status == DocumentStatus.PROCESSING.value for document in documents):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Document is being processed"
+        )
+
+    await s3_delete_documents(documents, qdrant_client, s3_client, db)
+
+    return {"message": "files successfuly deleted", "count": len(documents)}
+
 @router.post("/delete_document_reports")
 async def delete_document_reports(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client, db: DbSession):
     document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
@@ -108,13 +197,49 @@ async def delete_document_reports(id: int, user_data: AuthUserData, qdrant_clien
     return {"message": "document reports successfuly deleted"}
 
 @router.get("/get")
-def get_documents(user_data: AuthUserData, s3_client: S3Client, db: DbSession, page: int = 1, page_size: int = 20):
+def get_documents(user_data: AuthUserData, s3_client: S3Client, db: DbSession, page: int = 1, page_size: int = 20, after_id: int | None = None, approximate_total: bool = False):
 
-    result = s3_get_documents(page, page_size, user_data, s3_client, db)
+    result = s3_get_documents(page, page_size, user_data, s3_client, db, after_id, approximate_total)
 
     return result
 
-@router.post("/pager_process")
+def get_cacheable_object_response(key: str, etag: str, request: Request, s3_client: S3Client) -> Response:
+    # objects are stored under unique keys and never overwritten, so the key is a valid etag
+    # private, the route needs auth so only the browser of the owner may keep the content, not a cdn or proxy
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    headers["Content-Disposition"] = "inline"
+    return StreamingResponse(s3_get_object_stream(key, s3_client), media_type="application/pdf", headers=headers)
+
+@router.get("/content/{id}")
+def get_document_content(id: int, request: Request, user_data: AuthUserData, s3_client: S3Client, db: DbSession):
+    document = db.query(Document).filter(Document.id == id).first()
+    if document is None or document.owner_id != user_data.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document is not found"
+        )
+
+    return get_cacheable_object_response(f"documents/{document.s3_filename}.{document.s3_mime_type}", f'"{document.s3_filename}"', request, s3_client)
+
+@router.get("/report_outline/{id}")
+def get_report_outline(id: int, request: Request, user_data: AuthUserData, s3_client: S3Client, db: DbSession):
+    report = db.query(Report).filter(Report.id == id).first()
+    document = db.query(Document).filter(Document.id == report.document_id).first() if report is not None else None
+    if document is None or document.owner_id != user_data.user_id or get_report_outline_key(report, document) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report is not found"
+        )
+
+    return get_cacheable_object_response(get_report_outline_key(report, document), f'"{report.s3_filename}"', request, s3_client)
+
+@router.post("/pager_process", dependencies=[Depends(require_models_ready), Depends(profile_request)])
 async def pager_process_document(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client,  db: DbSession):
     document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
     if document is None or document.owner_id != user_data.user_id:
@@ -128,12 +253,13 @@ async def pager_process_document(id: int, user_data: AuthUserData, qdrant_client
             detail="Document is already being processed"
         )
 
-    report_id = await service_pager_process_document(document, qdrant_client, s3_client, db)
+    async with admission_limiters["processing"].acquire():
+        report_id = await service_pager_process_document(document, qdrant_client, s3_client, db)
 
     return {"message": "document successfuly processed", "id": report_id}
 
 
-@router.post("/pymupdf_full_process")
+@router.post("/pymupdf_full_process", dependencies=[Depends(require_models_ready), Depends(profile_request)])
 async def pymupdf_full_process_document(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client,  db: DbSession):
     document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
     if document is None or document.owner_id != user_data.user_id:
@@ -147,12 +273,13 @@ async def pymupdf_full_process_document(id: int, user_data: AuthUserData, qdrant
             detail="Document is already being processed"
         )
 
-    report_id = await service_pymupdf_full_process_document(document, qdrant_client, s3_client, db)
+    async with admission_limiters["processing"].acquire():
+        report_id = await service_pymupdf_full_process_document(document, qdrant_client, s3_client, db)
 
     return {"message": "document successfuly processed", "id": report_id}
 
 
-@router.post("/pymupdf_partial_process")
+@router.post("/pymupdf_partial_process", dependencies=[Depends(profile_request)])
 async def pymupdf_partial_process_document(id: int, user_data: AuthUserData, start: int, end: int, s3_client: S3Client,  db: DbSession):
     document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
     if document is None or document.owner_id != user_data.user_id:
@@ -166,12 +293,13 @@ async def pymupdf_partial_process_document(id: int, user_data: AuthUserData, sta
             detail="Document is already being processed"
         )
 
-    report_id = await service_pymupdf_partial_process_document(document, start, end, s3_client, db)
+    async with admission_limiters["processing"].acquire():
+        report_id = await service_pymupdf_partial_process_document(document, start, end, s3_client, db)
 
     return {"message": "document successfuly processed", "id": report_id}
 
 
-@router.post("/mineru_process")
+@router.post("/mineru_process", dependencies=[Depends(require_models_ready), Depends(profile_request)])
 async def mineru_process_document(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client,  db: DbSession):
     document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
     if document is None or document.owner_id != user_data.user_id:
@@ -185,14 +313,50 @@ async def mineru_process_document(id: int, user_data: AuthUserData, qdrant_clien
             detail="Document is already being processed"
         )
 
-    report_id = await service_mineru_process_document(document, qdrant_client, s3_client, db)
+    async with admission_limiters["processing"].acquire():
+        report_id = await service_mineru_process_document(document, qdrant_client, s3_client, db)
 
     return {"message": "document successfuly processed", "id": report_id}
 
-# [(label, text), (text)]
-#https://huggingface.co/Qwen/Qwen2.5-7B-Instruct
-@router.get("/report_points_based_search")
-async def report_points_based_search(prompt: str, search_text: str, report_id: int, user_data: AuthUserData, qdrant_client: QdrantClient, open_ai_client: OpenAIClient,  db: DbSession, label: str | None = None):
+@router.post("/resume_process", dependencies=[Depends(require_models_ready), Depends(profile_request)])
+async def resume_process_document(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client,  db: DbSession):
+    document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
+    if document is None or document.owner_id != user_data.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document is not found"
+        )
+    if document.status == DocumentStatus.PROCESSING.value:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Document is already being processed"
+        )
+
+    async with admission_limiters["processing"].acquire():
+        report_id = await service_resume_process_document(document, qdrant_client, s3_client, db)
+
+    return {"message": "document successfuly processed", "id": report_id}
+
+@router.post("/reindex_process", dependencies=[Depends(require_models_ready), Depends(profile_request)])
+async def reindex_process_document(id: int, user_data: AuthUserData, qdrant_client: QdrantClient, s3_client: S3Client,  db: DbSession):
+    document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == id).first())
+    if document is None or document.owner_id != user_data.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document is not found"
+        )
+    if document.status == DocumentStatus.PROCESSING.value:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Document is already being processed"
+        )
+
+    async with admission_limiters["processing"].acquire():
+        report_id = await service_reindex_process_document(document, qdrant_client, s3_client, db)
+
+    return {"message": "document successfuly processed", "id": report_id}
+
+async def get_owned_report(report_id: int, user_data: UserData, db: Session) -> Report:
     report = await run_in_threadpool(lambda: db.query(Report).filter(Report.id == report_id).first())
     if report is None:
         raise HTTPException(
@@ -205,81 +369,42 @@ async def report_points_based_search(prompt: str, search_text: str, report_id: i
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Report is not found"
         )
+    return report
 
-    result = await service_report_points_based_search(search_text, report_id, label, qdrant_client)
+async def get_owned_report_ids(document_ids: list[int] | None, user_data: UserData, db: Session) -> list[int]:
+    query = db.query(Report.id).join(Document, Document.id == Report.document_id).filter(Document.owner_id == user_data.user_id)
+    if document_ids:
+        query = query.filter(Document.id.in_(document_ids))
+    report_ids = [row.id for row in await run_in_threadpool(query.all)]
+
+    if len(report_ids) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No reports found"
+        )
+    return report_ids
 
+def get_points_search_messages(prompt: str, search_text: str, points) -> tuple[list[dict], list[dict], dict]:
     content = [ 
         {"type": "text", "text": search_text},
     ]
 
-    evidence_items = []
-    for scored_point in result.points:
-        data = scored_point.payload.get("data", "")
-        if isinstance(data, dict):
-            if "text" in data:
-                item = {"type": "text", "text": data.get("text", "")}
-                content.append(item)
-                evidence_items.append(item)
-            if "image" in data:
-                item = {
-                    "type": "image_url",
-                    "image_url": {
-                        # Critical: Format as data:image/jpeg;base64,<data>
-                        "url": data.get("image", "")
-                    },
-                }
-                content.append(item)
-                evidence_items.append(item)
-        elif isinstance(data, list):
-            content.extend(data)
-            evidence_items.extend(data)
-        else: 
-            item = {"type": "text", "text": data}
-            content.append(item)
-            evidence_items.append(item)
+    evidence_items, packing = pack_evidence(prompt, search_text, points)
+    content.extend(evidence_items)
 
     messages = [
         {"role": "system", "content": prompt},
         {"role": "user", "content": content}
     ]
 
-    # for index, item in enumerate(content):
-    #     print(f"{index}: {item}")
-    #     print()
-
-    response = await open_ai_client.chat.completions.create(
-        model=config.open_ai_model_name,
-        messages=messages,
-        temperature=0,
-        max_tokens=4096
-    )
-
-    result = response.choices[0].message.content
-
-    return {"result": result, "items": evidence_items}
-
-@router.get("/report_based_search")
-async def report_based_search(prompt: str, search_text: str, report_id: int, user_data: AuthUserData, s3_client: S3Client, open_ai_client: OpenAIClient, db: DbSession):
-    report = await run_in_threadpool(lambda: db.query(Report).filter(Report.id == report_id).first())
-    if report is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Report is not found"
-        )
-    document = await run_in_threadpool(lambda: db.query(Document).filter(Document.id == report.document_id).first())
-    if document.owner_id != user_data.user_id:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Report is not found"
-        )
-    
-    result: PyMuPdfPartialReportJson = await service_report_based_search(report, s3_client)
+    return messages, evidence_items, packing
 
+def get_report_search_messages(prompt: str, search_text: str, report_obj: PyMuPdfPartialReportJson) -> list[dict]:
     content = [ 
         {"type": "text", "text": search_text},
     ]
 
-    for page in result.pages:
+    for page in report_obj.pages:
         content.append({
             "type": "image_url",
             "image_url": {
@@ -287,42 +412,212 @@ async def report_based_search(prompt: str, search_text: str, report_id: int, use
             },
         })
 
-    messages = [
+    return [
         {"role": "system", "content": prompt},
         {"role": "user", "content": content}
     ]
 
-    # print(content)
+def get_pure_llm_messages(prompt: str, search_text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": search_text}
+    ]
+
+def get_points_sources(points) -> list[dict]:
+    return [
+        {"report_id": point.payload.get("report_id"), "document_id": point.payload.get("document_id"), "label": point.payload.get("label")}
+        for point in points
+    ]
+
+# [(label, text), (text)]
+#https://huggingface.co/Qwen/Qwen2.5-7B-Instruct
+@router.get("/report_points_based_search", dependencies=[Depends(require_models_ready), Depends(profile_request)])
+async def report_points_based_search(prompt: str, search_text: str, report_id: int, user_data: AuthUserData, qdrant_client: QdrantClient, open_ai_client: OpenAIClient,  db: DbSession, label: str | None = None, use_cache: bool = True):
+    await get_owned_report(report_id, user_data, db)
+
+    result = await service_report_points_based_search(search_text, report_id, label, qdrant_client)
+
+    messages, evidence_items, packing = await run_in_threadpool(get_points_search_messages, prompt, search_text, result.points)
+
+    result = await get_completion(messages, open_ai_client, db, use_cache)
+
+    return {"result": result, "items": evidence_items, "packing": packing}
+
+@router.get("/report_points_based_search_stream", dependencies=[Depends(require_models_ready)])
+async def report_points_based_search_stream(prompt: str, search_text: str, report_id: int, user_data: AuthUserData, qdrant_client: QdrantClient, open_ai_client: OpenAIClient,  db: DbSession, label: str | None = None, use_cache: bool = True):
+    await get_owned_report(report_id, user_data, db)
+
+    result = await service_report_points_based_search(search_text, report_id, label, qdrant_client)
+
+    messages, evidence_items, packing = await run_in_threadpool(get_points_search_messages, prompt, search_text, result.points)
+
+    return StreamingResponse(
+        stream_search_events(messages, {"items": evidence_items, "packing": packing}, open_ai_client, db, use_cache),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+async def stream_batch_search_events(request: BatchSearchRequest, responses: list, open_ai_client) -> AsyncIterator[str]:
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(config.batch_search_llm_concurrency)
+
+    async def answer(index: int, question: str, points: list):
+        try:
+            messages, evidence_items, packing = await run_in_threadpool(get_points_search_messages, request.prompt, question, points)
+            async with semaphore:
+                # every concurrent answer needs its own session, sessions are not safe to share between threads
+                with SessionLocal() as db:
+                    result = await get_completion(messages, open_ai_client, db, request.use_cache)
+            await queue.put(sse_event("result", {"index": index, "question": question, "result": result, "items": evidence_items, "packing": packing}))
+        except Exception as e:
+            logging.exception(f"Error while answering batch question {index} \n {e}")
+            await queue.put(sse_event("error", {"index": index, "question": question, "detail": "Answer generation failed"}))
+
+    async def rerank_and_answer():
+        tasks = []
+        try:
+            # the candidates of a chunk of questions are scored in one model call, answers of earlier chunks are generated meanwhile
+            chunk_size = config.batch_search_rerank_questions
+            for start in range(0, len(request.questions), chunk_size):
+                questions = request.questions[start:start + chunk_size]
+                rankings = await rerank_points_batch(questions, [response.points for response in responses[start:start + chunk_size]])
+                for offset, (question, points) in enumerate(zip(questions, rankings)):
+                    index = start + offset
+                    if isinstance(points, Exception):
+                        logging.error(f"Error while reranking batch question {index} \n {points}")
+                        await queue.put(sse_event("error", {"index": index, "question": question, "detail": "Reranking failed"}))
+                        continue
+                    tasks.append(asyncio.create_task(answer(index, question, points)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await queue.put(None)
+
+    producer = asyncio.create_task(rerank_and_answer())
+    try:
+        while (event := await queue.get()) is not None:
+            yield event
+        await producer
+        yield sse_event("done", {"questions": len(request.questions)})
+    except Exception as e:
+        logging.exception(f"Error while processing batch search \n {e}")
+        yield sse_event("error", {"detail": "Batch search failed"})
+    finally:
+        producer.cancel()
+
+@router.post("/report_points_based_search_batch", dependencies=[Depends(require_models_ready)])
+async def report_points_based_search_batch(request: BatchSearchRequest, user_data: AuthUserData, qdrant_client: QdrantClient, open_ai_client: OpenAIClient, db: DbSession):
+    if not 0 < len(request.questions) <= config.batch_search_max_questions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch search supports 1 to {config.batch_search_max_questions} questions"
+        )
+
+    await get_owned_report(request.report_id, user_data, db)
+
+    responses = await service_report_points_based_search_batch(request.questions, request.report_id, request.label, qdrant_client)
 
-    response = await open_ai_client.chat.completions.create(
-        model=config.open_ai_model_name,
-        messages=messages,
-        temperature=0,
-        max_tokens=4096
+    return StreamingResponse(
+        stream_batch_search_events(request, responses, open_ai_client),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
 
-    result = response.choices[0].message.content
+@router.get("/library_points_based_search", dependencies=[Depends(require_models_ready), Depends(profile_request)])
+async def library_points_based_search(prompt: str, search_text: str, user_data: AuthUserData, qdrant_client: QdrantClient, open_ai_client: OpenAIClient, db: DbSession, document_ids: list[int] | None = Query(default=None), labels: list[str] | None = Query(default=None), use_cache: bool = True):
+    report_ids = await get_owned_report_ids(document_ids, user_data, db)
+
+    result = await service_library_points_based_search(search_text, report_ids, labels, qdrant_client)
+
+    messages, evidence_items, packing = await run_in_threadpool(get_points_search_messages, prompt, search_text, result.points)
+
+    result_text = await get_completion(messages, open_ai_client, db, use_cache)
+
+    return {"result": result_text, "items": evidence_items, "sources": get_points_sources(result.points), "packing": packing}
+
+@router.get("/library_points_based_search_stream", dependencies=[Depends(require_models_ready)])
+async def library_points_based_search_stream(prompt: str, search_text: str, user_data: AuthUserData, qdrant_client: QdrantClient, open_ai_client: OpenAIClient, db: DbSession, document_ids: list[int] | None = Query(default=None), labels: list[str] | None = Query(default=None), use_cache: bool = True):
+    report_ids = await get_owned_report_ids(document_ids, user_data, db)
+
+    result = await service_library_points_based_search(search_text, report_ids, labels, qdrant_client)
+
+    messages, evidence_items, packing = await run_in_threadpool(get_points_search_messages, prompt, search_text, result.points)
+
+    return StreamingResponse(
+        stream_search_events(messages, {"items": evidence_items, "sources": get_points_sources(result.points), "packing": packing}, open_ai_client, db, use_cache),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@router.get("/report_based_search", dependencies=[Depends(profile_request)])
+async def report_based_search(prompt: str, search_text: str, report_id: int, user_data: AuthUserData, s3_client: S3Client, open_ai_client: OpenAIClient, db: DbSession, use_cache: bool = True):
+    report = await get_owned_report(report_id, user_data, db)
+    
+    result: PyMuPdfPartialReportJson = await service_report_based_search(report, s3_client)
+
+    messages = get_report_search_messages(prompt, search_text, result)
+
+    result = await get_completion(messages, open_ai_client, db, use_cache)
 
     return {"message": result}
 
+@router.get("/report_based_search_stream")
+async def report_based_search_stream(prompt: str, search_text: str, report_id: int, user_data: AuthUserData, s3_client: S3Client, open_ai_client: OpenAIClient, db: DbSession, use_cache: bool = True):
+    report = await get_owned_report(report_id, user_data, db)
+    
+    result: PyMuPdfPartialReportJson = await service_report_based_search(report, s3_client)
 
-@router.get("/pure_llm_search")
-async def pure_llm_search(prompt: str, search_text: str, user_data: AuthUserData, open_ai_client: OpenAIClient):
+    messages = get_report_search_messages(prompt, search_text, result)
 
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": search_text}
-    ]
+    return StreamingResponse(
+        stream_search_events(messages, {"pages": [page.page_number for page in result.pages]}, open_ai_client, db, use_cache),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+@router.get("/pure_llm_search", dependencies=[Depends(profile_request)])
+async def pure_llm_search(prompt: str, search_text: str, user_data: AuthUserData, open_ai_client: OpenAIClient, db: DbSession, use_cache: bool = True):
+
+    messages = get_pure_llm_messages(prompt, search_text)
+
+    result = await get_completion(messages, open_ai_client, db, use_cache)
 
-    # print(prompt + "\n" + search_text)
+    return {"message": result}
+
+@router.get("/pure_llm_search_stream")
+async def pure_llm_search_stream(prompt: str, search_text: str, user_data: AuthUserData, open_ai_client: OpenAIClient, db: DbSession, use_cache: bool = True):
+
+    messages = get_pure_llm_messages(prompt, search_text)
 
-    response = await open_ai_client.chat.completions.create(
-        model=config.open_ai_model_name,
-        messages=messages,
-        temperature=0,
-        max_tokens=4096
+    return StreamingResponse(
+        stream_search_events(messages, None, open_ai_client, db, use_cache),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
 
-    result = response.choices[0].message.content
+@router.get("/llm_cache_stats")
+def get_llm_cache_stats(user_data: AuthUserData) -> dict[str, int]:
+    return llm_cache_stats
+
+@router.get("/admission_stats")
+def get_admission_stats(user_data: AuthUserData) -> dict[str, dict]:
+    return {name: limiter.stats() for name, limiter in admission_limiters.items()}
+
+@router.get("/processing_stats")
+def get_processing_run_stats(user_data: AuthUserData, db: DbSession, pipeline: str | None = None, window_hours: float = Query(default=config.processing_stats_window_hours, gt=0)) -> dict[str, dict]:
+    # the users that may profile see the runs of everyone for capacity planning, the others only their own
+    owner_id = None if user_data.username in config.profiling_users else user_data.user_id
+    return get_processing_stats(window_hours, pipeline, owner_id, db)
+
+@router.get("/processing_runs/{id}")
+def get_processing_runs(id: int, user_data: AuthUserData, db: DbSession, limit: int = Query(default=20, ge=1, le=100)) -> list[dict]:
+    document = db.query(Document).filter(Document.id == id).first()
+    if document is None or document.owner_id != user_data.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document is not found"
+        )
 
-    return {"message": result}
\ No newline at end of file
+    return get_document_processing_runs(document.id, limit, db)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from fastapi import HTTPException, status
+
+from app.core.config import config
+
+# set by the auth dependency, so services can be fair per user without passing the user around
+current_user_id: ContextVar[int | None] = ContextVar("current_user_id", default=None)
+
+class AdmissionLimiter:
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, per_user_limit: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.per_user_limit = per_user_limit
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.user_counts: dict[int, int] = defaultdict(int)
+        self.waiting = 0
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def reject(self, reason: str):
+        self.rejected += 1
+        logging.info(f"Rejecting {self.name} request, {reason}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many {self.name} requests, try again later",
+            headers={"Retry-After": str(config.admission_retry_after_seconds)}
+        )
+
+    @asynccontextmanager
+    async def acquire(self, shed: bool = True):
+        # shed=False is for work that was already admitted as part of a bigger job,
+        # it waits for its turn instead of failing halfway through
+        user_id = current_user_id.get()
+
+        if shed:
+            if self.waiting >= self.queue_size:
+                self.reject("queue is full")
+            if user_id is not None and self.user_counts[user_id] >= self.per_user_limit:
+                self.reject(f"user {user_id} is over its limit")
+
+        if user_id is not None:
+            self.user_counts[user_id] += 1
+
+        try:
+            self.waiting += 1
+            start = time.monotonic()
+            try:
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+
+            wait_seconds = time.monotonic() - start
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+            self.admitted += 1
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+                self.semaphore.release()
+        finally:
+            if user_id is not None:
+                self.user_counts[user_id] -= 1
+                if self.user_counts[user_id] == 0:
+                    del self.user_counts[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "average_wait_seconds": self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds
+        }
+
+admission_limiters = {
+    "processing": AdmissionLimiter("processing", config.processing_concurrency, config.processing_queue_size, config.admission_per_user_limit),
+    "embedding": AdmissionLimiter("embedding", config.embedding_concurrency, config.embedding_queue_size, config.admission_per_user_limit),
+    "reranker": AdmissionLimiter("reranker", config.reranker_concurrency, config.reranker_queue_size, config.admission_per_user_limit),
+    "pager": AdmissionLimiter("pager", config.pager_concurrency, config.parser_queue_size, config.admission_per_user_limit),
+    "mineru": AdmissionLimiter("mineru", config.mineru_concurrency, config.parser_queue_size, config.admission_per_user_limit),
+    "openai": AdmissionLimiter("openai", config.openai_concurrency, config.openai_queue_size, config.admission_per_user_limit),
+}
@@ -24,5 +24,88 @@ class Config(BaseSettings):
     embedding_text_size: int = 500
     embedding_text_overlap: int = 100
     reranker_model_path: str = ""
+    inference_backend: str = "auto"
+    inference_quantization: str = "none"
+    inference_threads: int = 0
+    onnx_quantization_config: str = "avx512_vnni"
+    inference_accuracy_check: bool = False
+    inference_min_cosine: float = 0.99
+    memory_cuda_high_water_ratio: float = 0.85
+    memory_rss_high_water_bytes: int = 0
+    memory_idle_seconds: int = 30
+    memory_idle_check_seconds: int = 10
+    embedding_coarse_size: int = 128
+    search_prefetch_multiplier: int = 4
+    rerank_min_candidates: int = 10
+    rerank_max_candidates: int = 50
+    rerank_score_window: float = 0.2
+    rerank_skip_margin: float = 0.2
+    rerank_text_batch_size: int = 16
+    rerank_image_batch_size: int = 4
+    rerank_time_budget_seconds: float = 0
+    document_list_approximate_count_limit: int = 1000
+    bulk_delete_max_documents: int = 500
+    password_hash_workers: int = 2
+    password_hash_queue_size: int = 32
+    password_hash_retry_after_seconds: int = 1
+    processing_concurrency: int = 4
+    processing_queue_size: int = 16
+    embedding_concurrency: int = 1
+    embedding_queue_size: int = 32
+    reranker_concurrency: int = 1
+    reranker_queue_size: int = 32
+    pager_concurrency: int = 2
+    mineru_concurrency: int = 1
+    parser_queue_size: int = 16
+    openai_concurrency: int = 8
+    openai_queue_size: int = 64
+    admission_per_user_limit: int = 8
+    admission_retry_after_seconds: int = 5
+    reconcile_interval_seconds: int = 0
+    reconcile_grace_seconds: int = 3600
+    reconcile_dry_run: bool = False
+    processing_timeout_seconds: int = 7200
+    presigned_url_safety_margin_seconds: int = 600
+    presigned_url_cache_max_entries: int = 100000
+    document_url_mode: str = "presigned"
+    document_content_base_url: str = ""
+    library_search_group_limit: int = 10
+    library_search_candidates: int = 50
+    library_search_max_batch: int = 64
+    batch_search_max_questions: int = 200
+    batch_search_encode_batch_size: int = 32
+    batch_search_llm_concurrency: int = 4
+    batch_search_rerank_questions: int = 16
+    llm_context_tokens: int = 32768
+    llm_max_output_tokens: int = 4096
+    llm_chars_per_token: int = 4
+    llm_image_pixels_per_token: int = 28 * 28
+    llm_image_max_pixels: int = 512 * 512
+    llm_min_truncated_tokens: int = 64
+    llm_cache_enabled: bool = True
+    llm_cache_ttl_seconds: int = 86400
+    llm_cache_max_bytes: int = 64 * 1024 * 1024
+    llm_cache_evict_interval_seconds: int = 60
+    llm_cache_touch_interval_seconds: int = 300
+    processing_stats_window_hours: int = 24 * 7
+    profiling_users: list[str] = []
+    profiling_interval_seconds: float = 0.005
+    loop_lag_interval_seconds: float = 0.1
+    loop_block_threshold_seconds: float = 0.25
+    loop_lag_window: int = 3000
+    inference_executor_workers: int = 1
+    inference_executor_queue_size: int = 64
+    pdf_executor_workers: int = 2
+    pdf_executor_queue_size: int = 16
+    cpu_executor_workers: int = 4
+    cpu_executor_queue_size: int = 64
+    io_executor_workers: int = 32
+    io_executor_queue_size: int = 256
+    checkpoint_upsert_batch_size: int = 256
+    page_fingerprint_dpi: int = 36
+    # empty loads the models in every worker, otherwise the unix socket of app.core.model_server
+    model_server_socket: str = ""
+    model_server_connect_timeout_seconds: int = 300
+    model_server_shared_memory_min_bytes: int = 64 * 1024
 
 config = Config()
\ No newline at end of file
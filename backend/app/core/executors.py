@@ -0,0 +1,102 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import torch
+
+from app.core.config import config
+
+class WorkExecutor:
+    # one lane per kind of work, so a long ingest can not take the threads a search needs
+
+    def __init__(self, name: str, workers: int, queue_size: int, processes: bool = False):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.processes = processes
+        self.executor: Executor | None = None
+        # callers over the limit wait here instead of piling up in the executor queue
+        self.slots = asyncio.Semaphore(workers + queue_size)
+        self.waiting = 0
+        self.pending = 0
+        self.completed = 0
+        self.total_seconds = 0.0
+
+    def start(self) -> None:
+        if self.processes:
+            # spawn instead of fork, the parent holds cuda contexts and model threads
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        logging.info(f"Started {self.name} executor with {self.workers} workers")
+
+    def stop(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, function, *args, **kwargs):
+        if self.executor is None:
+            raise RuntimeError(f"{self.name} executor is not started")
+
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.pending += 1
+        start = time.monotonic()
+        try:
+            if self.processes:
+                call = functools.partial(function, *args, **kwargs)
+            else:
+                # threads keep the caller's context vars like run_in_threadpool does
+                call = functools.partial(contextvars.copy_context().run, function, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.total_seconds += time.monotonic() - start
+            self.slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "processes": self.processes,
+            "pending": self.pending,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "average_seconds": self.total_seconds / self.completed if self.completed else 0.0
+        }
+
+executors = {
+    # model calls, one worker keeps the accelerator from being time sliced between requests
+    "inference": WorkExecutor("inference", config.inference_executor_workers, config.inference_executor_queue_size),
+    # pdf rendering and outlining, self contained jobs that hold the gil for long
+    "pdf": WorkExecutor("pdf", config.pdf_executor_workers, config.pdf_executor_queue_size, processes=True),
+    # in-process cpu work on objects that can not cheaply leave the process, e.g. decoded images
+    "cpu": WorkExecutor("cpu", config.cpu_executor_workers, config.cpu_executor_queue_size),
+    # s3 and database calls
+    "io": WorkExecutor("io", config.io_executor_workers, config.io_executor_queue_size),
+}
+
+def start_executors() -> None:
+    for executor in executors.values():
+        executor.start()
+
+def stop_executors() -> None:
+    for executor in executors.values():
+        executor.stop()
+
+def call_in_inference_mode(function, *args, **kwargs):
+    # entered in the worker thread, inference mode is thread local
+    with torch.inference_mode():
+        return function(*args, **kwargs)
+
+async def run_inference(function, *args, **kwargs):
+    return await executors["inference"].run(call_in_inference_mode, function, *args, **kwargs)
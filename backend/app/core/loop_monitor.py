@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from app.core.config import config
+from app.core.metrics import blocking_calls, loop_lag_seconds
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STACK_LIMIT = 20
+
+loop_stats = {
+    "lag_samples": deque(maxlen=config.loop_lag_window),
+    "max_lag_seconds": 0.0,
+    "blocked": 0,
+    "offenders": {}
+}
+
+# the watchdog thread adds offenders while the loop and the endpoint read them
+offenders_lock = threading.Lock()
+
+last_tick = time.monotonic()
+# the offender seen by the watchdog while the loop is still blocked, the loop charges the full lag to it
+blocking_offender: str | None = None
+
+def get_offender(frame) -> str:
+    # the innermost frame of our own code is the call to fix, library frames below it are just where it spends the time
+    current = frame
+    while current is not None:
+        if current.f_code.co_filename.startswith(APP_DIR):
+            return f"{os.path.relpath(current.f_code.co_filename, APP_DIR)}:{current.f_lineno} {current.f_code.co_name}"
+        current = current.f_back
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+
+def record_offender(frame, blocked_seconds: float) -> None:
+    global blocking_offender
+
+    offender = get_offender(frame)
+    stack = traceback.format_stack(frame)[-STACK_LIMIT:]
+    with offenders_lock:
+        stats = loop_stats["offenders"].get(offender)
+        if stats is None:
+            stats = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "stack": []}
+            loop_stats["offenders"][offender] = stats
+        stats["count"] += 1
+        stats["stack"] = stack
+        loop_stats["blocked"] += 1
+    blocking_calls.labels(offender).inc()
+    blocking_offender = offender
+    logging.warning(f"Event loop blocked for over {blocked_seconds:.3f}s in {offender}")
+
+def watch_loop(loop_thread_id: int, stopped: threading.Event) -> None:
+    reported_tick = None
+    while not stopped.wait(config.loop_block_threshold_seconds / 2):
+        tick = last_tick
+        blocked_seconds = time.monotonic() - tick - config.loop_lag_interval_seconds
+        if blocked_seconds < config.loop_block_threshold_seconds or tick == reported_tick:
+            continue
+        frame = sys._current_frames().get(loop_thread_id)
+        if frame is None:
+            continue
+        # one capture per blocked step, the stack does not change while the loop is stuck
+        reported_tick = tick
+        record_offender(frame, blocked_seconds)
+
+def record_lag(lag: float) -> None:
+    global blocking_offender
+
+    loop_stats["lag_samples"].append(lag)
+    loop_stats["max_lag_seconds"] = max(loop_stats["max_lag_seconds"], lag)
+    loop_lag_seconds.observe(lag)
+
+    offender = blocking_offender
+    if offender is not None:
+        blocking_offender = None
+        with offenders_lock:
+            stats = loop_stats["offenders"][offender]
+            stats["total_seconds"] += lag
+            stats["max_seconds"] = max(stats["max_seconds"], lag)
+
+def get_offenders() -> list[tuple[str, dict]]:
+    with offenders_lock:
+        return [(offender, dict(stats)) for offender, stats in loop_stats["offenders"].items()]
+
+async def run_loop_monitor() -> None:
+    global last_tick
+
+    last_tick = time.monotonic()
+    stopped = threading.Event()
+    watchdog = threading.Thread(target=watch_loop, args=(threading.get_ident(), stopped), name="loop-watchdog", daemon=True)
+    watchdog.start()
+    try:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(config.loop_lag_interval_seconds)
+            last_tick = time.monotonic()
+            record_lag(max(0.0, last_tick - start - config.loop_lag_interval_seconds))
+    finally:
+        stopped.set()
@@ -0,0 +1,71 @@
+import asyncio
+import gc
+import logging
+import time
+import psutil
+import torch
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import config
+
+memory_stats = {
+    "compactions": 0,
+    "idle_compactions": 0,
+    "skipped_compactions": 0,
+    "last_compaction_seconds": 0.0
+}
+
+last_activity = time.monotonic()
+compacted_since_activity = True
+
+def get_memory_usage() -> dict[str, int]:
+    usage = {
+        "process_rss_bytes": psutil.Process().memory_info().rss
+    }
+    if torch.cuda.is_available():
+        usage["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+        usage["cuda_reserved_bytes"] = torch.cuda.memory_reserved()
+        usage["cuda_max_allocated_bytes"] = torch.cuda.max_memory_allocated()
+        usage["cuda_total_bytes"] = torch.cuda.get_device_properties(0).total_memory
+    return usage
+
+def is_above_high_water(usage: dict[str, int]) -> bool:
+    if usage["process_rss_bytes"] >= config.memory_rss_high_water_bytes > 0:
+        return True
+    if "cuda_total_bytes" in usage:
+        return usage["cuda_reserved_bytes"] >= usage["cuda_total_bytes"] * config.memory_cuda_high_water_ratio
+    return False
+
+def compact_memory() -> None:
+    start = time.monotonic()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    memory_stats["compactions"] += 1
+    memory_stats["last_compaction_seconds"] = round(time.monotonic() - start, 4)
+
+def release_memory() -> None:
+    # blocking, callers on the event loop run it in the cpu executor
+    # the caching allocator keeps freed blocks for the next call, they are only
+    # handed back to the driver when memory is actually getting tight
+    global last_activity, compacted_since_activity
+    last_activity = time.monotonic()
+    compacted_since_activity = False
+
+    if is_above_high_water(get_memory_usage()):
+        compact_memory()
+    else:
+        memory_stats["skipped_compactions"] += 1
+
+async def run_memory_manager() -> None:
+    global compacted_since_activity
+    while True:
+        await asyncio.sleep(config.memory_idle_check_seconds)
+        if compacted_since_activity or time.monotonic() - last_activity < config.memory_idle_seconds:
+            continue
+        try:
+            await run_in_threadpool(compact_memory)
+            memory_stats["idle_compactions"] += 1
+            compacted_since_activity = True
+        except Exception as e:
+            logging.exception(f"Error while compacting memory \n {e}")
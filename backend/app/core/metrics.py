@@ -0,0 +1,175 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# with several uvicorn workers each one keeps its own metrics, a scrape only reaches one of them.
+# setting PROMETHEUS_MULTIPROC_DIR to an empty directory makes the workers write their metrics
+# there and /metrics aggregates the files of all of them. prometheus_client reads it on import,
+# so it is set in the environment of the server, not in the .env file
+MULTIPROCESS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 2400)
+
+stage_seconds = Histogram(
+    "document_index_stage_seconds",
+    "Time spent in each stage of the processing and search pipelines",
+    ["pipeline", "stage"],
+    buckets=STAGE_BUCKETS
+)
+
+stage_failures = Counter(
+    "document_index_stage_failures_total",
+    "Stages that raised an exception",
+    ["pipeline", "stage"]
+)
+
+bytes_moved = Counter(
+    "document_index_bytes_total",
+    "Bytes moved between the service and its dependencies",
+    ["pipeline", "target", "direction"]
+)
+
+points_processed = Counter(
+    "document_index_points_total",
+    "Points created by processing pipelines or returned by searches",
+    ["pipeline", "stage"]
+)
+
+batch_sizes = Histogram(
+    "document_index_batch_size",
+    "Number of items sent to a model or a store in one call",
+    ["operation"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+)
+
+cache_requests = Counter(
+    "document_index_cache_requests_total",
+    "Lookups in the in-process caches",
+    ["cache", "result"]
+)
+
+loop_lag_seconds = Histogram(
+    "document_index_event_loop_lag_seconds",
+    "Delay between when the loop monitor should wake up and when it did",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+blocking_calls = Counter(
+    "document_index_blocking_calls_total",
+    "Coroutine steps that blocked the event loop over the threshold, by the code that was running",
+    ["location"]
+)
+
+threadpool_tokens = Gauge(
+    "document_index_threadpool_tokens",
+    "Default anyio threadpool capacity and usage",
+    ["state"],
+    multiprocess_mode="livesum"
+)
+
+# set while a document is processed, stages and counts end up in its processing_run row
+processing_run_stats: ContextVar[dict | None] = ContextVar("processing_run_stats", default=None)
+
+def add_run_count(key: str, value: int) -> None:
+    stats = processing_run_stats.get()
+    if stats is not None:
+        stats[key] = (stats.get(key) or 0) + value
+
+@contextmanager
+def track_stage(pipeline: str, stage: str):
+    started_at = datetime.now()
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        stage_failures.labels(pipeline, stage).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stage_seconds.labels(pipeline, stage).observe(seconds)
+        stats = processing_run_stats.get()
+        if stats is not None:
+            stats["stages"].append({
+                "stage": stage,
+                "started_at": started_at.isoformat(),
+                "ended_at": datetime.now().isoformat(),
+                "seconds": seconds,
+                "failed": failed
+            })
+
+class StatsCollector:
+    # exports the counters kept as plain dicts next to the components that own them
+
+    def collect(self):
+        from app.core.admission import admission_limiters
+        from app.core.executors import executors
+        from app.core.memory import get_memory_usage, memory_stats
+        from app.core.password_hashing import password_hash_stats
+        from app.services.llm_service import llm_cache_stats
+
+        llm_cache = CounterMetricFamily("document_index_llm_cache_requests", "LLM answer cache lookups", labels=["result"])
+        for result in ["hits", "misses", "bypassed"]:
+            llm_cache.add_metric([result], llm_cache_stats[result])
+        yield llm_cache
+
+        admission_active = GaugeMetricFamily("document_index_admission_active", "Admitted requests per resource", labels=["resource"])
+        admission_waiting = GaugeMetricFamily("document_index_admission_waiting", "Queued requests per resource", labels=["resource"])
+        admission_rejected = CounterMetricFamily("document_index_admission_rejected", "Requests shed per resource", labels=["resource"])
+        admission_wait = GaugeMetricFamily("document_index_admission_average_wait_seconds", "Average queue wait per resource", labels=["resource"])
+        for name, limiter in admission_limiters.items():
+            stats = limiter.stats()
+            admission_active.add_metric([name], stats["active"])
+            admission_waiting.add_metric([name], stats["waiting"])
+            admission_rejected.add_metric([name], stats["rejected"])
+            admission_wait.add_metric([name], stats["average_wait_seconds"])
+        yield admission_active
+        yield admission_waiting
+        yield admission_rejected
+        yield admission_wait
+
+        executor_pending = GaugeMetricFamily("document_index_executor_pending", "Calls running or queued in each executor", labels=["executor"])
+        executor_waiting = GaugeMetricFamily("document_index_executor_waiting", "Calls waiting for a free executor slot", labels=["executor"])
+        for name, executor in executors.items():
+            executor_pending.add_metric([name], executor.pending)
+            executor_waiting.add_metric([name], executor.waiting)
+        yield executor_pending
+        yield executor_waiting
+
+        memory = GaugeMetricFamily("document_index_memory_bytes", "Process and accelerator memory", labels=["kind"])
+        for kind, value in get_memory_usage().items():
+            memory.add_metric([kind], value)
+        yield memory
+
+        compactions = CounterMetricFamily("document_index_memory_compactions", "Memory compactions", labels=["kind"])
+        compactions.add_metric(["high_water"], memory_stats["compactions"] - memory_stats["idle_compactions"])
+        compactions.add_metric(["idle"], memory_stats["idle_compactions"])
+        yield compactions
+
+        password_hashing = GaugeMetricFamily("document_index_password_hash_pending", "Password hashing calls waiting or running")
+        password_hashing.add_metric([], password_hash_stats["pending"])
+        yield password_hashing
+
+        password_rejected = CounterMetricFamily("document_index_password_hash_rejected", "Password hashing calls rejected because the queue was full")
+        password_rejected.add_metric([], password_hash_stats["rejected"])
+        yield password_rejected
+
+REGISTRY.register(StatsCollector())
+
+def get_metrics_registry() -> CollectorRegistry:
+    if not MULTIPROCESS_DIR:
+        return REGISTRY
+    # the stats collector reads dicts of the answering worker only, it is left out so series do not jump between workers
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def mark_metrics_process_dead() -> None:
+    # the live gauges of a stopped worker must not be summed anymore
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,11 +1,232 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
 from typing import TypedDict
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from magika import Magika
+from PIL import Image
 from sentence_transformers import SentenceTransformer
 from sentence_transformers import CrossEncoder
+from sentence_transformers import export_dynamic_quantized_onnx_model
+import torch
+
+from app.core.config import config
+from app.core.model_client import SERVED_METHODS, ModelServerClient, RemoteModel
 
 class MLModels(TypedDict):
     magika: Magika
     embedding_model: SentenceTransformer
     reranker_model: CrossEncoder
 
-ml_models: MLModels = {}
\ No newline at end of file
+ml_models: MLModels = {}
+
+model_state = {
+    "ready": False,
+    "failed": False,
+    "phases": {}
+}
+
+MODELS_RETRY_AFTER_SECONDS = 10
+
+WARMUP_TEXTS = [
+    "What was the total revenue reported for the last fiscal year?",
+    " ".join(["Quarterly results improved compared to the previous period."] * 8),
+]
+
+def require_models_ready() -> None:
+    # model backed routes answer 503 instead of failing on a missing model while loading or after it failed
+    if not model_state["ready"]:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model loading failed" if model_state["failed"] else "Models are loading",
+            headers={"Retry-After": str(MODELS_RETRY_AFTER_SECONDS)}
+        )
+
+def get_warmup_image() -> Image.Image:
+    # a gradient instead of a blank image, so the processor does real resizing and patching work
+    image = Image.new("RGB", (512, 512))
+    image.putdata([(x % 256, y % 256, (x + y) % 256) for y in range(512) for x in range(512)])
+    return image
+
+ACCURACY_PAIRS = [
+    ("What was the total revenue?", "Total revenue for the year reached 4.2 billion dollars."),
+    ("What was the total revenue?", "The board approved a new remuneration policy."),
+    ("Who is the chief executive officer?", "The company is led by its chief executive officer, Jane Smith."),
+    ("Who is the chief executive officer?", "Figure 3 shows the regional breakdown of sales."),
+]
+
+def get_inference_device() -> str:
+    if config.inference_backend == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return "cuda" if config.inference_backend == "cuda" else "cpu"
+
+def is_bf16_supported(device: str) -> bool:
+    if device == "cuda":
+        return torch.cuda.is_bf16_supported()
+    # without native bf16 instructions cpu bf16 is emulated and slower than fp32, avx512 alone does not have them
+    return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+def load_exported_model(model_class, model_path: str):
+    model = model_class(model_path, backend=config.inference_backend, device="cpu")
+
+    if config.inference_quantization == "int8":
+        if config.inference_backend != "onnx":
+            logging.warning(f"int8 quantization is only supported for the onnx backend, {model_path} stays unquantized")
+            return model
+        file_name = f"onnx/model_qint8_{config.onnx_quantization_config}.onnx"
+        # the quantized export is written next to the model, later starts reuse it
+        if not (Path(model_path) / file_name).exists():
+            export_dynamic_quantized_onnx_model(model, config.onnx_quantization_config, model_path)
+        model = model_class(model_path, backend="onnx", device="cpu", model_kwargs={"file_name": file_name})
+
+    return model
+
+def load_model(model_class, model_path: str):
+    device = get_inference_device()
+
+    if config.inference_backend in ["onnx", "openvino"]:
+        try:
+            return load_exported_model(model_class, model_path)
+        except Exception as e:
+            logging.exception(f"Could not load {model_path} with {config.inference_backend} backend, falling back to torch \n {e}")
+            device = "cpu"
+
+    attn_implementation = "flash_attention_2" if device == "cuda" else "sdpa"
+    model = model_class(model_path, device=device, processor_kwargs={"max_pixels": 512 * 512},  model_kwargs={"attn_implementation": attn_implementation})
+
+    if config.inference_quantization == "bf16" and is_bf16_supported(device):
+        model = model.to(torch.bfloat16)
+    elif config.inference_quantization == "int8" and device == "cpu":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    return model
+
+def load_reference_model(model_class, model_path: str):
+    device = get_inference_device()
+    attn_implementation = "flash_attention_2" if device == "cuda" else "sdpa"
+    return model_class(model_path, device=device, processor_kwargs={"max_pixels": 512 * 512},  model_kwargs={"attn_implementation": attn_implementation})
+
+def load_embedding_model() -> SentenceTransformer:
+    return load_model(SentenceTransformer, config.embedding_model_path)
+
+def load_reranker_model() -> CrossEncoder:
+    return load_model(CrossEncoder, config.reranker_model_path)
+
+def check_inference_accuracy() -> dict:
+    texts = [text for pair in ACCURACY_PAIRS for text in pair]
+
+    with torch.inference_mode():
+        reference_embedding_model = load_reference_model(SentenceTransformer, config.embedding_model_path)
+        reference = reference_embedding_model.encode(texts, convert_to_tensor=True).float().cpu()
+        del reference_embedding_model
+        optimized = ml_models["embedding_model"].encode(texts, convert_to_tensor=True).float().cpu()
+        cosine = torch.nn.functional.cosine_similarity(reference, optimized, dim=1)
+
+        reference_reranker_model = load_reference_model(CrossEncoder, config.reranker_model_path)
+        reference_scores = torch.tensor(reference_reranker_model.predict(ACCURACY_PAIRS)).float()
+        del reference_reranker_model
+        optimized_scores = torch.tensor(ml_models["reranker_model"].predict(ACCURACY_PAIRS)).float()
+
+    # the ranking is what matters for search, so relevant pairs must still beat irrelevant ones
+    ranking_preserved = all(
+        (reference_scores[i] > reference_scores[i + 1]) == (optimized_scores[i] > optimized_scores[i + 1])
+        for i in range(0, len(ACCURACY_PAIRS), 2)
+    )
+
+    result = {
+        "embedding_min_cosine": round(cosine.min().item(), 5),
+        "reranker_max_score_difference": round((reference_scores - optimized_scores).abs().max().item(), 5),
+        "reranker_ranking_preserved": ranking_preserved,
+    }
+    result["passed"] = result["embedding_min_cosine"] >= config.inference_min_cosine and ranking_preserved
+
+    if result["passed"]:
+        logging.info(f"Inference accuracy check passed {result}")
+    else:
+        logging.error(f"Inference accuracy check failed {result}")
+    return result
+
+def warmup_models() -> None:
+    image = get_warmup_image()
+    with torch.inference_mode():
+        ml_models["embedding_model"].encode(WARMUP_TEXTS + [image], batch_size=1)
+        ml_models["reranker_model"].predict([(WARMUP_TEXTS[0], WARMUP_TEXTS[1]), (WARMUP_TEXTS[0], image)], batch_size=1)
+    ml_models["magika"].identify_bytes(b"%PDF-1.7\n")
+
+async def timed_phase(name: str, function, *args):
+    start = time.monotonic()
+    result = await run_in_threadpool(function, *args)
+    model_state["phases"][name] = round(time.monotonic() - start, 3)
+    logging.info(f"Startup phase {name} took {model_state['phases'][name]:.3f}s")
+    return result
+
+async def load_local_models() -> None:
+    start = time.monotonic()
+    if config.inference_threads > 0:
+        torch.set_num_threads(config.inference_threads)
+    try:
+        # loading is mostly file io and weight copies that release the gil, so the models load side by side
+        magika, embedding_model, reranker_model = await asyncio.gather(
+            timed_phase("load_magika", Magika),
+            timed_phase("load_embedding_model", load_embedding_model),
+            timed_phase("load_reranker_model", load_reranker_model),
+        )
+        ml_models["magika"] = magika
+        ml_models["embedding_model"] = embedding_model
+        ml_models["reranker_model"] = reranker_model
+
+        await timed_phase("warmup", warmup_models)
+
+        if config.inference_accuracy_check:
+            model_state["accuracy"] = await timed_phase("accuracy_check", check_inference_accuracy)
+            if not model_state["accuracy"]["passed"]:
+                # the optimized models answer differently, the unoptimized ones are served instead
+                logging.warning("Falling back to the reference models")
+                embedding_model, reranker_model = await asyncio.gather(
+                    timed_phase("load_reference_embedding_model", load_reference_model, SentenceTransformer, config.embedding_model_path),
+                    timed_phase("load_reference_reranker_model", load_reference_model, CrossEncoder, config.reranker_model_path),
+                )
+                ml_models["embedding_model"] = embedding_model
+                ml_models["reranker_model"] = reranker_model
+                await timed_phase("reference_warmup", warmup_models)
+                model_state["accuracy"]["fallback"] = True
+    except Exception as e:
+        model_state["failed"] = True
+        logging.exception(f"Error when loading models \n {e}")
+        return
+
+    model_state["ready"] = True
+    model_state["phases"]["total"] = round(time.monotonic() - start, 3)
+    logging.info(f"Models are ready after {model_state['phases']['total']:.3f}s")
+
+async def connect_model_server() -> None:
+    start = time.monotonic()
+    client = ModelServerClient(config.model_server_socket)
+    # the model server may still be loading, its ping only answers true once the models are warm
+    while True:
+        try:
+            if await run_in_threadpool(client.call, "server", "ping"):
+                break
+        except OSError:
+            pass
+        if time.monotonic() - start > config.model_server_connect_timeout_seconds:
+            model_state["failed"] = True
+            logging.error(f"Model server on {config.model_server_socket} was not ready after {config.model_server_connect_timeout_seconds}s")
+            return
+        await asyncio.sleep(1)
+
+    for name in SERVED_METHODS:
+        ml_models[name] = RemoteModel(client, name)
+
+    model_state["ready"] = True
+    model_state["phases"]["connect_model_server"] = round(time.monotonic() - start, 3)
+    logging.info(f"Using models of the model server on {config.model_server_socket}")
+
+async def load_models() -> None:
+    # with a model server every worker shares its one copy of the models instead of loading its own
+    if config.model_server_socket:
+        await connect_model_server()
+    else:
+        await load_local_models()
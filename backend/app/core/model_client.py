@@ -0,0 +1,135 @@
+import functools
+import pickle
+import socket
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import torch
+
+from app.core.config import config
+
+HEADER = struct.Struct("!Q")
+
+# the only calls the model server runs, anything else is refused
+SERVED_METHODS = {
+    "embedding_model": {"encode"},
+    "reranker_model": {"predict"},
+    "magika": {"identify_bytes"},
+}
+
+class SharedArray:
+    # big results travel through shared memory, only the block name and layout go over the socket
+
+    def __init__(self, array: np.ndarray, is_tensor: bool):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        # the receiving process unlinks the block after copying, the server unlinks what a dead receiver left
+        resource_tracker.unregister(block._name, "shared_memory")
+        self.name = block.name
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.is_tensor = is_tensor
+        block.close()
+
+    def load(self):
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            array = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=block.buf).copy()
+        finally:
+            block.close()
+            block.unlink()
+        return torch.from_numpy(array) if self.is_tensor else array
+
+def unlink_shared(names: list[str]) -> None:
+    for name in names:
+        try:
+            block = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            # already copied and unlinked by the receiver
+            continue
+        resource_tracker.unregister(block._name, "shared_memory")
+        block.close()
+        block.unlink()
+
+def to_shared(result):
+    if isinstance(result, torch.Tensor):
+        tensor = result.detach().cpu()
+        # numpy has no bfloat16
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.float()
+        if tensor.numel() * tensor.element_size() >= config.model_server_shared_memory_min_bytes:
+            return SharedArray(tensor.numpy(), True)
+        return tensor
+    if isinstance(result, np.ndarray) and result.nbytes >= config.model_server_shared_memory_min_bytes:
+        return SharedArray(result, False)
+    return result
+
+def from_shared(result):
+    if isinstance(result, SharedArray):
+        return result.load()
+    return result
+
+def send_message(connection: socket.socket, message) -> None:
+    payload = pickle.dumps(message, protocol=5)
+    connection.sendall(HEADER.pack(len(payload)) + payload)
+
+def receive_exactly(connection: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Model server closed the connection")
+        received += count
+    return buffer
+
+def receive_message(connection: socket.socket):
+    size = HEADER.unpack(receive_exactly(connection, HEADER.size))[0]
+    return pickle.loads(receive_exactly(connection, size))
+
+class ModelServerClient:
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        # calls block, one connection per calling thread keeps requests from interleaving
+        self.local = threading.local()
+
+    def get_connection(self) -> socket.socket:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.socket_path)
+            except OSError:
+                connection.close()
+                raise
+            self.local.connection = connection
+        return connection
+
+    def call(self, model: str, method: str, *args, **kwargs):
+        connection = self.get_connection()
+        try:
+            send_message(connection, {"model": model, "method": method, "args": args, "kwargs": kwargs})
+            response = receive_message(connection)
+        except OSError:
+            connection.close()
+            self.local.connection = None
+            raise
+
+        if "error" in response:
+            raise RuntimeError(f"Model server failed {model}.{method}: {response['error']}")
+        return from_shared(response["result"])
+
+class RemoteModel:
+    # same call surface as the local model, so services do not know where inference runs
+
+    def __init__(self, client: ModelServerClient, name: str):
+        self.client = client
+        self.name = name
+
+    def __getattr__(self, method: str):
+        if method not in SERVED_METHODS[self.name]:
+            raise AttributeError(f"{self.name}.{method} is not served by the model server")
+        return functools.partial(self.client.call, self.name, method)
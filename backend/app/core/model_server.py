@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import pickle
+
+from app.core.config import config
+from app.core.executors import executors, run_inference
+from app.core.logging import setup_logging
+from app.core.memory import release_memory, run_memory_manager
+from app.core.ml_models import load_local_models, ml_models, model_state
+from app.core.model_client import HEADER, SERVED_METHODS, SharedArray, send_message, to_shared, unlink_shared
+
+# run next to the http workers with `python -m app.core.model_server`, the workers
+# get model_server_socket set and talk to this process instead of loading their own copies
+
+async def handle_request(request: dict):
+    if request["model"] == "server" and request["method"] == "ping":
+        return model_state["ready"]
+    if request["method"] not in SERVED_METHODS.get(request["model"], set()):
+        raise ValueError(f"{request['model']}.{request['method']} is not served")
+
+    function = getattr(ml_models[request["model"]], request["method"])
+    result = to_shared(await run_inference(function, *request["args"], **request["kwargs"]))
+    await executors["cpu"].run(release_memory)
+    return result
+
+class StreamConnection:
+    # lets the socket helpers of the client write to an asyncio stream
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    def sendall(self, data: bytes) -> None:
+        self.writer.write(data)
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    connection = StreamConnection(writer)
+    # blocks of the last response, calls on a connection are sequential so they are copied once the next request arrives
+    outstanding = []
+    try:
+        while True:
+            size = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+            unlink_shared(outstanding)
+            outstanding.clear()
+            request = await executors["cpu"].run(pickle.loads, await reader.readexactly(size))
+            try:
+                response = {"result": await handle_request(request)}
+            except Exception as e:
+                logging.exception(f"Error while serving {request.get('model')}.{request.get('method')} \n {e}")
+                response = {"error": f"{type(e).__name__}: {e}"}
+            if isinstance(response.get("result"), SharedArray):
+                outstanding.append(response["result"].name)
+            send_message(connection, response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        # a worker that died mid call never unlinks its blocks
+        unlink_shared(outstanding)
+        writer.close()
+
+async def serve() -> None:
+    setup_logging()
+    executors["inference"].start()
+    executors["cpu"].start()
+    memory_manager = asyncio.create_task(run_memory_manager())
+
+    await load_local_models()
+    if not model_state["ready"]:
+        raise RuntimeError("Model server could not load the models")
+
+    if os.path.exists(config.model_server_socket):
+        os.unlink(config.model_server_socket)
+    # only processes of the same user may call the models, the socket is created without group and other access
+    previous_umask = os.umask(0o077)
+    try:
+        server = await asyncio.start_unix_server(handle_connection, path=config.model_server_socket)
+    finally:
+        os.umask(previous_umask)
+    logging.info(f"Model server listening on {config.model_server_socket}")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        memory_manager.cancel()
+        executors["inference"].stop()
+        executors["cpu"].stop()
+
+if __name__ == "__main__":
+    asyncio.run(serve())
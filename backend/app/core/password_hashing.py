@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, status
+from pwdlib import PasswordHash
+
+from app.core.config import config
+
+# kept light on imports, spawned workers import this module to unpickle the hashing functions
+password_hash = PasswordHash.recommended()
+
+password_hash_executor: ProcessPoolExecutor | None = None
+
+password_hash_stats = {
+    "pending": 0,
+    "completed": 0,
+    "rejected": 0
+}
+
+def hash_password(password: str) -> str:
+    return password_hash.hash(password)
+
+def verify_password_hash(plain_password: str, hashed_password: str) -> bool:
+    return password_hash.verify(plain_password, hashed_password)
+
+def start_password_hash_executor() -> None:
+    global password_hash_executor
+    # spawn instead of fork, the parent holds cuda contexts and model threads
+    password_hash_executor = ProcessPoolExecutor(
+        max_workers=config.password_hash_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+    logging.info(f"Started password hashing executor with {config.password_hash_workers} workers")
+
+def stop_password_hash_executor() -> None:
+    global password_hash_executor
+    if password_hash_executor is not None:
+        password_hash_executor.shutdown(wait=False, cancel_futures=True)
+        password_hash_executor = None
+
+async def run_password_hashing(function, *args):
+    if password_hash_executor is None:
+        raise RuntimeError("Password hashing executor is not started")
+
+    if password_hash_stats["pending"] >= config.password_hash_queue_size:
+        password_hash_stats["rejected"] += 1
+        logging.info("Password hashing queue is full, rejecting request")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is busy, try again later",
+            headers={"Retry-After": str(config.password_hash_retry_after_seconds)}
+        )
+
+    password_hash_stats["pending"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_hash_executor, function, *args)
+    finally:
+        password_hash_stats["pending"] -= 1
+        password_hash_stats["completed"] += 1
@@ -19,14 +19,67 @@ QdrantClient = Annotated[AsyncQdrantClient, Depends(get_qdrant_client)]
 
 collection_name = "DocumentEmbedding"
 
+# Matryoshka embeddings keep most of their meaning in the leading dimensions,
+# so the truncated vector is used for the HNSW pass and the full one only rescores
+COARSE_VECTOR_NAME = "coarse"
+FULL_VECTOR_NAME = "full"
+FULL_VECTOR_SIZE = 512
+
+class QdrantSchemaError(RuntimeError):
+    # the collection can not serve this version, startup stops instead of failing every request
+    pass
+
+def get_point_vector(embedding) -> dict[str, list[float]]:
+    return {
+        COARSE_VECTOR_NAME: embedding[:config.embedding_coarse_size].tolist(),
+        FULL_VECTOR_NAME: embedding[:FULL_VECTOR_SIZE].tolist(),
+    }
+
+def get_two_stage_query(embedding, filter_condition: models.Filter, limit: int) -> dict:
+    return {
+        "prefetch": models.Prefetch(
+            query=embedding[:config.embedding_coarse_size].tolist(),
+            using=COARSE_VECTOR_NAME,
+            filter=filter_condition,
+            limit=limit * config.search_prefetch_multiplier,
+        ),
+        "query": embedding[:FULL_VECTOR_SIZE].tolist(),
+        "using": FULL_VECTOR_NAME,
+        "limit": limit,
+    }
+
 async def init_qdrant(qdrant_client: AsyncQdrantClient):
-    if not await qdrant_client.collection_exists(collection_name=collection_name):
+    if not 0 < config.embedding_coarse_size < FULL_VECTOR_SIZE:
+        raise QdrantSchemaError(f"embedding_coarse_size must be between 0 and {FULL_VECTOR_SIZE}, got {config.embedding_coarse_size}")
+
+    if await qdrant_client.collection_exists(collection_name=collection_name):
+        collection = await qdrant_client.get_collection(collection_name=collection_name)
+        vectors = collection.config.params.vectors
+        # points are written and searched with the named vectors, an older collection would fail every request
+        if not isinstance(vectors, dict) or set(vectors.keys()) != {COARSE_VECTOR_NAME, FULL_VECTOR_NAME}:
+            raise QdrantSchemaError(f"Collection {collection_name} does not have the {COARSE_VECTOR_NAME} and {FULL_VECTOR_NAME} vectors, delete it and reprocess the documents")
+        if vectors[COARSE_VECTOR_NAME].size != config.embedding_coarse_size:
+            raise QdrantSchemaError(f"Collection {collection_name} has {COARSE_VECTOR_NAME} vectors of size {vectors[COARSE_VECTOR_NAME].size}, embedding_coarse_size is {config.embedding_coarse_size}")
+    else:
         await qdrant_client.create_collection(
             collection_name=collection_name,
-            vectors_config=models.VectorParams(
-                size=512,
-                distance=models.Distance.COSINE
-            ),
+            vectors_config={
+                COARSE_VECTOR_NAME: models.VectorParams(
+                    size=config.embedding_coarse_size,
+                    distance=models.Distance.COSINE,
+                ),
+                # full vectors are only read for rescoring prefetched candidates,
+                # so they do not need a graph and can live on disk
+                FULL_VECTOR_NAME: models.VectorParams(
+                    size=FULL_VECTOR_SIZE,
+                    distance=models.Distance.COSINE,
+                    on_disk=True,
+                    hnsw_config=models.HnswConfigDiff(
+                        m=0,
+                        payload_m=0,
+                    ),
+                ),
+            },
             hnsw_config=models.HnswConfigDiff(
                 payload_m=16,
                 m=0,
@@ -51,3 +104,9 @@ async def init_qdrant(qdrant_client: AsyncQdrantClient):
             field_schema=models.PayloadSchemaType.INTEGER
         )
 
+    # added after the first collections were created, so it is ensured on existing ones too
+    await qdrant_client.create_payload_index(
+        collection_name=collection_name,
+        field_name="page",
+        field_schema=models.PayloadSchemaType.INTEGER
+    )
@@ -7,14 +7,17 @@ from types_boto3_s3.client import S3Client as ActualS3Client
 
 AWS_BUCKET = config.s3_bucket_name
 
-def get_s3_client():
-    s3_client = boto3.client(            
+def create_s3_client() -> ActualS3Client:
+    return boto3.client(            
         "s3",
         endpoint_url=config.s3_url,
         aws_access_key_id=config.s3_login,
         aws_secret_access_key=config.s3_password,
         config=Config(signature_version="s3v4")
     )
+
+def get_s3_client():
+    s3_client = create_s3_client()
     try:
         yield s3_client
     finally:
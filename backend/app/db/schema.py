@@ -1,6 +1,7 @@
 from typing import Annotated
 from fastapi import Depends
-from sqlalchemy import ForeignKey, String, create_engine 
+from datetime import datetime
+from sqlalchemy import JSON, ForeignKey, String, Text, create_engine 
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker, Session, relationship
 
 from app.core.config import config
@@ -31,7 +32,7 @@ class Document(Base):
     __tablename__ = "document"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    owner_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    owner_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     name: Mapped[str]
     status: Mapped[str]
     s3_filename: Mapped[str] = mapped_column(unique=True)
@@ -44,7 +45,63 @@ class Report(Base):
     __tablename__ = "report"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    document_id: Mapped[int] = mapped_column(ForeignKey("document.id"))
+    document_id: Mapped[int] = mapped_column(ForeignKey("document.id"), index=True)
     s3_filename: Mapped[str] = mapped_column(unique=True)
     tag: Mapped[str]
-    
\ No newline at end of file
+    
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache_entry"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str]
+    response: Mapped[str] = mapped_column(Text)
+    size: Mapped[int]
+    created_at: Mapped[datetime] = mapped_column(index=True)
+    last_used_at: Mapped[datetime] = mapped_column(index=True)
+
+
+class ProcessingRun(Base):
+    __tablename__ = "processing_run"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # runs outlive their document, they are the history used for capacity planning
+    document_id: Mapped[int | None] = mapped_column(ForeignKey("document.id", ondelete="SET NULL"), index=True)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
+    pipeline: Mapped[str] = mapped_column(String(30), index=True)
+    status: Mapped[str]
+    started_at: Mapped[datetime] = mapped_column(index=True)
+    finished_at: Mapped[datetime | None]
+    duration_seconds: Mapped[float | None]
+    input_bytes: Mapped[int | None]
+    page_count: Mapped[int | None]
+    point_count: Mapped[int | None]
+    error_class: Mapped[str | None] = mapped_column(String(200))
+    stages: Mapped[list] = mapped_column(JSON, default=list)
+
+
+class ProcessingCheckpoint(Base):
+    __tablename__ = "processing_checkpoint"
+
+    # one per report of an unfinished pager or mineru run, removed together with it once the run completes
+    report_id: Mapped[int] = mapped_column(ForeignKey("report.id"), primary_key=True)
+    document_id: Mapped[int] = mapped_column(ForeignKey("document.id"), index=True)
+    pipeline: Mapped[str] = mapped_column(String(30))
+    stage: Mapped[str] = mapped_column(String(30))
+    upserted_batches: Mapped[list] = mapped_column(JSON, default=list)
+    updated_at: Mapped[datetime]
+
+
+class ReportFingerprint(Base):
+    __tablename__ = "report_fingerprint"
+
+    # content hashes of the document pages the report was made from, indexed by page number
+    report_id: Mapped[int] = mapped_column(ForeignKey("report.id"), primary_key=True)
+    document_id: Mapped[int] = mapped_column(ForeignKey("document.id"), index=True)
+    pages: Mapped[list] = mapped_column(JSON)
+
+def create_added_indexes() -> None:
+    # create_all skips tables that already exist, indexes added to them later are created here
+    for table in [Document.__table__, Report.__table__]:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -1,21 +1,30 @@
+import asyncio
 from contextlib import asynccontextmanager
 import logging
-from fastapi import FastAPI
+import anyio
+from fastapi import Depends, FastAPI, HTTPException, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
-from magika import Magika
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from qdrant_client import AsyncQdrantClient
-from sentence_transformers import CrossEncoder
-from sentence_transformers import SentenceTransformer
-from torch import cuda
 
 from app.api import document_api
 from app.core.config import config
+from app.core.executors import executors, start_executors, stop_executors
 from app.core.logging import setup_logging
-from app.core.qdrant import init_qdrant
-from app.db.schema import Base, engine
-from app.core.ml_models import ml_models
+from app.core.loop_monitor import get_offenders, loop_stats, run_loop_monitor
+from app.core.memory import get_memory_usage, memory_stats, run_memory_manager
+from app.core.metrics import get_metrics_registry, mark_metrics_process_dead, threadpool_tokens
+from app.core.password_hashing import start_password_hash_executor, stop_password_hash_executor
+from app.core.qdrant import QdrantSchemaError, init_qdrant
+from app.db.schema import Base, create_added_indexes, engine
+from app.core.ml_models import load_models, ml_models, model_state, require_models_ready
 from app.api import auth_api
+from app.services.auth_service import AuthUserData
+from app.services.llm_service import run_llm_cache_evictor
+from app.services.processing_run_service import get_percentiles
+from app.services.reconcile_service import run_reconciler
 
 #https://github.com/Kludex/fastapi-tips/tree/main
 # Should rewrite model management later like here https://starlette.dev/lifespan/
@@ -24,6 +33,7 @@ async def lifespan(app: FastAPI):
     setup_logging()
     try:
         Base.metadata.create_all(bind=engine)
+        create_added_indexes()
     except Exception as e:
         logging.exception(f"Error when creating db models \n {e}")
 
@@ -34,19 +44,36 @@ async def lifespan(app: FastAPI):
         )
         await init_qdrant(qdrant_client)
         await qdrant_client.close()
+    except QdrantSchemaError:
+        raise
     except Exception as e:
         logging.exception(f"Error when creating qdrant collection \n {e}")
     
 
-    ml_models["magika"] = Magika()
-    ml_models["embedding_model"] = SentenceTransformer(config.embedding_model_path, processor_kwargs={"max_pixels": 512 * 512},  model_kwargs={"attn_implementation": "flash_attention_2"})
-    ml_models["reranker_model"] = CrossEncoder(config.reranker_model_path, processor_kwargs={"max_pixels": 512 * 512},  model_kwargs={"attn_implementation": "flash_attention_2"})
+    start_password_hash_executor()
+    start_executors()
 
-    if cuda.is_available():
-        ml_models["embedding_model"] = ml_models["embedding_model"].to('cuda')
-        ml_models["reranker_model"] = ml_models["reranker_model"].to("cuda")
+    # the server starts answering right away, /api/ready reports when the models are warm
+    model_loader = asyncio.create_task(load_models())
+    memory_manager = asyncio.create_task(run_memory_manager())
+    loop_monitor = asyncio.create_task(run_loop_monitor())
+    llm_cache_evictor = asyncio.create_task(run_llm_cache_evictor())
+
+    reconciler = None
+    if config.reconcile_interval_seconds > 0:
+        reconciler = asyncio.create_task(run_reconciler())
 
     yield
+
+    model_loader.cancel()
+    memory_manager.cancel()
+    loop_monitor.cancel()
+    llm_cache_evictor.cancel()
+    if reconciler is not None:
+        reconciler.cancel()
+    stop_password_hash_executor()
+    mark_metrics_process_dead()
+    stop_executors()
     ml_models.clear()
 
 app = FastAPI(title=config.app_name, lifespan=lifespan)
@@ -61,8 +88,51 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id", "X-Profile-Stacks-Url", "X-Profile-Trace-Url"],
 )
 
 # Register routes
 app.include_router(auth_api.router, prefix="/api", tags=["auth"])
-app.include_router(document_api.router, prefix="/api", tags=["document"])
\ No newline at end of file
+app.include_router(document_api.router, prefix="/api", tags=["document"])
+
+@app.get("/api/ready")
+def ready() -> dict:
+    require_models_ready()
+    return {"message": "ready", "phases": model_state["phases"], "accuracy": model_state.get("accuracy")}
+
+@app.get("/api/memory")
+def memory(user_data: AuthUserData) -> dict:
+    return {"usage": get_memory_usage(), "stats": memory_stats}
+
+def require_profiling_user(user_data: AuthUserData) -> None:
+    # internal load and code details, for the same users that may profile
+    if user_data.username not in config.profiling_users:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="These stats are not allowed for this user"
+        )
+
+@app.get("/api/executors", dependencies=[Depends(require_profiling_user)])
+def executor_stats() -> dict[str, dict]:
+    return {name: executor.stats() for name, executor in executors.items()}
+
+@app.get("/api/loop_lag", dependencies=[Depends(require_profiling_user)])
+async def loop_lag() -> dict:
+    # the offenders carry stacks and source paths
+    # read on the loop, the monitor appends to the samples from it
+    offenders = sorted(get_offenders(), key=lambda item: item[1]["total_seconds"], reverse=True)
+    return {
+        "lag_seconds": get_percentiles(list(loop_stats["lag_samples"])),
+        "max_lag_seconds": loop_stats["max_lag_seconds"],
+        "blocked": loop_stats["blocked"],
+        "offenders": [{"location": location, **stats} for location, stats in offenders]
+    }
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    # async so the threadpool is sampled from the loop, not from one of its own workers
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    threadpool_tokens.labels("total").set(limiter.total_tokens)
+    threadpool_tokens.labels("borrowed").set(limiter.borrowed_tokens)
+    # in multiprocess mode this reads the files of every worker, not something to do on the loop
+    return Response(await run_in_threadpool(generate_latest, get_metrics_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -1,8 +1,28 @@
 import enum
+from pydantic import BaseModel
 
 class DocumentStatus(enum.Enum):
 
     UPLOADED = "UPLOADED"
     PROCESSING = "PROCESSING"
     PROCESSED = "PROCESSED"
-    PROCESSING_FAILED = "PROCESSING FAILED"
\ No newline at end of file
+    PROCESSING_FAILED = "PROCESSING FAILED"
+
+class ProcessingRunStatus(enum.Enum):
+
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+class ProcessingCheckpointStage(enum.Enum):
+
+    PARSED = "PARSED"
+    EMBEDDED = "EMBEDDED"
+    UPSERTED = "UPSERTED"
+
+class BatchSearchRequest(BaseModel):
+    prompt: str
+    questions: list[str]
+    report_id: int
+    label: str | None = None
+    use_cache: bool = True
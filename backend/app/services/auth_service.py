@@ -5,9 +5,11 @@ from typing import Annotated
 import jwt
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
-from pwdlib import PasswordHash
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from app.core.admission import current_user_id
 from app.core.config import config
+from app.core.password_hashing import hash_password, run_password_hashing, verify_password_hash
 from app.db.schema import User
 from app.models.auth_models import AuthUserRequest, UserData, Token
 
@@ -15,7 +17,6 @@ SECRET_KEY = config.secret_key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRATION_TIME_SECONDS = 7200 # 2 hours
 
-password_hash = PasswordHash.recommended()
 oauth2_bearer  = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
 def verify_token(token: str) -> UserData:
@@ -29,12 +30,15 @@ def verify_token(token: str) -> UserData:
             detail="Not authenticated",
         )
 
-def get_current_user(request: Request) -> UserData:
+async def get_current_user(request: Request) -> UserData:
     cookie_access_token = request.cookies.get("access_token")
 
     if cookie_access_token and cookie_access_token.startswith("Bearer "):
         cookie_token = cookie_access_token.split(" ")[1]
-        return verify_token(cookie_token)
+        user_data = verify_token(cookie_token)
+        # async so the value is set in the request task and seen by the endpoint
+        current_user_id.set(user_data.user_id)
+        return user_data
     else:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -43,29 +47,29 @@ def get_current_user(request: Request) -> UserData:
     
 AuthUserData = Annotated[UserData, Depends(get_current_user)]
 
-def get_password_hash(password: str) -> str:
-    return password_hash.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await run_password_hashing(hash_password, password)
 
-def register_user(request: AuthUserRequest, db: Session) -> None:
-    user = db.query(User).filter(User.name == request.username).first()
+async def register_user(request: AuthUserRequest, db: Session) -> None:
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.name == request.username).first())
     if(user is not None):
         logging.info(f"Failed to register user {request.username}. User with that name already exists")
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"User with name {request.username} already exists",
         )
-    user = User(name=request.username, password=get_password_hash(request.password))
+    user = User(name=request.username, password=await get_password_hash(request.password))
     db.add(user)
-    db.commit()
+    await run_in_threadpool(db.commit)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return password_hash.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_hashing(verify_password_hash, plain_password, hashed_password)
     
-def authenticate_user(username: str, password: str, db: Session) -> User | None:
-    user = db.query(User).filter(User.name == username).first()
+async def authenticate_user(username: str, password: str, db: Session) -> User | None:
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.name == username).first())
     if not user:
         return None
-    if not verify_password(password, user.password):
+    if not await verify_password(password, user.password):
         return None
     return user
 
@@ -77,8 +81,8 @@ def create_access_token(user_id: int, username: str, expiration_time_seconds: in
     }
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def login(request: AuthUserRequest, db: Session) -> tuple[Token, UserData]:
-    user = authenticate_user(request.username, request.password, db)
+async def login(request: AuthUserRequest, db: Session) -> tuple[Token, UserData]:
+    user = await authenticate_user(request.username, request.password, db)
     if user is None:
         logging.info(f"Failed to authenticate user: {request.username}.")
         raise HTTPException(
@@ -0,0 +1,86 @@
+import json
+import logging
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+import torch
+from sqlalchemy.orm import Session
+from types_boto3_s3.client import S3Client
+
+from app.core.metrics import bytes_moved
+from app.core.s3 import AWS_BUCKET
+from app.db.schema import ProcessingCheckpoint, Report
+from app.models.document_models import ProcessingCheckpointStage
+
+# the parser output is the report itself, the checkpoint only adds what was computed from it
+
+def get_checkpoint_keys(report: Report) -> list[str]:
+    return [f"checkpoints/{report.s3_filename}/chunks.json", f"checkpoints/{report.s3_filename}/embeddings.npy"]
+
+def create_processing_checkpoint(report: Report, pipeline: str, db: Session) -> ProcessingCheckpoint:
+    checkpoint = ProcessingCheckpoint(
+        report_id=report.id,
+        document_id=report.document_id,
+        pipeline=pipeline,
+        stage=ProcessingCheckpointStage.PARSED.value,
+        upserted_batches=[],
+        updated_at=datetime.now()
+    )
+    db.add(checkpoint)
+    db.commit()
+    return checkpoint
+
+def save_processing_checkpoint(checkpoint: ProcessingCheckpoint, stage: ProcessingCheckpointStage | None, db: Session, upserted_batch: int | None = None) -> None:
+    if stage is not None:
+        checkpoint.stage = stage.value
+    if upserted_batch is not None:
+        # reassigned, in place changes of a json column are not tracked
+        checkpoint.upserted_batches = checkpoint.upserted_batches + [upserted_batch]
+    checkpoint.updated_at = datetime.now()
+    db.commit()
+
+def get_resumable_checkpoint(document_id: int, db: Session, pipeline: str | None = None) -> tuple[ProcessingCheckpoint, Report] | None:
+    query = db.query(ProcessingCheckpoint, Report).join(Report, Report.id == ProcessingCheckpoint.report_id)
+    query = query.filter(ProcessingCheckpoint.document_id == document_id)
+    if pipeline is not None:
+        query = query.filter(ProcessingCheckpoint.pipeline == pipeline)
+    return query.order_by(ProcessingCheckpoint.updated_at.desc()).first()
+
+def get_embeddings_array(embeddings) -> np.ndarray:
+    if isinstance(embeddings, torch.Tensor):
+        embeddings = embeddings.float().cpu().numpy()
+    return np.asarray(embeddings, dtype=np.float32)
+
+def s3_upload_checkpoint(data: list, labels: list, pages: list[int], embeddings, report: Report, pipeline: str, s3_client: S3Client) -> None:
+    chunks_key, embeddings_key = get_checkpoint_keys(report)
+    logging.info(f"Uploading processing checkpoint for report {report.s3_filename}")
+
+    chunks = json.dumps({"data": data, "labels": labels, "pages": pages}).encode("utf-8")
+    s3_client.upload_fileobj(Fileobj=BytesIO(chunks), Bucket=AWS_BUCKET, Key=chunks_key)
+
+    buffer = BytesIO()
+    np.save(buffer, get_embeddings_array(embeddings), allow_pickle=False)
+    s3_client.upload_fileobj(Fileobj=BytesIO(buffer.getvalue()), Bucket=AWS_BUCKET, Key=embeddings_key)
+    bytes_moved.labels(pipeline, "s3", "upload").inc(len(chunks) + buffer.tell())
+
+def s3_download_checkpoint(report: Report, pipeline: str, s3_client: S3Client) -> tuple[list, list, list[int], np.ndarray]:
+    chunks_key, embeddings_key = get_checkpoint_keys(report)
+    logging.info(f"Downloading processing checkpoint for report {report.s3_filename}")
+
+    chunks_content = s3_client.get_object(Bucket=AWS_BUCKET, Key=chunks_key)["Body"].read()
+    embeddings_content = s3_client.get_object(Bucket=AWS_BUCKET, Key=embeddings_key)["Body"].read()
+    bytes_moved.labels(pipeline, "s3", "download").inc(len(chunks_content) + len(embeddings_content))
+
+    chunks = json.loads(chunks_content)
+    return chunks["data"], chunks["labels"], chunks["pages"], np.load(BytesIO(embeddings_content), allow_pickle=False)
+
+def s3_delete_processing_checkpoint(checkpoint: ProcessingCheckpoint, report: Report, s3_client: S3Client, db: Session) -> None:
+    # the row is only marked for deletion, the caller commits it together with the document status
+    s3_client.delete_objects(
+        Bucket=AWS_BUCKET,
+        Delete={
+            "Objects": [{"Key": key} for key in get_checkpoint_keys(report)],
+            "Quiet": True
+        }
+    )
+    db.delete(checkpoint)
@@ -1,34 +1,40 @@
-import base64
-import gc
-import io
+import json
 import logging
-import re
-import pymupdf
-from pymupdf import Page, Document as PyMuPDFDoc
+import threading
+import time
+from typing import Any
 from io import BytesIO
-from PIL import Image, ImageFile
 from uuid import uuid4
 from fastapi import HTTPException, status
-from fastapi.concurrency import run_in_threadpool
 from sentence_transformers import SentenceTransformer
-from sqlalchemy.orm import Session
-import torch
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
 from types_boto3_s3.client import S3Client
 from qdrant_client import AsyncQdrantClient
 import httpx
 from qdrant_client import models
 
+from app.core.admission import admission_limiters
+from app.core.executors import executors, run_inference
+from app.core.metrics import add_run_count, batch_sizes, bytes_moved, cache_requests, points_processed, track_stage
 from app.core.ml_models import ml_models
-from app.db.schema import Document, Report
+from app.db.schema import Document, ProcessingCheckpoint, Report, ReportFingerprint
 from app.core.s3 import AWS_BUCKET
 from app.core.config import config
-from app.core.qdrant import collection_name
+from app.core.qdrant import collection_name, get_two_stage_query
 from app.models.document_models import DocumentStatus
-from app.services.report_service import delete_reports, outline_mineru_report, outline_pager_report, s3_upload_report, s3_upload_report_outline
+from app.services.report_service import get_mineru_outline_data, get_pager_outline_regions, get_report_outline_key, qdrant_delete_documents_points, s3_upload_report, s3_upload_report_outline
+from app.services.report_service import get_report_keys, s3_delete_objects
 from app.services.report_service import process_pager_report, process_pymupdf_full_report, process_mineru_report
-from app.models.report_models import PyMuPdfPartialPage, PyMuPdfPartialReportJson, ReportJson, PyMuPdfReportJson, PyMuPdfPage
+from app.services.report_service import process_report_pages
+from app.services.reindex_service import add_report_fingerprint, get_page_mapping, get_reindexable_report, get_report_page_filter
+from app.services.reindex_service import delete_report_rows, get_unreindexable_reports, s3_delete_unreindexable_reports, merge_mineru_reports, merge_pager_reports, qdrant_copy_carried_points, qdrant_delete_points, s3_delete_report
+from app.services.checkpoint_service import create_processing_checkpoint, get_resumable_checkpoint, s3_delete_processing_checkpoint
+from app.services.processing_run_service import finish_processing_run, start_processing_run
+from app.services.rerank_service import rerank_points
+from app.models.report_models import PyMuPdfPartialReportJson, ReportJson
 from app.models.mineru_models import MinerUReport
-from app.utility.report_utility import base64_to_pil, safe_open_image
+from app.utility.pdf_utility import get_page_fingerprints, outline_mineru_report, outline_pager_report, pymupdf_full_extract, pymupdf_partial_render, select_pages
 from app.models.auth_models import UserData
 
 PRESIGNED_URLS_EXPIRATION_TIME_SECONDS = 3600 # 1 hour
@@ -42,390 +48,672 @@ def s3_upload_document(content: bytes, s3_filename: str, s3_mime_type: str, file
     return document.id
 
 
-async def s3_delete_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session)  -> None:
-    logging.info(f"Starting deleting process for document {document.id}")
+def s3_bulk_delete_documents(documents: list[Document], s3_client: S3Client, db: Session) -> None:
+    document_ids = [document.id for document in documents]
+    documents_by_id = {document.id: document for document in documents}
+    reports = db.query(Report).filter(Report.document_id.in_(document_ids)).all()
 
-    await delete_reports(document, qdrant_client, s3_client, db)
+    keys = [f"documents/{document.s3_filename}.{document.s3_mime_type}" for document in documents]
+    for report in reports:
+        keys.extend(get_report_keys(report, documents_by_id[report.document_id]))
 
-    logging.info(f"Deleting document {document.id} from s3")
-    await run_in_threadpool(s3_client.delete_object, Bucket=AWS_BUCKET, Key=f"documents/{document.s3_filename}.{document.s3_mime_type}")
-    logging.info(f"Deleting document {document.id} from db")
-    await run_in_threadpool(db.delete, document)
-    await run_in_threadpool(db.commit)
+    s3_delete_objects(keys, s3_client)
 
-def s3_get_documents(page: int, page_size: int, user_data: UserData, s3_client: S3Client, db: Session) -> list[dict[str, str]]:
-    logging.info(f"Presigning documents urls")
-    query = db.query(Document).filter(Document.owner_id == user_data.user_id).order_by(Document.id)
+    logging.info(f"Deleting {len(documents)} documents and {len(reports)} reports from db")
+    try:
+        db.query(ProcessingCheckpoint).filter(ProcessingCheckpoint.document_id.in_(document_ids)).delete(synchronize_session=False)
+        db.query(ReportFingerprint).filter(ReportFingerprint.document_id.in_(document_ids)).delete(synchronize_session=False)
+        db.query(Report).filter(Report.document_id.in_(document_ids)).delete(synchronize_session=False)
+        db.query(Document).filter(Document.id.in_(document_ids)).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
-    total_items = query.count()
+async def s3_delete_documents(documents: list[Document], qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session) -> None:
+    logging.info(f"Starting deleting process for documents {[document.id for document in documents]}")
 
-    documents = (
-        query.offset((page-1)*page_size)
-        .limit(page_size)
-        .all()
+    await qdrant_delete_documents_points([document.id for document in documents], qdrant_client)
+    await executors["io"].run(s3_bulk_delete_documents, documents, s3_client, db)
+
+async def s3_delete_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session)  -> None:
+    await s3_delete_documents([document], qdrant_client, s3_client, db)
+
+# urls are reused until shortly before they expire, so repeated listings return identical urls
+presigned_url_cache: dict[tuple[str, str, str], tuple[str, float]] = {}
+presigned_url_cache_lock = threading.Lock()
+
+def get_presigned_url(key: str, s3_client: S3Client, content_type: str = "application/pdf", content_disposition: str = "inline") -> str:
+    cache_key = (key, content_type, content_disposition)
+    now = time.time()
+
+    with presigned_url_cache_lock:
+        cached = presigned_url_cache.get(cache_key)
+    if cached is not None and cached[1] - config.presigned_url_safety_margin_seconds > now:
+        cache_requests.labels("presigned_url", "hit").inc()
+        return cached[0]
+    cache_requests.labels("presigned_url", "miss").inc()
+
+    url = s3_client.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={
+            "Bucket": AWS_BUCKET, 
+            "Key": key,
+            "ResponseContentType": content_type,
+            "ResponseContentDisposition": content_disposition
+        },
+        ExpiresIn=PRESIGNED_URLS_EXPIRATION_TIME_SECONDS,
+    )
+
+    with presigned_url_cache_lock:
+        if len(presigned_url_cache) >= config.presigned_url_cache_max_entries:
+            evict_presigned_urls(now)
+        presigned_url_cache[cache_key] = (url, now + PRESIGNED_URLS_EXPIRATION_TIME_SECONDS)
+
+    return url
+
+def evict_presigned_urls(now: float) -> None:
+    for cache_key, (_, expires_at) in list(presigned_url_cache.items()):
+        if expires_at - config.presigned_url_safety_margin_seconds <= now:
+            del presigned_url_cache[cache_key]
+
+    # still full, drop the urls that expire first
+    overflow = len(presigned_url_cache) - config.presigned_url_cache_max_entries + 1
+    if overflow > 0:
+        for cache_key, _ in sorted(presigned_url_cache.items(), key=lambda item: item[1][1])[:overflow]:
+            del presigned_url_cache[cache_key]
+
+def presign_get_urls(keys: list[str], s3_client: S3Client) -> dict[str, str]:
+    urls = {}
+    for key in keys:
+        if key not in urls:
+            urls[key] = get_presigned_url(key, s3_client)
+    return urls
+
+def count_documents(user_data: UserData, db: Session, approximate_total: bool) -> tuple[int, bool]:
+    query = db.query(Document.id).filter(Document.owner_id == user_data.user_id)
+
+    if not approximate_total:
+        return query.count(), False
+
+    # counting stops at the limit, so the cost stays flat for users with huge libraries
+    limit = config.document_list_approximate_count_limit
+    total_items = db.query(func.count()).select_from(query.limit(limit + 1).subquery()).scalar()
+    return min(total_items, limit), total_items > limit
+
+def get_content_urls(documents: list[Document]) -> dict[str, str]:
+    # content urls never change for an object, so the browser of the owner can cache it, shared caches can not as the routes need auth
+    urls = {}
+    for document in documents:
+        urls[f"documents/{document.s3_filename}.{document.s3_mime_type}"] = f"{config.document_content_base_url}/api/document/content/{document.id}"
+        for report in document.reports:
+            report_key = get_report_outline_key(report, document)
+            if report_key is not None:
+                urls[report_key] = f"{config.document_content_base_url}/api/document/report_outline/{report.id}"
+    return urls
+
+def s3_get_object_stream(key: str, s3_client: S3Client):
+    file = s3_client.get_object(Bucket=AWS_BUCKET, Key=key)
+    return file["Body"].iter_chunks()
+
+def s3_download_document(document: Document, pipeline: str, s3_client: S3Client) -> bytes:
+    content = s3_client.get_object(Bucket=AWS_BUCKET, Key=f"documents/{document.s3_filename}.{document.s3_mime_type}")["Body"].read()
+    bytes_moved.labels(pipeline, "s3", "download").inc(len(content))
+    add_run_count("input_bytes", len(content))
+    return content
+
+def s3_get_documents(page: int, page_size: int, user_data: UserData, s3_client: S3Client, db: Session, after_id: int | None = None, approximate_total: bool = False) -> dict[str, Any]:
+    logging.info(f"Presigning documents urls")
+    query = (
+        db.query(Document)
+        .options(selectinload(Document.reports))
+        .filter(Document.owner_id == user_data.user_id)
+        .order_by(Document.id)
     )
 
+    if after_id is not None:
+        query = query.filter(Document.id > after_id)
+    else:
+        query = query.offset((page-1)*page_size)
+
+    documents = query.limit(page_size).all()
+
+    total_items, total_is_approximate = count_documents(user_data, db, approximate_total)
+
+    if config.document_url_mode == "content":
+        urls = get_content_urls(documents)
+    else:
+        keys = []
+        for document in documents:
+            keys.append(f"documents/{document.s3_filename}.{document.s3_mime_type}")
+            for report in document.reports:
+                report_key = get_report_outline_key(report, document)
+                if report_key is not None:
+                    keys.append(report_key)
+
+        urls = presign_get_urls(keys, s3_client)
+
     result = []
     for document in documents:
-        url = s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={
-                "Bucket": AWS_BUCKET, 
-                "Key": f"documents/{document.s3_filename}.{document.s3_mime_type}",
-                "ResponseContentType": "application/pdf",
-                "ResponseContentDisposition": "inline"
-            },
-            ExpiresIn=PRESIGNED_URLS_EXPIRATION_TIME_SECONDS,
-        )
+        url = urls[f"documents/{document.s3_filename}.{document.s3_mime_type}"]
         report_list = []
         for report in document.reports:
-            report_url = None
-            if report.tag in ["pager", "mineru"]:
-                report_url = s3_client.generate_presigned_url(
-                    ClientMethod="get_object",
-                    Params={
-                        "Bucket": AWS_BUCKET, 
-                        "Key": f"report_outlines/{report.s3_filename}.{document.s3_mime_type}",
-                        "ResponseContentType": "application/pdf",
-                        "ResponseContentDisposition": "inline"
-                    },
-                    ExpiresIn=PRESIGNED_URLS_EXPIRATION_TIME_SECONDS,
-                )
+            report_key = get_report_outline_key(report, document)
+            report_url = urls[report_key] if report_key is not None else None
             report_list.append({"report": report, "url": report_url})
 
         result.append({"id": document.id,"key": f"{document.name}.{document.s3_mime_type}", "status": document.status, "url": url, "reports": report_list})
+
+    next_after_id = documents[-1].id if len(documents) == page_size else None
         
-    return {"page": page, "page_size": page_size, "total_items": total_items, "documents": result}
+    return {
+        "page": page,
+        "page_size": page_size,
+        "total_items": total_items,
+        "total_is_approximate": total_is_approximate,
+        "next_after_id": next_after_id,
+        "documents": result
+    }
+
+CHECKPOINTED_PIPELINES = {
+    "pager": process_pager_report,
+    "mineru": process_mineru_report,
+}
+
+REPORT_OUTLINERS = {
+    "pager": (get_pager_outline_regions, outline_pager_report),
+    "mineru": (get_mineru_outline_data, outline_mineru_report),
+}
+
+REPORT_MERGERS = {
+    "pager": merge_pager_reports,
+    "mineru": merge_mineru_reports,
+}
+
+REPORT_MODELS = {
+    "pager": ReportJson,
+    "mineru": MinerUReport,
+}
+
+def s3_download_report(report: Report, pipeline: str, s3_client: S3Client) -> bytes:
+    content = s3_client.get_object(Bucket=AWS_BUCKET, Key=f"reports/{report.s3_filename}.json")["Body"].read()
+    bytes_moved.labels(pipeline, "s3", "download").inc(len(content))
+    return content
+
+async def create_report_outline(pipeline: str, report_obj: ReportJson | MinerUReport, document_obj: bytes, report: Report, document: Document, s3_client: S3Client, db: Session) -> None:
+    logging.info(f"Creating report {report.s3_filename}.json representation")
+    get_outline_data, outline_report = REPORT_OUTLINERS[pipeline]
+    with track_stage(pipeline, "outline"):
+        updated_document_obj = await executors["pdf"].run(outline_report, get_outline_data(report_obj), report.s3_filename, document_obj, document.s3_mime_type)
+
+    logging.info(f"Uploading report outline for {report.s3_filename}")
+    with track_stage(pipeline, "upload_outline"):
+        await executors["io"].run(s3_upload_report_outline, updated_document_obj, report.s3_filename, document.s3_mime_type, s3_client, db)
+    bytes_moved.labels(pipeline, "s3", "upload").inc(len(updated_document_obj))
+
+def get_report_page_count(report_obj: ReportJson | MinerUReport) -> int:
+    if isinstance(report_obj, MinerUReport):
+        return len({block.page_idx for block in report_obj.content_list})
+    return len(report_obj.pages)
+
+async def complete_checkpointed_processing(pipeline: str, report_obj: ReportJson | MinerUReport, document_obj: bytes, report: Report, checkpoint: ProcessingCheckpoint, document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session) -> None:
+    process_report = CHECKPOINTED_PIPELINES[pipeline]
+
+    # a failure from here on keeps the report and the checkpoint, resume_process_document continues after the last finished stage
+    logging.info(f"Processing report {report.s3_filename}.json from stage {checkpoint.stage}")
+    await process_report(report_obj, report, checkpoint, qdrant_client, s3_client, db)
+
+    await create_report_outline(pipeline, report_obj, document_obj, report, document, s3_client, db)
+
+    # kept with the report, a later reindex only sends the pages whose fingerprint changed
+    with track_stage(pipeline, "fingerprint"):
+        fingerprints = await executors["pdf"].run(get_page_fingerprints, document_obj, document.s3_mime_type, config.page_fingerprint_dpi)
+    await executors["io"].run(add_report_fingerprint, report, fingerprints, db)
+
+    await executors["io"].run(s3_delete_processing_checkpoint, checkpoint, report, s3_client, db)
+    document.status = DocumentStatus.PROCESSED.value
+    await executors["io"].run(db.commit)
+
+def s3_delete_stale_checkpoint(checkpoint: ProcessingCheckpoint, report: Report, document: Document, s3_client: S3Client, db: Session) -> None:
+    s3_delete_processing_checkpoint(checkpoint, report, s3_client, db)
+    s3_delete_report(report, document, s3_client, db)
+    db.commit()
+
+async def drop_stale_checkpoint(pipeline: str, document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session) -> None:
+    # a fresh run replaces an interrupted one of the same pipeline, a later resume would otherwise add its points a second time.
+    # interrupted runs of the other pipeline stay resumable, their points are kept under their own report
+    while (resumable := await executors["io"].run(get_resumable_checkpoint, document.id, db, pipeline)) is not None:
+        checkpoint, report = resumable
+        logging.info(f"Dropping interrupted {checkpoint.pipeline} report {report.id} of document {document.id}")
+        await qdrant_client.delete(collection_name=collection_name, points_selector=get_report_page_filter(report.id), wait=True)
+        await executors["io"].run(s3_delete_stale_checkpoint, checkpoint, report, document, s3_client, db)
+
+async def pager_parse(document: Document, document_obj: bytes) -> bytes:
+    files = {
+        "file": (
+            f"{document.s3_filename}.{document.s3_mime_type}",
+            document_obj,
+            f"application/{document.s3_mime_type}"
+        )
+    }
+
+    data = {
+        "process": '{"glam_rows": true}'
+    }
+
+    logging.info(f"Sending documents {document.s3_filename}.{document.s3_mime_type} to pager")
+    
+    with track_stage("pager", "parser"):
+        async with admission_limiters["pager"].acquire(shed=False):
+            async with httpx.AsyncClient(timeout=None) as client:
+                response = await client.post(config.pager_url + "/", data=data, files=files)
+                response.raise_for_status()
+    bytes_moved.labels("pager", "parser", "upload").inc(len(document_obj))
+    bytes_moved.labels("pager", "parser", "download").inc(len(response.content))
+    return response.content
 
 async def pager_process_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session):
     logging.info(f"Processing document {document.s3_filename}.{document.s3_mime_type} from s3")
     document.status = DocumentStatus.PROCESSING.value
-    await run_in_threadpool(db.commit)
+    await executors["io"].run(db.commit)
+    run = await start_processing_run(document, "pager", db)
     try:
+        await drop_stale_checkpoint("pager", document, qdrant_client, s3_client, db)
+        with track_stage("pager", "total"):
+            with track_stage("pager", "download"):
+                document_obj = await executors["io"].run(s3_download_document, document, "pager", s3_client)
 
-        document_obj = await run_in_threadpool(s3_client.get_object(Bucket=AWS_BUCKET, Key=f"documents/{document.s3_filename}.{document.s3_mime_type}")["Body"].read)
-
-        files = {
-            "file": (
-                f"{document.s3_filename}.{document.s3_mime_type}",
-                document_obj,
-                f"application/{document.s3_mime_type}"
-            )
-        }
-
-        data = {
-            "process": '{"glam_rows": true}'
-        }
-
-        logging.info(f"Sending documents {document.s3_filename}.{document.s3_mime_type} to pager")
-        
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.post(config.pager_url + "/", data=data, files=files)
-            response.raise_for_status()
-
-        report_uuid = uuid4()
-        
-        report = await run_in_threadpool(s3_upload_report, response.content, "pager", str(report_uuid), document, s3_client, db)
+            response_content = await pager_parse(document, document_obj)
 
-        report_obj = ReportJson.model_validate(response.json())
-
-        # report is not gonna be processed again if something fails, 
-        # but it is gonna be created and saved to s3
-        logging.info(f"Processing report {report.s3_filename}.json")
-        await process_pager_report(report_obj, document.id, report.id, qdrant_client)
+            report_uuid = uuid4()
+            
+            with track_stage("pager", "upload_report"):
+                report = await executors["io"].run(s3_upload_report, response_content, "pager", str(report_uuid), document, s3_client, db)
+            bytes_moved.labels("pager", "s3", "upload").inc(len(response_content))
 
-        logging.info(f"Creating report {report.s3_filename}.json representation")
-        updated_document_obj = await run_in_threadpool(outline_pager_report, report_obj, str(report_uuid), document_obj, document.s3_mime_type)
+            checkpoint = await executors["io"].run(create_processing_checkpoint, report, "pager", db)
 
-        logging.info(f"Uploading report outline for {report.s3_filename}")
-        await run_in_threadpool(s3_upload_report_outline, updated_document_obj, str(report_uuid), document.s3_mime_type, s3_client, db)
+            with track_stage("pager", "validate"):
+                report_obj = await executors["cpu"].run(ReportJson.model_validate_json, response_content)
+            add_run_count("page_count", get_report_page_count(report_obj))
 
-        document.status = DocumentStatus.PROCESSED.value
-        await run_in_threadpool(db.commit)
+            await complete_checkpointed_processing("pager", report_obj, document_obj, report, checkpoint, document, qdrant_client, s3_client, db)
 
+        await finish_processing_run(run, db)
         return report.id
 
     except Exception as e:
-        await run_in_threadpool(db.rollback)
+        await executors["io"].run(db.rollback)
         logging.exception(f"Error while processing document {document.s3_filename}.{document.s3_mime_type} from s3 \n {e}")
         document.status = DocumentStatus.PROCESSING_FAILED.value
-        await run_in_threadpool(db.commit)
+        await executors["io"].run(db.commit)
+        await finish_processing_run(run, db, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Document processing failed"
         )
     
 
-def get_page_text(page: Page):
-    text = page.get_text(sort=True)
-    text = re.sub(' +', ' ', text)
-    lines = [line for line in text.splitlines() if line.strip()]
-    cleaned_text = "\n".join(lines)
-
-    return cleaned_text
-
-# def get_page_images(page: Page, pymupdf_doc: PyMuPDFDoc) -> list[str]: 
-#     base64_images = []
-
-#     image_list = page.get_images(full=True) 
-
-#     for img in image_list: 
-#         xref = img[0] 
-
-#         base_image = pymupdf_doc.extract_image(xref) 
-
-#         image_bytes = base_image["image"] 
-#         image_ext = base_image["ext"] 
-
-#         base64_string = base64.b64encode(image_bytes).decode("utf-8") 
-#         data_uri = f"data:image/{image_ext};base64,{base64_string}" 
-        
-#         base64_images.append(data_uri) 
-    
-#     return base64_images
-
-ImageFile.LOAD_TRUNCATED_IMAGES = True
-
-def get_page_images(page: Page, pymupdf_doc: PyMuPDFDoc) -> list[str]: 
-    base64_images = []
-    image_list = page.get_images(full=True) 
-
-    for img in image_list: 
-        xref = img[0] 
-        base_image = pymupdf_doc.extract_image(xref) 
-        
-        image_bytes = base_image["image"] 
-
-        image = safe_open_image(image_bytes)
-
-        if image is None:
-            continue
-
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        width, height = image.size
-
-        # Skip extreme aspect ratios
-        aspect_ratio = max(width / height, height / width)
-        if aspect_ratio >= 200:
-            continue
-
-        if width > 512 or height > 512:
-            image.thumbnail((512, 512), Image.Resampling.LANCZOS)
-            
-        buffer = io.BytesIO()
-        image.save(buffer, format="JPEG", quality=85)
-        
-        image_bytes = buffer.getvalue()
-
-        base64_string = base64.b64encode(image_bytes).decode("utf-8") 
-        data_uri = f"data:image/jpeg;base64,{base64_string}" 
-        
-        base64_images.append(data_uri) 
-    
-    return base64_images
-
 async def pymupdf_full_process_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session):
     logging.info(f"Processing document {document.s3_filename}.{document.s3_mime_type} from s3")
     document.status = DocumentStatus.PROCESSING.value
-    await run_in_threadpool(db.commit)
+    await executors["io"].run(db.commit)
+    run = await start_processing_run(document, "pymupdf_full", db)
     try:
+        with track_stage("pymupdf_full", "total"):
+            with track_stage("pymupdf_full", "download"):
+                file_content = await executors["io"].run(s3_download_document, document, "pymupdf_full", s3_client)
 
-        file = await run_in_threadpool(s3_client.get_object, Bucket=AWS_BUCKET, Key=f"documents/{document.s3_filename}.{document.s3_mime_type}")
+            with track_stage("pymupdf_full", "extract"):
+                report_data, json_bytes = await executors["pdf"].run(pymupdf_full_extract, file_content, document.s3_mime_type, document.s3_filename)
+            add_run_count("page_count", report_data.total_pages)
 
-        file_content = await run_in_threadpool(file["Body"].read)
-
-        pymupdf_doc = pymupdf.open(stream=file_content, filetype=document.s3_mime_type)
+            report_uuid = uuid4()
+            
+            with track_stage("pymupdf_full", "upload_report"):
+                report = await executors["io"].run(s3_upload_report, json_bytes, "pymupdf_full", str(report_uuid), document, s3_client, db)
+            bytes_moved.labels("pymupdf_full", "s3", "upload").inc(len(json_bytes))
 
+            logging.info(f"Processing report {report.s3_filename}.json")
+            await process_pymupdf_full_report(report_data, document.id, report.id, qdrant_client)
 
-        pages_data  = []
-        for  page in pymupdf_doc:
-            page_text = await run_in_threadpool(get_page_text, page)
-            page_images = await run_in_threadpool(get_page_images, page, pymupdf_doc)
-            pages_data.append(PyMuPdfPage(page_number=page.number, text=page_text, images=page_images))
+            document.status = DocumentStatus.PROCESSED.value
+            await executors["io"].run(db.commit)
 
-        pymupdf_doc.close()
+        await finish_processing_run(run, db)
+        return report.id
 
-        report_data = PyMuPdfReportJson(
-            document_name=document.s3_filename,
-            total_pages=len(pages_data),
-            pages=pages_data
+    except Exception as e:
+        await executors["io"].run(db.rollback)
+        logging.exception(f"Error while processing document {document.s3_filename}.{document.s3_mime_type} from s3 \n {e}")
+        document.status = DocumentStatus.PROCESSING_FAILED.value
+        await executors["io"].run(db.commit)
+        await finish_processing_run(run, db, e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Document processing failed"
         )
+    
 
-        json_bytes = report_data.model_dump_json(indent=2).encode("utf-8")
+async def pymupdf_partial_process_document(document: Document, start: int, end: int, s3_client: S3Client, db: Session):
+    logging.info(f"Processing document {document.s3_filename}.{document.s3_mime_type} from s3")
+    document.status = DocumentStatus.PROCESSING.value
+    await executors["io"].run(db.commit)
+    run = await start_processing_run(document, "pymupdf_partial", db)
+    try:
+        with track_stage("pymupdf_partial", "total"):
+            with track_stage("pymupdf_partial", "download"):
+                file_content = await executors["io"].run(s3_download_document, document, "pymupdf_partial", s3_client)
 
-        report_uuid = uuid4()
-        
-        report = await run_in_threadpool(s3_upload_report, json_bytes, "pymupdf_full", str(report_uuid), document, s3_client, db)
+            with track_stage("pymupdf_partial", "render"):
+                json_bytes, page_count = await executors["pdf"].run(pymupdf_partial_render, file_content, document.s3_mime_type, document.s3_filename, document.id, start, end)
+            add_run_count("page_count", page_count)
 
-        logging.info(f"Processing report {report.s3_filename}.json")
-        await process_pymupdf_full_report(report_data, document.id, report.id, qdrant_client)
+            report_uuid = uuid4()
+            
+            with track_stage("pymupdf_partial", "upload_report"):
+                report = await executors["io"].run(s3_upload_report, json_bytes, "pymupdf_partial", str(report_uuid), document, s3_client, db)
+            bytes_moved.labels("pymupdf_partial", "s3", "upload").inc(len(json_bytes))
 
-        document.status = DocumentStatus.PROCESSED.value
-        await run_in_threadpool(db.commit)
+            document.status = DocumentStatus.PROCESSED.value
+            await executors["io"].run(db.commit)
 
+        await finish_processing_run(run, db)
         return report.id
 
     except Exception as e:
-        await run_in_threadpool(db.rollback)
+        await executors["io"].run(db.rollback)
         logging.exception(f"Error while processing document {document.s3_filename}.{document.s3_mime_type} from s3 \n {e}")
         document.status = DocumentStatus.PROCESSING_FAILED.value
-        await run_in_threadpool(db.commit)
+        await executors["io"].run(db.commit)
+        await finish_processing_run(run, db, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Document processing failed"
         )
-    
 
-def get_pages_start_end(document: Document, start: int, end: int, total_pages: int, num_of_images_input: int = 30):
-    # All page ids mentioned are based on the order in the raw document.
-    # context_start_end: page start/end id of context in qa generation
-    # num_of_images_input: the number of input images, 30 images in cut-off paradigm
-    # total_pages: total pages in the raw document
-    # img_start, img_end: input page start/end id
-    raw_start_page, raw_end_page = start, end
-    raw_pages_len = raw_end_page - raw_start_page
-    img_start = max(0, raw_start_page - (num_of_images_input - raw_pages_len)//2)
-    img_end = img_start + num_of_images_input
-    if img_end >= total_pages:
-        img_end = total_pages
-        img_start = max(0, img_end - num_of_images_input)
-    logging.info(f"Document {document.id}: start  {start}, end {end}, page number {total_pages}")
-    logging.info(f"result is [{img_start}, {img_end}]")
-    return img_start, img_end
 
-async def pymupdf_partial_process_document(document: Document, start: int, end: int, s3_client: S3Client, db: Session):
-    logging.info(f"Processing document {document.s3_filename}.{document.s3_mime_type} from s3")
-    document.status = DocumentStatus.PROCESSING.value
-    await run_in_threadpool(db.commit)
-    try:
-
-        file = await run_in_threadpool(s3_client.get_object, Bucket=AWS_BUCKET, Key=f"documents/{document.s3_filename}.{document.s3_mime_type}")
+def validate_mineru_response(content: bytes, document_name: str) -> tuple[MinerUReport, bytes]:
+    results = json.loads(content)["results"]
+    report_obj = MinerUReport.model_validate(results[document_name])
+    return report_obj, report_obj.model_dump_json(indent=2).encode("utf-8")
 
-        file_content = await run_in_threadpool(file["Body"].read)
+async def mineru_parse(document: Document, document_obj: bytes) -> bytes:
+    files = {
+        "files": (
+            f"{document.name}.{document.s3_mime_type}",
+            document_obj,
+            f"application/{document.s3_mime_type}"
+        )
+    }
 
-        pymupdf_doc = pymupdf.open(stream=file_content, filetype=document.s3_mime_type)
+    data = {
+        "lang_list": ["en"],
+        "backend": "pipeline",
+        "formula_enable": False,
+        "return_md": False,
+        "return_content_list": True,
+        "return_images": True,
+        "return_model_output": True
+    }
 
-        part_start, part_end = get_pages_start_end(document, start, end, pymupdf_doc.page_count)
 
-        pages_data  = []
-        for page in pymupdf_doc.pages(start=part_start, stop=part_end):
-            pix = page.get_pixmap()
-            image_bytes = pix.tobytes("png")
-            page_data = f"data:image/png;base64,{base64.b64encode(image_bytes).decode("utf-8")}"
-            pages_data.append(PyMuPdfPartialPage(page_number=page.number, image=page_data))
+    logging.info(f"Sending documents {document.s3_filename}.{document.s3_mime_type} to mineru")
+    
+    with track_stage("mineru", "parser"):
+        async with admission_limiters["mineru"].acquire(shed=False):
+            async with httpx.AsyncClient(timeout=None) as client:
+                response = await client.post(config.mineru_url + "/file_parse", data=data, files=files)
+                response.raise_for_status()
+    bytes_moved.labels("mineru", "parser", "upload").inc(len(document_obj))
+    bytes_moved.labels("mineru", "parser", "download").inc(len(response.content))
+    return response.content
 
-        report_data = PyMuPdfPartialReportJson(
-            document_name=document.s3_filename,
-            total_pages=pymupdf_doc.page_count,
-            pages=pages_data
-        )
+async def mineru_process_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session):
+    logging.info(f"Processing document {document.s3_filename}.{document.s3_mime_type} from s3")
+    document.status = DocumentStatus.PROCESSING.value
+    await executors["io"].run(db.commit)
+    run = await start_processing_run(document, "mineru", db)
+    try:
+        await drop_stale_checkpoint("mineru", document, qdrant_client, s3_client, db)
+        with track_stage("mineru", "total"):
+            with track_stage("mineru", "download"):
+                document_obj = await executors["io"].run(s3_download_document, document, "mineru", s3_client)
 
-        pymupdf_doc.close()
+            response_content = await mineru_parse(document, document_obj)
+            
+            with track_stage("mineru", "validate"):
+                report_obj, json_bytes = await executors["cpu"].run(validate_mineru_response, response_content, document.name)
+            add_run_count("page_count", get_report_page_count(report_obj))
+            
+            report_uuid = uuid4()
 
-        json_bytes = report_data.model_dump_json(indent=2).encode("utf-8")
+            with track_stage("mineru", "upload_report"):
+                report = await executors["io"].run(s3_upload_report, json_bytes, "mineru", str(report_uuid), document, s3_client, db)
+            bytes_moved.labels("mineru", "s3", "upload").inc(len(json_bytes))
 
-        report_uuid = uuid4()
-        
-        report = await run_in_threadpool(s3_upload_report, json_bytes, "pymupdf_partial", str(report_uuid), document, s3_client, db)
+            checkpoint = await executors["io"].run(create_processing_checkpoint, report, "mineru", db)
 
-        document.status = DocumentStatus.PROCESSED.value
-        await run_in_threadpool(db.commit)
+            await complete_checkpointed_processing("mineru", report_obj, document_obj, report, checkpoint, document, qdrant_client, s3_client, db)
 
+        await finish_processing_run(run, db)
         return report.id
 
     except Exception as e:
-        await run_in_threadpool(db.rollback)
+        await executors["io"].run(db.rollback)
         logging.exception(f"Error while processing document {document.s3_filename}.{document.s3_mime_type} from s3 \n {e}")
         document.status = DocumentStatus.PROCESSING_FAILED.value
-        await run_in_threadpool(db.commit)
+        await executors["io"].run(db.commit)
+        await finish_processing_run(run, db, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Document processing failed"
         )
 
+async def resume_process_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session):
+    resumable = await executors["io"].run(get_resumable_checkpoint, document.id, db)
+    if resumable is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="There is no interrupted processing to resume"
+        )
+    checkpoint, report = resumable
+    pipeline = checkpoint.pipeline
 
-async def mineru_process_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session):
-    logging.info(f"Processing document {document.s3_filename}.{document.s3_mime_type} from s3")
+    logging.info(f"Resuming {pipeline} processing of document {document.s3_filename}.{document.s3_mime_type} from stage {checkpoint.stage}")
     document.status = DocumentStatus.PROCESSING.value
-    await run_in_threadpool(db.commit)
+    await executors["io"].run(db.commit)
+    # recorded apart from fresh runs, a resume skips the parser and would skew their durations
+    run = await start_processing_run(document, f"{pipeline}_resume", db)
     try:
-        document_obj = await run_in_threadpool(s3_client.get_object(Bucket=AWS_BUCKET, Key=f"documents/{document.s3_filename}.{document.s3_mime_type}")["Body"].read)
+        with track_stage(f"{pipeline}_resume", "total"):
+            # the parser is not called again, its response is the stored report
+            with track_stage(pipeline, "download"):
+                document_obj = await executors["io"].run(s3_download_document, document, pipeline, s3_client)
+                report_content = await executors["io"].run(s3_download_report, report, pipeline, s3_client)
 
-        files = {
-            "files": (
-                f"{document.name}.{document.s3_mime_type}",
-                document_obj,
-                f"application/{document.s3_mime_type}"
-            )
-        }
+            with track_stage(pipeline, "validate"):
+                report_obj = await executors["cpu"].run(REPORT_MODELS[pipeline].model_validate_json, report_content)
+            add_run_count("page_count", get_report_page_count(report_obj))
 
-        data = {
-            "lang_list": ["en"],
-            "backend": "pipeline",
-            "formula_enable": False,
-            "return_md": False,
-            "return_content_list": True,
-            "return_images": True,
-            "return_model_output": True
-        }
+            await complete_checkpointed_processing(pipeline, report_obj, document_obj, report, checkpoint, document, qdrant_client, s3_client, db)
 
+        await finish_processing_run(run, db)
+        return report.id
 
-        logging.info(f"Sending documents {document.s3_filename}.{document.s3_mime_type} to mineru")
-        
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.post(config.mineru_url + "/file_parse", data=data, files=files)
-            response.raise_for_status()
-        
-        data = response.json()
-        results = data["results"]
-        report_obj = MinerUReport.model_validate(results[document.name])
-        
-        report_uuid = uuid4()
+    except Exception as e:
+        await executors["io"].run(db.rollback)
+        logging.exception(f"Error while resuming processing of document {document.s3_filename}.{document.s3_mime_type} \n {e}")
+        document.status = DocumentStatus.PROCESSING_FAILED.value
+        await executors["io"].run(db.commit)
+        await finish_processing_run(run, db, e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Document processing failed"
+        )
 
-        json_bytes = report_obj.model_dump_json(indent=2).encode("utf-8")
+def get_report_bytes(report_obj: ReportJson | MinerUReport) -> bytes:
+    return report_obj.model_dump_json(indent=2).encode("utf-8")
 
-        report = await run_in_threadpool(s3_upload_report, json_bytes, "mineru", str(report_uuid), document, s3_client, db)
+async def parse_changed_pages(pipeline: str, changed: list[int], document: Document, document_obj: bytes) -> ReportJson | MinerUReport:
+    if not changed:
+        return ReportJson(pages=[]) if pipeline == "pager" else MinerUReport(content_list=[], images={}, model_output="[]")
 
-        # report is not gonna be processed again if something fails, 
-        # but it is gonna be created and saved to s3
-        logging.info(f"Processing report {report.s3_filename}.json")
-        await process_mineru_report(report_obj, document.id, report.id, qdrant_client)
+    # the parser gets a pdf of the changed pages only, its page numbers start from zero again
+    with track_stage(pipeline, "select_pages"):
+        changed_obj = await executors["pdf"].run(select_pages, document_obj, document.s3_mime_type, changed)
 
-        logging.info(f"Creating report {report.s3_filename}.json representation")
-        updated_document_obj = await run_in_threadpool(outline_mineru_report, report_obj, str(report_uuid), document_obj, document.s3_mime_type)
+    if pipeline == "pager":
+        response_content = await pager_parse(document, changed_obj)
+        with track_stage(pipeline, "validate"):
+            return await executors["cpu"].run(ReportJson.model_validate_json, response_content)
 
-        logging.info(f"Uploading report outline for {report.s3_filename}")
-        await run_in_threadpool(s3_upload_report_outline, updated_document_obj, str(report_uuid), document.s3_mime_type, s3_client, db)
+    response_content = await mineru_parse(document, changed_obj)
+    with track_stage(pipeline, "validate"):
+        report_obj, _ = await executors["cpu"].run(validate_mineru_response, response_content, document.name)
+    return report_obj
 
-        document.status = DocumentStatus.PROCESSED.value
-        await run_in_threadpool(db.commit)
+async def reindex_process_document(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session):
+    reindexable = await executors["io"].run(get_reindexable_report, document.id, db)
+    if reindexable is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="There is no processed report with page fingerprints to reindex"
+        )
+    previous_report, previous_fingerprint = reindexable
+    pipeline = previous_report.tag
 
+    logging.info(f"Reindexing document {document.s3_filename}.{document.s3_mime_type} based on {pipeline} report {previous_report.id}")
+    document.status = DocumentStatus.PROCESSING.value
+    await executors["io"].run(db.commit)
+    # recorded apart from fresh runs, a reindex only parses the changed pages
+    run = await start_processing_run(document, f"{pipeline}_reindex", db)
+    report = None
+    # every point written for the new report, the previous report is not touched before the commit
+    point_ids = []
+    committed = False
+    try:
+        with track_stage(f"{pipeline}_reindex", "total"):
+            with track_stage(pipeline, "download"):
+                document_obj = await executors["io"].run(s3_download_document, document, pipeline, s3_client)
+                previous_content = await executors["io"].run(s3_download_report, previous_report, pipeline, s3_client)
+
+            with track_stage(pipeline, "fingerprint"):
+                fingerprints = await executors["pdf"].run(get_page_fingerprints, document_obj, document.s3_mime_type, config.page_fingerprint_dpi)
+            carried, changed = get_page_mapping(previous_fingerprint.pages, fingerprints)
+            add_run_count("page_count", len(changed))
+            logging.info(f"{len(changed)} of {len(fingerprints)} pages changed since report {previous_report.id}")
+
+            if not changed and carried == {page: page for page in range(len(previous_fingerprint.pages))}:
+                logging.info(f"Report {previous_report.id} is up to date, nothing to reindex")
+                report = previous_report
+                document.status = DocumentStatus.PROCESSED.value
+                await executors["io"].run(db.commit)
+                committed = True
+            else:
+                with track_stage(pipeline, "validate"):
+                    previous_report_obj = await executors["cpu"].run(REPORT_MODELS[pipeline].model_validate_json, previous_content)
+                parsed_report_obj = await parse_changed_pages(pipeline, changed, document, document_obj)
+
+                with track_stage(pipeline, "merge"):
+                    report_obj = await executors["cpu"].run(REPORT_MERGERS[pipeline], previous_report_obj, parsed_report_obj, carried, changed)
+                    json_bytes = await executors["cpu"].run(get_report_bytes, report_obj)
+
+                with track_stage(pipeline, "upload_report"):
+                    report = await executors["io"].run(s3_upload_report, json_bytes, pipeline, str(uuid4()), document, s3_client, db)
+                bytes_moved.labels(pipeline, "s3", "upload").inc(len(json_bytes))
+
+                await process_report_pages(pipeline, report_obj, set(changed), report, point_ids, qdrant_client)
+
+                with track_stage(pipeline, "carry_over"):
+                    await qdrant_copy_carried_points(previous_report.id, report.id, carried, point_ids, qdrant_client)
+
+                await create_report_outline(pipeline, report_obj, document_obj, report, document, s3_client, db)
+
+                previous_report_id = previous_report.id
+                previous_keys = get_report_keys(previous_report, document)
+                await executors["io"].run(delete_report_rows, previous_report, db)
+                await executors["io"].run(add_report_fingerprint, report, fingerprints, db)
+                document.status = DocumentStatus.PROCESSED.value
+                await executors["io"].run(db.commit)
+                committed = True
+
+                # the new report is committed, only now the previous one is removed,
+                # anything left behind here is an orphan the reconciler collects
+                try:
+                    await qdrant_client.delete(collection_name=collection_name, points_selector=get_report_page_filter(previous_report_id), wait=True)
+                    await executors["io"].run(s3_delete_objects, previous_keys, s3_client)
+                except Exception as e:
+                    logging.exception(f"Error while removing replaced report {previous_report_id} \n {e}")
+
+        await finish_processing_run(run, db)
         return report.id
 
     except Exception as e:
-        await run_in_threadpool(db.rollback)
-        logging.exception(f"Error while processing document {document.s3_filename}.{document.s3_mime_type} from s3 \n {e}")
+        await executors["io"].run(db.rollback)
+        logging.exception(f"Error while reindexing document {document.s3_filename}.{document.s3_mime_type} \n {e}")
+        # the previous report and its points are intact, only what this run wrote is dropped
+        if report is not None and not committed:
+            try:
+                await qdrant_delete_points(point_ids, qdrant_client)
+                await executors["io"].run(s3_delete_report, report, document, s3_client, db)
+            except Exception as cleanup_error:
+                logging.exception(f"Error while dropping report {report.id} of the failed reindex \n {cleanup_error}")
+                await executors["io"].run(db.rollback)
         document.status = DocumentStatus.PROCESSING_FAILED.value
-        await run_in_threadpool(db.commit)
+        await executors["io"].run(db.commit)
+        await finish_processing_run(run, db, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Document processing failed"
         )
 
-async def report_points_based_search(text: str, report_id: int, label: str | None, qdrant_client: AsyncQdrantClient) -> models.QueryResponse:
-    logging.info(f"Searching documents with string {text}")
+def s3_upload_document_revision(content: bytes, document: Document, s3_client: S3Client, db: Session) -> None:
+    # a new key instead of overwriting, cached responses for the old key stay valid for what they contain
+    previous_key = f"documents/{document.s3_filename}.{document.s3_mime_type}"
+    s3_filename = str(uuid4())
+    logging.info(f"Uploading revision of document {document.id} to s3 {s3_filename}")
+    s3_client.upload_fileobj(Fileobj=BytesIO(content), Bucket=AWS_BUCKET, Key=f"documents/{s3_filename}.{document.s3_mime_type}")
+
+    document.s3_filename = s3_filename
+    db.commit()
+    s3_delete_objects([previous_key], s3_client)
+
+async def upload_document_revision(content: bytes, document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session) -> None:
+    await executors["io"].run(s3_upload_document_revision, content, document, s3_client, db)
+
+    # pager and mineru reports stay until the document is reindexed, which only processes the pages that changed,
+    # the others would keep serving pages of a file that no longer exists
+    reports = await executors["io"].run(get_unreindexable_reports, document, db)
+    if not reports:
+        return
+    logging.info(f"Deleting {len(reports)} reports of document {document.id} that can not be reindexed")
+    await qdrant_client.delete(
+        collection_name=collection_name,
+        points_selector=models.Filter(
+            must=[models.FieldCondition(key="report_id", match=models.MatchAny(any=[report.id for report in reports]))]
+        ),
+        wait=True
+    )
+    await executors["io"].run(s3_delete_unreindexable_reports, reports, document, s3_client, db)
 
+    remaining = await executors["io"].run(lambda: db.query(Report.id).filter(Report.document_id == document.id).first())
+    if remaining is None:
+        document.status = DocumentStatus.UPLOADED.value
+        await executors["io"].run(db.commit)
+
+def get_points_filter(report_ids: list[int], label: str | None = None) -> models.Filter:
     conditions = []
-    
+
+    if len(report_ids) == 1:
+        report_match = models.MatchValue(value=report_ids[0])
+    else:
+        report_match = models.MatchAny(any=report_ids)
 
     conditions.append(
         models.FieldCondition(
             key="report_id",
-            match=models.MatchValue(
-                value=report_id,
-            ),
+            match=report_match,
         )
     )
 
@@ -439,90 +727,124 @@ async def report_points_based_search(text: str, report_id: int, label: str | Non
             )
         )
 
-    filter_condition = models.Filter(
+    return models.Filter(
         must=conditions
     )
 
-    with torch.inference_mode():
-        embedding = await run_in_threadpool(ml_models["embedding_model"].encode, text)
+async def report_points_based_search(text: str, report_id: int, label: str | None, qdrant_client: AsyncQdrantClient) -> models.QueryResponse:
+    logging.info(f"Searching documents with string {text}")
 
-    result = await qdrant_client.query_points(
-        collection_name=collection_name,
-        query_filter=filter_condition,
-        query=embedding[:512],
-        limit=50,
-    )
+    filter_condition = get_points_filter([report_id], label)
 
-    # for index, element in enumerate(result.points):
-    #     print(f"{index}: {element.id}")
-    # print()
-
-    fragments = []
-    for item in result.points:
-        data = item.payload.get("data", "")
-        if isinstance(data, dict):
-            if "image" not in data:
-                fragments.append(data.get("text", ""))
-            elif "text" not in data:
-                fragments.append(base64_to_pil(data.get("image", "")))
-            else:
-                fragments.append({
-                    "text": data.get("text", ""),
-                    "image": base64_to_pil(data.get("image", ""))
-                })
-        elif isinstance(data, list):
-            intermediate_form = {}
-            for index, element in enumerate(data):
-                if "image_url" in element:
-                    base64_image = element["image_url"]["url"]
-                    intermediate_form["image"] = base64_to_pil(base64_image)
-                if "text" in element:
-                    if "text" not in intermediate_form:
-                        intermediate_form["text"] = []
-                    intermediate_form["text"].append(element["text"])
-            fragments.append(intermediate_form)
-        else:
-            fragments.append(data)
-
-    # for index, element in enumerate(fragments):
-    #     print(f"{index}: {element}")
-    # print()
-
-    query = text
-
-    with torch.inference_mode():
-        rankings = ml_models["reranker_model"].rank(query, fragments, batch_size=1)
-
-    # for index, element in enumerate(rankings):
-    #     print(f"{index}: {element}")
-    # print()
-
-    top_ranked = []
-    for item in rankings[:10]:
-        top_ranked.append(result.points[item.get("corpus_id")])
-
-    del rankings
-    gc.collect()
-    torch.cuda.empty_cache()
-
-    result.points = top_ranked
-
-    # for index, element in enumerate(result.points):
-    #     print(f"{index}: {element.id}")
-    # print()
+    with track_stage("report_search", "encode"):
+        async with admission_limiters["embedding"].acquire():
+            embedding = await run_inference(ml_models["embedding_model"].encode, text)
+
+    with track_stage("report_search", "qdrant"):
+        result = await qdrant_client.query_points(
+            collection_name=collection_name,
+            query_filter=filter_condition,
+            **get_two_stage_query(embedding, filter_condition, config.rerank_max_candidates),
+        )
+    points_processed.labels("report_search", "qdrant").inc(len(result.points))
+
+    with track_stage("report_search", "rerank"):
+        result.points = await rerank_points(text, result.points)
 
     return result
 
+async def report_points_based_search_batch(texts: list[str], report_id: int, label: str | None, qdrant_client: AsyncQdrantClient) -> list[models.QueryResponse]:
+    logging.info(f"Searching report {report_id} with {len(texts)} questions")
+
+    filter_condition = get_points_filter([report_id], label)
+
+    with track_stage("batch_search", "encode"):
+        async with admission_limiters["embedding"].acquire():
+            embeddings = await run_inference(ml_models["embedding_model"].encode, texts, batch_size=config.batch_search_encode_batch_size)
+    batch_sizes.labels("search_encode").observe(len(texts))
+
+    requests = [
+        models.QueryRequest(
+            filter=filter_condition,
+            with_payload=True,
+            **get_two_stage_query(embedding, filter_condition, config.rerank_max_candidates),
+        )
+        for embedding in embeddings
+    ]
+
+    with track_stage("batch_search", "qdrant"):
+        return await qdrant_client.query_batch_points(
+            collection_name=collection_name,
+            requests=requests,
+        )
+
+def merge_batch_points(responses: list[models.QueryResponse], limit: int) -> list[models.ScoredPoint]:
+    # the same point can be returned by several sub-queries (e.g. per-label and per-report),
+    # keep the best scored copy only
+    merged: dict[str, models.ScoredPoint] = {}
+    for response in responses:
+        for point in response.points:
+            key = str(point.id)
+            if key not in merged or merged[key].score < point.score:
+                merged[key] = point
+
+    return sorted(merged.values(), key=lambda point: point.score, reverse=True)[:limit]
+
+async def library_points_based_search(text: str, report_ids: list[int], labels: list[str] | None, qdrant_client: AsyncQdrantClient) -> models.QueryResponse:
+    logging.info(f"Searching {len(report_ids)} reports with string {text}")
+
+    if len(report_ids) == 0:
+        return models.QueryResponse(points=[])
+
+    # one sub-query per label over the whole library, otherwise one per report,
+    # so a single big report can not push every other report out of the candidate pool
+    if labels:
+        filters = [get_points_filter(report_ids, label) for label in labels]
+    elif len(report_ids) <= config.library_search_max_batch:
+        filters = [get_points_filter([report_id]) for report_id in report_ids]
+    else:
+        filters = [get_points_filter(report_ids)]
+
+    with track_stage("library_search", "encode"):
+        async with admission_limiters["embedding"].acquire():
+            embedding = await run_inference(ml_models["embedding_model"].encode, text)
+
+    requests = [
+        models.QueryRequest(
+            filter=filter_condition,
+            with_payload=True,
+            **get_two_stage_query(
+                embedding,
+                filter_condition,
+                config.library_search_group_limit if len(filters) > 1 else config.library_search_candidates,
+            ),
+        )
+        for filter_condition in filters
+    ]
+
+    with track_stage("library_search", "qdrant"):
+        responses = await qdrant_client.query_batch_points(
+            collection_name=collection_name,
+            requests=requests,
+        )
+    batch_sizes.labels("qdrant_query_batch").observe(len(requests))
+
+    candidates = merge_batch_points(responses, config.library_search_candidates)
+    points_processed.labels("library_search", "qdrant").inc(len(candidates))
+
+    with track_stage("library_search", "rerank"):
+        return models.QueryResponse(points=await rerank_points(text, candidates))
+
 
 async def report_based_search(report: Report, s3_client: S3Client) -> str:
     logging.info(f"Assembling text for report {report.id}")
 
     # text = text.replace("-\n", "").replace("\n", " ").lower()
-    file = await run_in_threadpool(s3_client.get_object, Bucket=AWS_BUCKET, Key=f"reports/{report.s3_filename}.json")
+    file = await executors["io"].run(s3_client.get_object, Bucket=AWS_BUCKET, Key=f"reports/{report.s3_filename}.json")
 
-    file_content = await run_in_threadpool(file["Body"].read)
+    file_content = await executors["io"].run(file["Body"].read)
 
-    report_obj = PyMuPdfPartialReportJson.model_validate_json(file_content)
+    report_obj = await executors["cpu"].run(PyMuPdfPartialReportJson.model_validate_json, file_content)
 
     return report_obj
 
@@ -0,0 +1,119 @@
+import base64
+import io
+import logging
+import math
+from PIL import Image
+from qdrant_client import models
+
+from app.core.config import config
+from app.utility.report_utility import base64_to_pil
+
+def get_point_evidence(point: models.ScoredPoint) -> list[dict]:
+    evidence_items = []
+    data = point.payload.get("data", "")
+    if isinstance(data, dict):
+        if "text" in data:
+            evidence_items.append({"type": "text", "text": data.get("text", "")})
+        if "image" in data:
+            evidence_items.append({
+                "type": "image_url",
+                "image_url": {
+                    # Critical: Format as data:image/jpeg;base64,<data>
+                    "url": data.get("image", "")
+                },
+            })
+    elif isinstance(data, list):
+        evidence_items.extend(data)
+    else: 
+        evidence_items.append({"type": "text", "text": data})
+
+    return evidence_items
+
+def estimate_text_tokens(text: str) -> int:
+    return math.ceil(len(text) / config.llm_chars_per_token)
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    return math.ceil(width * height / config.llm_image_pixels_per_token)
+
+def downsize_image(url: str) -> tuple[str, int]:
+    image = base64_to_pil(url)
+    width, height = image.size
+
+    if width * height > config.llm_image_max_pixels:
+        scale = math.sqrt(config.llm_image_max_pixels / (width * height))
+        image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        url = f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+    return url, estimate_image_tokens(*image.size)
+
+def get_item_cost(item: dict) -> tuple[dict, int]:
+    if item.get("type") == "image_url":
+        url, tokens = downsize_image(item["image_url"]["url"])
+        return {"type": "image_url", "image_url": {"url": url}}, tokens
+    return item, estimate_text_tokens(item.get("text", ""))
+
+def truncate_evidence(items: list[dict], budget: int) -> tuple[list[dict], int]:
+    # images can not be cut, so a truncated item keeps only as much text as fits
+    truncated = []
+    used = 0
+    for item in items:
+        if item.get("type") != "text":
+            continue
+        tokens = estimate_text_tokens(item["text"])
+        if used + tokens > budget:
+            max_chars = (budget - used) * config.llm_chars_per_token
+            if max_chars > 0:
+                truncated.append({"type": "text", "text": item["text"][:max_chars]})
+                used = budget
+            break
+        truncated.append(item)
+        used += tokens
+    return truncated, used
+
+def pack_evidence(prompt: str, search_text: str, points: list[models.ScoredPoint]) -> tuple[list[dict], dict]:
+    budget = config.llm_context_tokens - config.llm_max_output_tokens - estimate_text_tokens(prompt) - estimate_text_tokens(search_text)
+
+    evidence_items = []
+    packed, truncated, dropped = [], [], []
+    used = 0
+
+    # points come in rank order, so whatever does not fit is always lower ranked than what was packed
+    for rank, point in enumerate(points):
+        items, costs = [], 0
+        for item in get_point_evidence(point):
+            packed_item, tokens = get_item_cost(item)
+            items.append(packed_item)
+            costs += tokens
+
+        if used + costs <= budget:
+            evidence_items.extend(items)
+            used += costs
+            packed.append(rank)
+            continue
+
+        remaining = budget - used
+        if remaining >= config.llm_min_truncated_tokens:
+            items, tokens = truncate_evidence(items, remaining)
+            if items:
+                evidence_items.extend(items)
+                used += tokens
+                truncated.append(rank)
+                continue
+
+        dropped.append(rank)
+
+    if truncated or dropped:
+        logging.info(f"Evidence packed into {used} of {budget} tokens, truncated {truncated}, dropped {dropped}")
+
+    packing = {
+        "budget_tokens": budget,
+        "used_tokens": used,
+        "packed": packed,
+        "truncated": truncated,
+        "dropped": dropped
+    }
+
+    return evidence_items, packing
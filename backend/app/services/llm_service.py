@@ -0,0 +1,249 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from openai import AsyncOpenAI
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.admission import admission_limiters
+from app.core.config import config
+from app.core.metrics import stage_seconds, track_stage
+from app.db.schema import LLMCacheEntry, SessionLocal
+
+LLM_CACHE_EVICT_BATCH_SIZE = 1000
+
+llm_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "bypassed": 0,
+    "stored": 0,
+    "evicted": 0
+}
+
+def get_image_digest(url: str) -> str:
+    # the same image can come with a different data uri prefix or base64 line breaks,
+    # so the key is built from the decoded bytes
+    if not url.startswith("data:"):
+        return url
+    base64_str = url.split(",", 1)[1]
+    return "sha256:" + hashlib.sha256(base64.b64decode(base64_str)).hexdigest()
+
+def get_message_fingerprint(message: dict) -> dict:
+    content = message["content"]
+    if isinstance(content, str):
+        return message
+
+    fingerprint_content = []
+    for item in content:
+        if item.get("type") == "image_url":
+            fingerprint_content.append({"type": "image_url", "image_url": get_image_digest(item["image_url"]["url"])})
+        else:
+            fingerprint_content.append(item)
+    return {"role": message["role"], "content": fingerprint_content}
+
+def get_cache_key(messages: list[dict]) -> str:
+    key_data = {
+        "model": config.open_ai_model_name,
+        "temperature": 0,
+        "max_tokens": config.llm_max_output_tokens,
+        "messages": [get_message_fingerprint(message) for message in messages]
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_cached_completion(key: str, db: Session) -> str | None:
+    entry = db.query(LLMCacheEntry).filter(LLMCacheEntry.key == key).first()
+    if entry is None:
+        return None
+
+    now = datetime.now()
+    if entry.created_at < now - timedelta(seconds=config.llm_cache_ttl_seconds):
+        db.delete(entry)
+        db.commit()
+        return None
+
+    # recency only matters for eviction, a hit does not have to write every time
+    if entry.last_used_at < now - timedelta(seconds=config.llm_cache_touch_interval_seconds):
+        entry.last_used_at = now
+        db.commit()
+    return entry.response
+
+def store_completion(key: str, response: str, db: Session) -> None:
+    now = datetime.now()
+    db.add(LLMCacheEntry(
+        key=key,
+        model=config.open_ai_model_name,
+        response=response,
+        size=len(response.encode("utf-8")),
+        created_at=now,
+        last_used_at=now
+    ))
+    try:
+        db.commit()
+    except IntegrityError:
+        # a concurrent miss on the same key stored it first, with temperature 0 it is the same answer
+        db.rollback()
+        return
+    llm_cache_stats["stored"] += 1
+
+def evict_completions(db: Session) -> None:
+    expired = db.query(LLMCacheEntry).filter(
+        LLMCacheEntry.created_at < datetime.now() - timedelta(seconds=config.llm_cache_ttl_seconds)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+    # the entries are only walked once the cache is over its size limit
+    evicted_keys = []
+    total_size = db.query(func.coalesce(func.sum(LLMCacheEntry.size), 0)).scalar()
+    if total_size > config.llm_cache_max_bytes:
+        # least recently used entries go first
+        total_size = 0
+        for key, size in db.query(LLMCacheEntry.key, LLMCacheEntry.size).order_by(LLMCacheEntry.last_used_at.desc()):
+            total_size += size
+            if total_size > config.llm_cache_max_bytes:
+                evicted_keys.append(key)
+
+    for start in range(0, len(evicted_keys), LLM_CACHE_EVICT_BATCH_SIZE):
+        db.query(LLMCacheEntry).filter(LLMCacheEntry.key.in_(evicted_keys[start:start + LLM_CACHE_EVICT_BATCH_SIZE])).delete(synchronize_session=False)
+    db.commit()
+    llm_cache_stats["evicted"] += expired + len(evicted_keys)
+
+def evict_completions_in_session() -> None:
+    db = SessionLocal()
+    try:
+        evict_completions(db)
+    finally:
+        db.close()
+
+async def run_llm_cache_evictor() -> None:
+    # off the request path, a store does not pay for walking the cache
+    while True:
+        await asyncio.sleep(config.llm_cache_evict_interval_seconds)
+        try:
+            await run_in_threadpool(evict_completions_in_session)
+        except Exception as e:
+            logging.exception(f"Error while evicting llm cache entries \n {e}")
+
+async def save_completion(key: str, response: str, db: Session) -> None:
+    # the answer is already generated, failing to cache it must not fail the request
+    try:
+        await run_in_threadpool(store_completion, key, response, db)
+    except Exception as e:
+        logging.exception(f"Error while storing llm cache entry \n {e}")
+        await run_in_threadpool(db.rollback)
+
+async def lookup_completion(messages: list[dict], db: Session, use_cache: bool) -> tuple[str | None, str | None]:
+    if not config.llm_cache_enabled or not use_cache:
+        llm_cache_stats["bypassed"] += 1
+        return None, None
+
+    key = await run_in_threadpool(get_cache_key, messages)
+    cached = await run_in_threadpool(get_cached_completion, key, db)
+    if cached is None:
+        llm_cache_stats["misses"] += 1
+    else:
+        llm_cache_stats["hits"] += 1
+    return key, cached
+
+async def get_completion(messages: list[dict], open_ai_client: AsyncOpenAI, db: Session, use_cache: bool = True) -> str:
+    key, cached = await lookup_completion(messages, db, use_cache)
+    if cached is not None:
+        return cached
+
+    with track_stage("llm", "completion"):
+        async with admission_limiters["openai"].acquire():
+            response = await open_ai_client.chat.completions.create(
+                model=config.open_ai_model_name,
+                messages=messages,
+                temperature=0,
+                max_tokens=config.llm_max_output_tokens
+            )
+
+    result = response.choices[0].message.content
+
+    if key is not None and result:
+        await save_completion(key, result, db)
+
+    return result
+
+STREAM_END = object()
+
+async def produce_completion(messages: list[dict], open_ai_client: AsyncOpenAI, queue: asyncio.Queue) -> None:
+    try:
+        # the slot is held while the model generates, not while a slow client reads
+        async with admission_limiters["openai"].acquire():
+            start = time.perf_counter()
+            first_token = True
+            stream = await open_ai_client.chat.completions.create(
+                model=config.open_ai_model_name,
+                messages=messages,
+                temperature=0,
+                max_tokens=config.llm_max_output_tokens,
+                stream=True
+            )
+
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        stage_seconds.labels("llm", "first_token").observe(time.perf_counter() - start)
+                        first_token = False
+                    await queue.put(chunk.choices[0].delta.content)
+            stage_seconds.labels("llm", "stream").observe(time.perf_counter() - start)
+        await queue.put(STREAM_END)
+    except Exception as e:
+        await queue.put(e)
+
+async def stream_completion(messages: list[dict], open_ai_client: AsyncOpenAI) -> AsyncIterator[str]:
+    # a chunk carries at least one token, so the queue never fills and the producer never waits on the client
+    queue = asyncio.Queue(maxsize=config.llm_max_output_tokens + 1)
+    producer = asyncio.create_task(produce_completion(messages, open_ai_client, queue))
+    try:
+        while True:
+            item = await queue.get()
+            if item is STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # a client that went away stops the generation too
+        producer.cancel()
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_search_events(messages: list[dict], evidence: dict | None, open_ai_client: AsyncOpenAI, db: Session, use_cache: bool = True) -> AsyncIterator[str]:
+    # evidence is already ranked at this point, send it before the first token is generated
+    if evidence is not None:
+        yield sse_event("evidence", evidence)
+
+    try:
+        key, cached = await lookup_completion(messages, db, use_cache)
+        if cached is not None:
+            yield sse_event("token", {"text": cached})
+            yield sse_event("done", {"cached": True})
+            return
+
+        tokens = []
+        async for token in stream_completion(messages, open_ai_client):
+            tokens.append(token)
+            yield sse_event("token", {"text": token})
+
+        if key is not None and tokens:
+            await save_completion(key, "".join(tokens), db)
+    except HTTPException as e:
+        yield sse_event("error", {"detail": e.detail, "status_code": e.status_code})
+        return
+    except Exception as e:
+        logging.exception(f"Error while streaming completion \n {e}")
+        yield sse_event("error", {"detail": "Answer generation failed"})
+        return
+
+    yield sse_event("done", {})
@@ -0,0 +1,136 @@
+import logging
+import math
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+
+from app.core.executors import executors
+from app.core.metrics import processing_run_stats
+from app.db.schema import Document, ProcessingRun
+from app.models.document_models import ProcessingRunStatus
+
+PERCENTILES = [50, 90, 95, 99]
+
+def create_processing_run(document: Document, pipeline: str, db: Session) -> ProcessingRun:
+    run = ProcessingRun(
+        document_id=document.id,
+        owner_id=document.owner_id,
+        pipeline=pipeline,
+        status=ProcessingRunStatus.RUNNING.value,
+        started_at=datetime.now(),
+        stages=[]
+    )
+    db.add(run)
+    db.commit()
+    return run
+
+async def start_processing_run(document: Document, pipeline: str, db: Session) -> ProcessingRun:
+    run = await executors["io"].run(create_processing_run, document, pipeline, db)
+    # awaited directly by the pipeline, so the stats are visible to every stage it runs
+    processing_run_stats.set({"stages": [], "input_bytes": None, "page_count": None, "point_count": None})
+    return run
+
+def save_processing_run(run: ProcessingRun, stats: dict, error: Exception | None, db: Session) -> None:
+    run.finished_at = datetime.now()
+    run.duration_seconds = (run.finished_at - run.started_at).total_seconds()
+    run.status = ProcessingRunStatus.FAILED.value if error is not None else ProcessingRunStatus.SUCCEEDED.value
+    run.error_class = f"{type(error).__module__}.{type(error).__qualname__}" if error is not None else None
+    run.input_bytes = stats["input_bytes"]
+    run.page_count = stats["page_count"]
+    run.point_count = stats["point_count"]
+    run.stages = stats["stages"]
+    db.commit()
+
+async def finish_processing_run(run: ProcessingRun, db: Session, error: Exception | None = None) -> None:
+    stats = processing_run_stats.get() or {"stages": [], "input_bytes": None, "page_count": None, "point_count": None}
+    processing_run_stats.set(None)
+    # the history is best effort, it must not fail a document that was processed
+    try:
+        await executors["io"].run(save_processing_run, run, stats, error, db)
+    except Exception as e:
+        logging.exception(f"Error while saving processing run {run.id} \n {e}")
+        await executors["io"].run(db.rollback)
+
+def get_percentiles(values: list[float]) -> dict[str, float | None]:
+    values = sorted(values)
+    result = {}
+    for percentile in PERCENTILES:
+        if not values:
+            result[f"p{percentile}"] = None
+            continue
+        # linear interpolation between the closest ranks
+        index = (len(values) - 1) * percentile / 100
+        low, high = math.floor(index), math.ceil(index)
+        result[f"p{percentile}"] = values[low] + (values[high] - values[low]) * (index - low)
+    return result
+
+def get_pipeline_stats(runs: list, window_hours: float) -> dict:
+    succeeded = [run for run in runs if run.status == ProcessingRunStatus.SUCCEEDED.value]
+    busy_seconds = sum(run.duration_seconds for run in succeeded)
+    pages = sum(run.page_count or 0 for run in succeeded)
+    points = sum(run.point_count or 0 for run in succeeded)
+    input_bytes = sum(run.input_bytes or 0 for run in succeeded)
+
+    stage_seconds = defaultdict(list)
+    for run in succeeded:
+        for stage in run.stages or []:
+            stage_seconds[stage["stage"]].append(stage["seconds"])
+
+    return {
+        "runs": len(runs),
+        "succeeded": len(succeeded),
+        "failed": len(runs) - len(succeeded),
+        "errors": dict(Counter(run.error_class for run in runs if run.error_class is not None)),
+        "documents_per_hour": len(succeeded) / window_hours,
+        # throughput of a single busy worker, what capacity planning multiplies by the worker count
+        "pages_per_second": pages / busy_seconds if busy_seconds else None,
+        "points_per_second": points / busy_seconds if busy_seconds else None,
+        "bytes_per_second": input_bytes / busy_seconds if busy_seconds else None,
+        "latency_seconds": get_percentiles([run.duration_seconds for run in succeeded]),
+        "seconds_per_page": get_percentiles([run.duration_seconds / run.page_count for run in succeeded if run.page_count]),
+        "stage_seconds": {stage: get_percentiles(seconds) for stage, seconds in stage_seconds.items()}
+    }
+
+def get_processing_stats(window_hours: float, pipeline: str | None, owner_id: int | None, db: Session) -> dict[str, dict]:
+    query = db.query(
+        ProcessingRun.pipeline,
+        ProcessingRun.status,
+        ProcessingRun.duration_seconds,
+        ProcessingRun.page_count,
+        ProcessingRun.point_count,
+        ProcessingRun.input_bytes,
+        ProcessingRun.error_class,
+        ProcessingRun.stages
+    ).filter(
+        ProcessingRun.started_at >= datetime.now() - timedelta(hours=window_hours),
+        ProcessingRun.status != ProcessingRunStatus.RUNNING.value
+    )
+    if pipeline is not None:
+        query = query.filter(ProcessingRun.pipeline == pipeline)
+    if owner_id is not None:
+        query = query.filter(ProcessingRun.owner_id == owner_id)
+
+    runs_by_pipeline = defaultdict(list)
+    for run in query.yield_per(1000):
+        runs_by_pipeline[run.pipeline].append(run)
+
+    return {name: get_pipeline_stats(runs, window_hours) for name, runs in runs_by_pipeline.items()}
+
+def get_document_processing_runs(document_id: int, limit: int, db: Session) -> list[dict]:
+    runs = db.query(ProcessingRun).filter(ProcessingRun.document_id == document_id).order_by(ProcessingRun.id.desc()).limit(limit)
+    return [
+        {
+            "id": run.id,
+            "pipeline": run.pipeline,
+            "status": run.status,
+            "started_at": run.started_at,
+            "finished_at": run.finished_at,
+            "duration_seconds": run.duration_seconds,
+            "input_bytes": run.input_bytes,
+            "page_count": run.page_count,
+            "point_count": run.point_count,
+            "error_class": run.error_class,
+            "stages": run.stages
+        }
+        for run in runs
+    ]
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from io import BytesIO
+from uuid import uuid4
+import torch
+from fastapi import HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import config
+from app.core.s3 import AWS_BUCKET, create_s3_client
+from types_boto3_s3.client import S3Client
+from app.services.auth_service import AuthUserData
+from app.services.document_service import get_presigned_url
+
+# torch.profiler is process wide, two profiled requests would end up in each other's trace
+profiling_lock = asyncio.Lock()
+
+# innermost frames of threads that are parked, they would bury the busy stacks
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+class StackSampler:
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.stacks: Counter[str] = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name="profiling-sampler", daemon=True)
+
+    def sample(self) -> None:
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval_seconds):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self) -> bytes:
+        # folded stacks, the input format of flamegraph.pl and speedscope
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()).encode("utf-8")
+
+def start_torch_profiler() -> torch.profiler.profile:
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+    profiler.start()
+    return profiler
+
+def get_profile_keys(profile_id: str) -> tuple[str, str]:
+    return f"profiles/{profile_id}/stacks.txt", f"profiles/{profile_id}/torch_trace.json"
+
+def s3_upload_profile(profile_id: str, sampler: StackSampler, profiler: torch.profiler.profile, s3_client: S3Client) -> None:
+    stacks_key, trace_key = get_profile_keys(profile_id)
+    s3_client.upload_fileobj(Fileobj=BytesIO(sampler.collapsed()), Bucket=AWS_BUCKET, Key=stacks_key)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "torch_trace.json")
+        profiler.export_chrome_trace(path)
+        with open(path, "rb") as file:
+            s3_client.upload_fileobj(Fileobj=file, Bucket=AWS_BUCKET, Key=trace_key)
+
+async def profile_request(request: Request, response: Response, user_data: AuthUserData):
+    if request.headers.get("x-profile") != "1" and request.query_params.get("profile") != "true":
+        yield
+        return
+
+    if user_data.username not in config.profiling_users:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Profiling is not allowed for this user"
+        )
+    if profiling_lock.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another request is being profiled"
+        )
+
+    async with profiling_lock:
+        # created only for profiled requests, the others do not pay for a client
+        s3_client = await run_in_threadpool(create_s3_client)
+        profile_id = str(uuid4())
+        stacks_key, trace_key = get_profile_keys(profile_id)
+        # the artifacts are uploaded once the response is sent, the links are valid from then on
+        response.headers["X-Profile-Id"] = profile_id
+        response.headers["X-Profile-Stacks-Url"] = await run_in_threadpool(get_presigned_url, stacks_key, s3_client, "text/plain", "attachment")
+        response.headers["X-Profile-Trace-Url"] = await run_in_threadpool(get_presigned_url, trace_key, s3_client, "application/json", "attachment")
+
+        logging.info(f"Profiling {request.url.path} for user {user_data.username} as {profile_id}")
+        sampler = StackSampler(config.profiling_interval_seconds)
+        sampler.start()
+        profiler = start_torch_profiler()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            sampler.stop()
+            try:
+                await run_in_threadpool(s3_upload_profile, profile_id, sampler, profiler, s3_client)
+            except Exception as e:
+                logging.exception(f"Error while uploading profile {profile_id} \n {e}")
+            finally:
+                s3_client.close()
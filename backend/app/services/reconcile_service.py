@@ -0,0 +1,238 @@
+import asyncio
+import fcntl
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from fastapi.concurrency import run_in_threadpool
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http import models
+from sqlalchemy import Connection, text
+from sqlalchemy.orm import Session
+from types_boto3_s3.client import S3Client
+
+from app.core.config import config
+from app.core.qdrant import collection_name
+from app.core.s3 import AWS_BUCKET, create_s3_client
+from app.db.schema import Document, ProcessingCheckpoint, ProcessingRun, Report, ReportFingerprint, SessionLocal, engine
+from app.models.document_models import DocumentStatus, ProcessingRunStatus
+from app.services.report_service import get_report_keys, s3_delete_objects, S3_DELETE_BATCH_SIZE
+
+RECONCILED_PREFIXES = ["documents/", "reports/", "report_outlines/", "checkpoints/"]
+QDRANT_SCROLL_BATCH_SIZE = 1000
+
+# any stable number, every worker asks for the same lock and only the holder reconciles
+RECONCILER_LOCK_KEY = 731902114
+RECONCILER_LOCK_FILE = os.path.join(tempfile.gettempdir(), "document_index_reconciler.lock")
+
+def get_expected_keys(db: Session) -> tuple[set[str], dict[int, str], set[int]]:
+    documents = {}
+    expected_keys = set()
+    for document in db.query(Document).yield_per(1000):
+        documents[document.id] = document
+        expected_keys.add(f"documents/{document.s3_filename}.{document.s3_mime_type}")
+
+    report_json_keys = {}
+    for report in db.query(Report).yield_per(1000):
+        document = documents.get(report.document_id)
+        if document is None:
+            continue
+        report_keys = get_report_keys(report, document)
+        expected_keys.update(report_keys)
+        report_json_keys[report.id] = report_keys[0]
+
+    return expected_keys, report_json_keys, set(documents.keys())
+
+def s3_reconcile(expected_keys: set[str], s3_client: S3Client, dry_run: bool) -> tuple[int, set[str]]:
+    # objects younger than the grace period may belong to an upload whose row is not committed yet
+    grace_limit = datetime.now(timezone.utc) - timedelta(seconds=config.reconcile_grace_seconds)
+    orphaned_keys = []
+    orphaned_count = 0
+    existing_keys = set()
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for prefix in RECONCILED_PREFIXES:
+        for page in paginator.paginate(Bucket=AWS_BUCKET, Prefix=prefix):
+            for item in page.get("Contents", []):
+                key = item["Key"]
+                existing_keys.add(key)
+                if key in expected_keys or item["LastModified"] > grace_limit:
+                    continue
+                orphaned_keys.append(key)
+                orphaned_count += 1
+
+            if len(orphaned_keys) >= S3_DELETE_BATCH_SIZE:
+                if not dry_run:
+                    s3_delete_objects(orphaned_keys, s3_client)
+                orphaned_keys = []
+
+    if orphaned_keys and not dry_run:
+        s3_delete_objects(orphaned_keys, s3_client)
+
+    return orphaned_count, existing_keys
+
+async def qdrant_find_orphaned_reports(report_ids: set[int], qdrant_client: AsyncQdrantClient) -> set[int]:
+    orphaned_report_ids = set()
+    offset = None
+    while True:
+        points, offset = await qdrant_client.scroll(
+            collection_name=collection_name,
+            limit=QDRANT_SCROLL_BATCH_SIZE,
+            offset=offset,
+            with_payload=["report_id"],
+            with_vectors=False,
+        )
+        for point in points:
+            report_id = point.payload.get("report_id")
+            if report_id not in report_ids:
+                orphaned_report_ids.add(report_id)
+        if offset is None:
+            return orphaned_report_ids
+
+async def qdrant_delete_reports_points(report_ids: list[int], qdrant_client: AsyncQdrantClient) -> None:
+    await qdrant_client.delete(
+        collection_name=collection_name,
+        points_selector=models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="report_id",
+                    match=models.MatchAny(
+                        any=report_ids
+                    )
+                )
+            ]
+        ),
+        wait=True
+    )
+
+def get_created_report_ids(report_ids: set[int], report_json_keys: dict[int, str], db: Session) -> set[int]:
+    candidates = [report_id for report_id in report_ids if report_id is not None and report_id not in report_json_keys]
+    if not candidates:
+        return set()
+    return {row.id for row in db.query(Report.id).filter(Report.id.in_(candidates))}
+
+def db_repair(missing_report_ids: list[int], dry_run: bool, db: Session) -> int:
+    # the run row is persisted when processing starts, a document without a run younger than the timeout is stuck
+    timeout_limit = datetime.now() - timedelta(seconds=config.processing_timeout_seconds)
+    processing_ids = {
+        row.id for row in db.query(Document.id).filter(Document.status == DocumentStatus.PROCESSING.value)
+    }
+    active_ids = {
+        row.document_id for row in db.query(ProcessingRun.document_id).filter(
+            ProcessingRun.status == ProcessingRunStatus.RUNNING.value,
+            ProcessingRun.started_at >= timeout_limit
+        )
+    }
+    stuck_ids = processing_ids - active_ids
+
+    if not dry_run:
+        if stuck_ids:
+            db.query(Document).filter(Document.id.in_(stuck_ids)).update({Document.status: DocumentStatus.PROCESSING_FAILED.value}, synchronize_session=False)
+        # the runs of a worker that died are never finished by it
+        db.query(ProcessingRun).filter(
+            ProcessingRun.status == ProcessingRunStatus.RUNNING.value,
+            ProcessingRun.started_at < timeout_limit
+        ).update({
+            ProcessingRun.status: ProcessingRunStatus.FAILED.value,
+            ProcessingRun.finished_at: datetime.now(),
+            ProcessingRun.error_class: "ProcessingTimeout"
+        }, synchronize_session=False)
+        if missing_report_ids:
+            db.query(ProcessingCheckpoint).filter(ProcessingCheckpoint.report_id.in_(missing_report_ids)).delete(synchronize_session=False)
+            db.query(ReportFingerprint).filter(ReportFingerprint.report_id.in_(missing_report_ids)).delete(synchronize_session=False)
+            db.query(Report).filter(Report.id.in_(missing_report_ids)).delete(synchronize_session=False)
+        db.commit()
+
+    return len(stuck_ids)
+
+async def reconcile(qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session, dry_run: bool = False) -> dict[str, int]:
+    logging.info(f"Starting reconciliation, dry run {dry_run}")
+
+    expected_keys, report_json_keys, document_ids = await run_in_threadpool(get_expected_keys, db)
+
+    orphaned_objects, existing_keys = await run_in_threadpool(s3_reconcile, expected_keys, s3_client, dry_run)
+
+    # reports whose json is gone can not be searched or reprocessed, their rows and points are dropped
+    missing_report_ids = [report_id for report_id, key in report_json_keys.items() if key not in existing_keys]
+    missing_documents = sum(
+        1 for key in expected_keys
+        if key.startswith("documents/") and key not in existing_keys
+    )
+
+    orphaned_report_ids = await qdrant_find_orphaned_reports(set(report_json_keys.keys()) - set(missing_report_ids), qdrant_client)
+    # reports created after the db snapshot already have points, they are not orphans
+    created_report_ids = await run_in_threadpool(get_created_report_ids, orphaned_report_ids - set(missing_report_ids), report_json_keys, db)
+    orphaned_report_ids -= created_report_ids
+    if orphaned_report_ids and not dry_run:
+        await qdrant_delete_reports_points(list(orphaned_report_ids), qdrant_client)
+
+    stuck_documents = await run_in_threadpool(db_repair, missing_report_ids, dry_run, db)
+
+    result = {
+        "documents": len(document_ids),
+        "reports": len(report_json_keys),
+        "orphaned_objects": orphaned_objects,
+        "orphaned_point_reports": len(orphaned_report_ids),
+        "missing_report_objects": len(missing_report_ids),
+        "missing_document_objects": missing_documents,
+        "stuck_documents": stuck_documents
+    }
+    logging.info(f"Reconciliation finished {result}")
+    return result
+
+def acquire_reconciler_lock():
+    # every http worker starts the reconciler, the lock holder is the only one that runs passes
+    if engine.dialect.name == "postgresql":
+        connection = engine.connect()
+        locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": RECONCILER_LOCK_KEY}).scalar()
+        # the lock belongs to the session, the transaction is not kept open
+        connection.commit()
+        if locked:
+            return connection
+        connection.close()
+        return None
+
+    lock_file = open(RECONCILER_LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def release_reconciler_lock(lock) -> None:
+    if isinstance(lock, Connection):
+        # a pooled connection would keep holding the lock after close
+        lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECONCILER_LOCK_KEY})
+        lock.commit()
+    lock.close()
+
+async def run_reconciler() -> None:
+    lock = None
+    try:
+        while True:
+            await asyncio.sleep(config.reconcile_interval_seconds)
+            if lock is None:
+                # a worker that exits releases the lock, another one takes over on its next pass
+                lock = await run_in_threadpool(acquire_reconciler_lock)
+                if lock is None:
+                    continue
+                logging.info("This worker runs the reconciler")
+
+            qdrant_client = AsyncQdrantClient(
+                url=config.qdrant_url,
+                api_key=config.qdrant_api_key
+            )
+            s3_client = create_s3_client()
+            db = SessionLocal()
+            try:
+                await reconcile(qdrant_client, s3_client, db, config.reconcile_dry_run)
+            except Exception as e:
+                logging.exception(f"Error while reconciling storage \n {e}")
+            finally:
+                db.close()
+                s3_client.close()
+                await qdrant_client.close()
+    finally:
+        if lock is not None:
+            release_reconciler_lock(lock)
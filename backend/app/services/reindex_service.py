@@ -0,0 +1,153 @@
+import json
+import logging
+from pathlib import Path
+from uuid import NAMESPACE_OID, uuid5
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http import models
+from sqlalchemy.orm import Session
+from types_boto3_s3.client import S3Client
+
+from app.core.qdrant import collection_name
+from app.db.schema import Document, ProcessingCheckpoint, Report, ReportFingerprint
+from app.models.mineru_models import MinerUReport
+from app.models.report_models import ReportJson
+from app.services.checkpoint_service import get_checkpoint_keys
+from app.services.report_service import get_report_keys, s3_delete_objects
+
+QDRANT_COPY_BATCH_SIZE = 256
+
+def add_report_fingerprint(report: Report, fingerprints: list[str], db: Session) -> None:
+    # committed by the caller together with the document status
+    db.add(ReportFingerprint(report_id=report.id, document_id=report.document_id, pages=fingerprints))
+
+def get_reindexable_report(document_id: int, db: Session) -> tuple[Report, ReportFingerprint] | None:
+    # only completed pager and mineru reports have fingerprints, their points carry the page field
+    query = db.query(Report, ReportFingerprint).join(ReportFingerprint, ReportFingerprint.report_id == Report.id)
+    return query.filter(Report.document_id == document_id).order_by(Report.id.desc()).first()
+
+def get_page_mapping(previous_fingerprints: list[str], fingerprints: list[str]) -> tuple[dict[int, int], list[int]]:
+    # new page -> previous page for unchanged content, pages move when others are inserted or removed
+    previous_pages = {}
+    for page, fingerprint in enumerate(previous_fingerprints):
+        previous_pages.setdefault(fingerprint, []).append(page)
+
+    carried = {}
+    changed = []
+    for page, fingerprint in enumerate(fingerprints):
+        # every previous page is carried over once, repeated pages like blank ones have one set of points each
+        if previous_pages.get(fingerprint):
+            carried[page] = previous_pages[fingerprint].pop(0)
+        else:
+            changed.append(page)
+    return carried, changed
+
+def merge_pager_reports(previous: ReportJson, parsed: ReportJson, carried: dict[int, int], changed: list[int]) -> ReportJson:
+    previous_pages = {page.number: page for page in previous.pages}
+    pages = [
+        previous_pages[previous_page].model_copy(update={"number": page})
+        for page, previous_page in carried.items() if previous_page in previous_pages
+    ]
+    # the parser numbered the selected pages from zero
+    pages.extend(page.model_copy(update={"number": changed[page.number]}) for page in parsed.pages)
+    pages.sort(key=lambda page: page.number)
+    return ReportJson(pages=pages)
+
+def merge_mineru_reports(previous: MinerUReport, parsed: MinerUReport, carried: dict[int, int], changed: list[int]) -> MinerUReport:
+    previous_to_page = {previous_page: page for page, previous_page in carried.items()}
+
+    blocks = [
+        block.model_copy(update={"page_idx": previous_to_page[block.page_idx]})
+        for block in previous.content_list if block.page_idx in previous_to_page
+    ]
+    blocks.extend(block.model_copy(update={"page_idx": changed[block.page_idx]}) for block in parsed.content_list)
+    # stable, blocks keep their reading order within a page
+    blocks.sort(key=lambda block: block.page_idx)
+
+    image_names = {Path(block.img_path).name for block in blocks if getattr(block, "img_path", None)}
+    images = {name: image for name, image in (previous.images | parsed.images).items() if name in image_names}
+
+    model_output = []
+    for page_data in json.loads(previous.model_output):
+        if page_data["page_info"]["page_no"] in previous_to_page:
+            page_data["page_info"]["page_no"] = previous_to_page[page_data["page_info"]["page_no"]]
+            model_output.append(page_data)
+    for page_data in json.loads(parsed.model_output):
+        page_data["page_info"]["page_no"] = changed[page_data["page_info"]["page_no"]]
+        model_output.append(page_data)
+    model_output.sort(key=lambda page_data: page_data["page_info"]["page_no"])
+
+    return MinerUReport(content_list=blocks, images=images, model_output=json.dumps(model_output))
+
+def get_report_page_filter(report_id: int, page: int | None = None) -> models.Filter:
+    conditions = [models.FieldCondition(key="report_id", match=models.MatchValue(value=report_id))]
+    if page is not None:
+        conditions.append(models.FieldCondition(key="page", match=models.MatchValue(value=page)))
+    return models.Filter(must=conditions)
+
+async def qdrant_copy_carried_points(previous_report_id: int, report_id: int, carried: dict[int, int], point_ids: list[str], qdrant_client: AsyncQdrantClient) -> None:
+    # copied, not moved, the previous report keeps its points until the new one is committed
+    previous_to_page = {previous_page: page for page, previous_page in carried.items()}
+    if not previous_to_page:
+        return
+
+    scroll_filter = models.Filter(
+        must=[
+            models.FieldCondition(key="report_id", match=models.MatchValue(value=previous_report_id)),
+            models.FieldCondition(key="page", match=models.MatchAny(any=list(previous_to_page.keys()))),
+        ]
+    )
+    logging.info(f"Copying points of {len(previous_to_page)} pages from report {previous_report_id} to report {report_id}")
+    offset = None
+    while True:
+        points, offset = await qdrant_client.scroll(
+            collection_name=collection_name,
+            scroll_filter=scroll_filter,
+            limit=QDRANT_COPY_BATCH_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        copies = [
+            models.PointStruct(
+                id=str(uuid5(NAMESPACE_OID, f"{report_id}/carried/{point.id}")),
+                vector=point.vector,
+                payload=point.payload | {"report_id": report_id, "page": previous_to_page[point.payload["page"]]}
+            )
+            for point in points
+        ]
+        if copies:
+            point_ids.extend(copy.id for copy in copies)
+            await qdrant_client.upsert(collection_name=collection_name, points=copies, wait=True)
+        if offset is None:
+            break
+
+async def qdrant_delete_points(point_ids: list[str], qdrant_client: AsyncQdrantClient) -> None:
+    for start in range(0, len(point_ids), QDRANT_COPY_BATCH_SIZE):
+        await qdrant_client.delete(
+            collection_name=collection_name,
+            points_selector=models.PointIdsList(points=point_ids[start:start + QDRANT_COPY_BATCH_SIZE]),
+            wait=True
+        )
+
+def delete_report_rows(report: Report, db: Session) -> None:
+    # rows are only marked for deletion, the caller commits them together with its own changes
+    db.query(ReportFingerprint).filter(ReportFingerprint.report_id == report.id).delete(synchronize_session=False)
+    db.delete(report)
+
+def s3_delete_report(report: Report, document: Document, s3_client: S3Client, db: Session) -> None:
+    s3_delete_objects(get_report_keys(report, document), s3_client)
+    delete_report_rows(report, db)
+
+def get_unreindexable_reports(document: Document, db: Session) -> list[Report]:
+    # pymupdf reports and interrupted runs have no fingerprints, a reindex can not bring them to a new revision
+    query = db.query(Report).outerjoin(ReportFingerprint, ReportFingerprint.report_id == Report.id)
+    return query.filter(Report.document_id == document.id, ReportFingerprint.report_id.is_(None)).all()
+
+def s3_delete_unreindexable_reports(reports: list[Report], document: Document, s3_client: S3Client, db: Session) -> None:
+    keys = [key for report in reports for key in get_report_keys(report, document) + get_checkpoint_keys(report)]
+    s3_delete_objects(keys, s3_client)
+    report_ids = [report.id for report in reports]
+    db.query(ProcessingCheckpoint).filter(ProcessingCheckpoint.report_id.in_(report_ids)).delete(synchronize_session=False)
+    for report in reports:
+        db.delete(report)
+    db.commit()
@@ -1,30 +1,32 @@
 import asyncio
-import gc
 from io import BytesIO
 import json
 import logging
 from pathlib import Path
 import random
-import pymupdf
 from typing import Any, Union
 from PIL.Image import Image as PILImage
-from fastapi.concurrency import run_in_threadpool
 from markdownify import markdownify as md
-from uuid import uuid4
+from uuid import NAMESPACE_OID, uuid5
 from sqlalchemy.orm import Session
 from torch import Tensor
-import torch
+from app.core.admission import admission_limiters
+from app.core.executors import executors, run_inference
+from app.core.memory import release_memory
+from app.core.metrics import add_run_count, batch_sizes, points_processed, track_stage
 from app.core.ml_models import ml_models
 from types_boto3_s3.client import S3Client
 from qdrant_client import AsyncQdrantClient
-from app.db.schema import Document, Report
+from app.db.schema import Document, ProcessingCheckpoint, Report, ReportFingerprint
 from app.core.s3 import AWS_BUCKET
-from app.core.qdrant import QdrantClient, collection_name
+from app.core.qdrant import QdrantClient, collection_name, get_point_vector
 from app.core.config import config
 from qdrant_client.http import models
+from app.models.document_models import ProcessingCheckpointStage
 from app.models.report_models import ReportJson, PyMuPdfReportJson
+from app.services.checkpoint_service import get_checkpoint_keys, s3_download_checkpoint, s3_upload_checkpoint, save_processing_checkpoint
 from app.models.mineru_models import AuxiliaryBlock, MinerUReport
-from app.utility.report_utility import base64_to_pil, generate_distinct_colors, get_aspect_ratio_from_base64
+from app.utility.report_utility import base64_to_pil, get_aspect_ratio_from_base64
 
 def s3_upload_report(content: bytes, report_tag: str, s3_filename: str, document: Document, s3_client: S3Client, db: Session) -> Report:
     logging.info(f"Creating report for document {document.s3_filename}.{document.s3_mime_type} from s3")
@@ -38,49 +40,98 @@ def s3_upload_report_outline(content: bytes, report_name: str, document_type: st
     logging.info(f"Uploading report outline for report {report_name} to s3")
     s3_client.upload_fileobj(Fileobj=BytesIO(content), Bucket=AWS_BUCKET, Key=f"report_outlines/{report_name}.{document_type}")
 
+S3_DELETE_BATCH_SIZE = 1000 # delete_objects limit
+
+def get_report_outline_key(report: Report, document: Document) -> str | None:
+    if report.tag in ["pager", "mineru"]:
+        return f"report_outlines/{report.s3_filename}.{document.s3_mime_type}"
+    return None
+
+def get_report_keys(report: Report, document: Document) -> list[str]:
+    keys = [f"reports/{report.s3_filename}.json"]
+    outline_key = get_report_outline_key(report, document)
+    if outline_key is not None:
+        keys.append(outline_key)
+        # left behind by a run that was never resumed
+        keys.extend(get_checkpoint_keys(report))
+    return keys
+
+def s3_delete_objects(keys: list[str], s3_client: S3Client) -> None:
+    for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+        batch = keys[start:start + S3_DELETE_BATCH_SIZE]
+        logging.info(f"Deleting {len(batch)} objects from s3")
+        response = s3_client.delete_objects(
+            Bucket=AWS_BUCKET,
+            Delete={
+                "Objects": [{"Key": key} for key in batch],
+                "Quiet": True
+            }
+        )
+        errors = response.get("Errors", [])
+        if errors:
+            for error in errors:
+                logging.error(f"Failed to delete {error.get('Key')} from s3: {error.get('Code')} {error.get('Message')}")
+            raise Exception(f"Failed to delete {len(errors)} objects from s3")
+
 async def delete_reports(document: Document, qdrant_client: AsyncQdrantClient, s3_client: S3Client, db: Session) -> None:
-    await qdrant_delete_reports_points(document, qdrant_client)
+    await qdrant_delete_documents_points([document.id], qdrant_client)
 
     logging.info(f"Deleting reports for {document.id}")
-    await run_in_threadpool(s3_delete_reports, document, s3_client, db)
+    await executors["io"].run(s3_delete_reports, document, s3_client, db)
 
-def s3_delete_reports(document: Document, s3_client: S3Client, db: Session) -> Report:
+def s3_delete_reports(document: Document, s3_client: S3Client, db: Session) -> None:
+    # rows are only marked for deletion, the caller commits them together with its own changes
     reports = db.query(Report).filter(Report.document_id == document.id).all()
+    keys = [key for report in reports for key in get_report_keys(report, document)]
+    logging.info(f"Deleting {len(reports)} reports from s3 for document {document.id}")
+    s3_delete_objects(keys, s3_client)
+    db.query(ProcessingCheckpoint).filter(ProcessingCheckpoint.document_id == document.id).delete(synchronize_session=False)
+    db.query(ReportFingerprint).filter(ReportFingerprint.document_id == document.id).delete(synchronize_session=False)
     for report in reports:
-        logging.info(f"Deleting report {report.s3_filename} from s3 for document {report.document_id}")
-        s3_client.delete_object(Bucket=AWS_BUCKET, Key=f"reports/{report.s3_filename}.json")
-        if report.tag in ["mineru", "pager"]:
-            s3_client.delete_object(Bucket=AWS_BUCKET, Key=f"report_outlines/{report.s3_filename}.{document.s3_mime_type}")
         db.delete(report)
-        db.commit()
 
-async def qdrant_delete_reports_points(document: Document, qdrant_client: AsyncQdrantClient):
+async def qdrant_delete_documents_points(document_ids: list[int], qdrant_client: AsyncQdrantClient):
     filter_condition = models.Filter(
         must=[
             models.FieldCondition(
                 key="document_id",
-                match=models.MatchValue(
-                    value=document.id
+                match=models.MatchAny(
+                    any=document_ids
                 )
             )
         ]
     )
 
-    logging.info(f"Deleting vectors for reports of document {document.id}")
+    logging.info(f"Deleting vectors for reports of documents {document_ids}")
     await qdrant_client.delete(
         collection_name=collection_name,
         points_selector=filter_condition,
         wait=True
     )
 
-def get_texts_and_labels(report: ReportJson):
+def get_region_seen_key(region) -> str | tuple[str, str]:
+    if region.label != "figure":
+        return region.text
+    return (region.text, region.base64) if region.text else region.base64
+
+def get_texts_and_labels(report: ReportJson, pages: set[int] | None = None):
     data = []
     embedding_data = []
     labels = []
+    point_pages = []
     seen = set()
     
     for page in report.pages:
+        # pages outside of pages are indexed already, their regions only keep duplicates out
+        if pages is not None and page.number not in pages:
+            seen.update(get_region_seen_key(region) for region in page.regions)
+            continue
+
         for region in page.regions:
+            seen_key = get_region_seen_key(region)
+            if seen_key in seen:
+                continue
+
             if region.label == "figure":
                 base64_image = f"data:image/png;base64,{region.base64}"
                 if get_aspect_ratio_from_base64(base64_image) >= 200:
@@ -95,76 +146,100 @@ def get_texts_and_labels(report: ReportJson):
                         "text": region.text,
                         "image": base64_to_pil(base64_image)
                     }
-                    seen_key = (region.text, region.base64)
                 else:
                     current_data = {
                         "image": base64_image
                     }
                     current_embedding_data = base64_to_pil(base64_image)
-                    seen_key = region.base64
             else:
                 current_data = region.text
                 current_embedding_data = region.text
-                seen_key = region.text
 
-            if seen_key not in seen:
-                seen.add(seen_key)
-                data.append(current_data)
-                embedding_data.append(current_embedding_data)
-                labels.append(region.label)
+            seen.add(seen_key)
+            data.append(current_data)
+            embedding_data.append(current_embedding_data)
+            labels.append(region.label)
+            point_pages.append(page.number)
 
-    return data, embedding_data, labels
+    return data, embedding_data, labels, point_pages
 
 
-def get_points(data: list[Any], labels: list[str], embeddings: Tensor, document_id: int, report_id: int) -> list[models.PointStruct]:
+def get_points(data: list[Any], labels: list[str], embeddings: Tensor, document_id: int, report_id: int, pages: list[int] | None = None) -> list[models.PointStruct]:
     points = []
-    for element, label, embedding in zip(data, labels, embeddings):
+    for index, (element, label, embedding) in enumerate(zip(data, labels, embeddings)):
         if isinstance(element, str) and len(element) == 0:
             continue
+        payload = {
+            "document_id": document_id,
+            "report_id": report_id,
+            "label": label,
+            "data": element
+        }
+        # reindexing replaces the points of changed pages only
+        if pages is not None:
+            payload["page"] = pages[index]
         points.append(
             models.PointStruct(
-                id = uuid4(),
-                vector = embedding[:512],
-                payload = {
-                    "document_id": document_id,
-                    "report_id": report_id,
-                    "label": label,
-                    "data": element
-                }
+                # stable ids, upserting the same chunk again after a resume overwrites instead of duplicating
+                id = uuid5(NAMESPACE_OID, f"{report_id}/{index}"),
+                vector = get_point_vector(embedding),
+                payload = payload
             )
         )
             
     return points
 
-async def process_pager_report(report: ReportJson, document_id: int, report_id: int, qdrant_client: QdrantClient) -> None:
+async def embed_checkpointed(pipeline: str, prepare, report_obj, report: Report, checkpoint: ProcessingCheckpoint, s3_client: S3Client, db: Session):
+    if checkpoint.stage != ProcessingCheckpointStage.PARSED.value:
+        with track_stage(pipeline, "load_checkpoint"):
+            return await executors["io"].run(s3_download_checkpoint, report, pipeline, s3_client)
 
+    with track_stage(pipeline, "prepare"):
+        data, embedding_data, labels, pages = await executors["cpu"].run(prepare, report_obj)
 
-    data, embedding_data, labels = await run_in_threadpool(get_texts_and_labels, report)
+    with track_stage(pipeline, "encode"):
+        async with admission_limiters["embedding"].acquire(shed=False):
+            embeddings = await run_inference(ml_models["embedding_model"].encode, embedding_data, batch_size=1)
+    batch_sizes.labels("processing_encode").observe(len(embedding_data))
 
-    with torch.inference_mode():
-        embeddings = await run_in_threadpool(ml_models["embedding_model"].encode, embedding_data, batch_size=1)
+    with track_stage(pipeline, "checkpoint"):
+        await executors["io"].run(s3_upload_checkpoint, data, labels, pages, embeddings, report, pipeline, s3_client)
+        await executors["io"].run(save_processing_checkpoint, checkpoint, ProcessingCheckpointStage.EMBEDDED, db)
 
-    # embeddings = []
+    return data, labels, pages, embeddings
 
-    # for element in embedding_data:
-    #     print(element)
-    #     await asyncio.sleep(5) 
-    #     with torch.inference_mode():
-    #         data = ml_models["embedding_model"].encode(element, batch_size=1)
-    #     embeddings.append(data)
+async def upsert_checkpointed(pipeline: str, points: list[models.PointStruct], checkpoint: ProcessingCheckpoint, qdrant_client: QdrantClient, db: Session) -> None:
+    batch_size = config.checkpoint_upsert_batch_size
+    with track_stage(pipeline, "upsert"):
+        for batch, start in enumerate(range(0, len(points), batch_size)):
+            if batch in checkpoint.upserted_batches:
+                continue
+            await qdrant_client.upsert(
+                collection_name=collection_name,
+                points=points[start:start + batch_size],
+                wait=True
+            )
+            await executors["io"].run(save_processing_checkpoint, checkpoint, None, db, batch)
+    await executors["io"].run(save_processing_checkpoint, checkpoint, ProcessingCheckpointStage.UPSERTED, db)
 
-    points = await run_in_threadpool(get_points, data, labels, embeddings, document_id, report_id)
+async def process_checkpointed_report(pipeline: str, prepare, report_obj, report: Report, checkpoint: ProcessingCheckpoint, qdrant_client: QdrantClient, s3_client: S3Client, db: Session) -> None:
+    # every finished stage is recorded, a resumed run continues after the last one
+    if checkpoint.stage == ProcessingCheckpointStage.UPSERTED.value:
+        return
 
-    if len(points) > 0:
-        await qdrant_client.upsert(
-            collection_name=collection_name,
-            points=points,
-            wait=True
-        )
+    data, labels, pages, embeddings = await embed_checkpointed(pipeline, prepare, report_obj, report, checkpoint, s3_client, db)
+
+    points = await executors["cpu"].run(get_points, data, labels, embeddings, report.document_id, report.id, pages)
+
+    await upsert_checkpointed(pipeline, points, checkpoint, qdrant_client, db)
+    points_processed.labels(pipeline, "upsert").inc(len(points))
+    add_run_count("point_count", len(points))
 
     del embeddings
-    gc.collect()
-    torch.cuda.empty_cache()
+    await executors["cpu"].run(release_memory)
+
+async def process_pager_report(report_obj: ReportJson, report: Report, checkpoint: ProcessingCheckpoint, qdrant_client: QdrantClient, s3_client: S3Client, db: Session) -> None:
+    await process_checkpointed_report("pager", get_texts_and_labels, report_obj, report, checkpoint, qdrant_client, s3_client, db)
 
 def chunk_document(report: PyMuPdfReportJson):
     data, embedding_data = [], []
@@ -202,38 +277,47 @@ def chunk_document(report: PyMuPdfReportJson):
 
 async def process_pymupdf_full_report(report: PyMuPdfReportJson, document_id: int, report_id: int, qdrant_client: QdrantClient) -> None:
 
-    data, embedding_data = await run_in_threadpool(chunk_document, report)
+    with track_stage("pymupdf_full", "prepare"):
+        data, embedding_data = await executors["cpu"].run(chunk_document, report)
 
-    with torch.inference_mode():
-        embeddings = await run_in_threadpool(ml_models["embedding_model"].encode, embedding_data, batch_size=1)
+    with track_stage("pymupdf_full", "encode"):
+        async with admission_limiters["embedding"].acquire(shed=False):
+            embeddings = await run_inference(ml_models["embedding_model"].encode, embedding_data, batch_size=1)
+    batch_sizes.labels("processing_encode").observe(len(embedding_data))
 
     # embeddings = []
 
     # for element in embedding_data:
     #     embeddings.append(ml_models["embedding_model"].encode(element))
 
-    points = await run_in_threadpool(get_points, data, [None] * len(data), embeddings, document_id, report_id)
+    points = await executors["cpu"].run(get_points, data, [None] * len(data), embeddings, document_id, report_id)
 
     if len(points) > 0:
-        await qdrant_client.upsert(
-            collection_name=collection_name,
-            points=points,
-            wait=True
-        )
+        with track_stage("pymupdf_full", "upsert"):
+            await qdrant_client.upsert(
+                collection_name=collection_name,
+                points=points,
+                wait=True
+            )
+    points_processed.labels("pymupdf_full", "upsert").inc(len(points))
+    add_run_count("point_count", len(points))
 
     del embeddings
-    gc.collect()
-    torch.cuda.empty_cache()
+    await executors["cpu"].run(release_memory)
 
-def mineru_get_texts_and_labels(report: MinerUReport):
+def mineru_get_texts_and_labels(report: MinerUReport, pages: set[int] | None = None):
     blocks = report.content_list
     images = report.images
     data = []
     embedding_data = []
     labels = []
+    point_pages = []
 
     seen = set()
     for block in blocks:
+        # blocks of pages outside of pages are indexed already, they only keep duplicates out
+        emitted = pages is None or block.page_idx in pages
+
         def convert(list):
             content_list = []
             for item in list:
@@ -263,7 +347,7 @@ def mineru_get_texts_and_labels(report: MinerUReport):
                         "url": image_base64
                     },
                 })
-                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64)})
+                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64) if emitted else None})
             
             if block.image_footnote:
                 image_footnote = convert(block.image_footnote)
@@ -285,7 +369,7 @@ def mineru_get_texts_and_labels(report: MinerUReport):
                         "url": image_base64
                     },
                 })
-                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64)})
+                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64) if emitted else None})
 
             if block.table_body:
                 md_body = md(block.table_body)
@@ -313,7 +397,7 @@ def mineru_get_texts_and_labels(report: MinerUReport):
                         "url": image_base64
                     },
                 })
-                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64)})
+                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64) if emitted else None})
 
             if block.content:
                 content.append({"type": "text", "text": block.content})   
@@ -334,7 +418,7 @@ def mineru_get_texts_and_labels(report: MinerUReport):
                         "url": image_base64
                     },
                 })
-                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64)})
+                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64) if emitted else None})
 
             if block.text:
                 content.append({"type": "text", "text": block.text})   
@@ -373,7 +457,7 @@ def mineru_get_texts_and_labels(report: MinerUReport):
                         "url": image_base64
                     },
                 })
-                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64)})
+                embedding_content.append({"type": "image", "image": base64_to_pil(image_base64) if emitted else None})
 
             if block.text:
                 content.append({"type": "text", "text": block.text})   
@@ -384,6 +468,8 @@ def mineru_get_texts_and_labels(report: MinerUReport):
 
             if seen_key not in seen:
                 seen.add(seen_key)
+                if not emitted:
+                    continue
                 data.append(content)
                 embedding_data.append([
                     {
@@ -392,232 +478,60 @@ def mineru_get_texts_and_labels(report: MinerUReport):
                     },
                 ])
                 labels.append(block.type)
+                point_pages.append(block.page_idx)
 
-    return data, embedding_data, labels
+    return data, embedding_data, labels, point_pages
 
 
 
-async def process_mineru_report(report: MinerUReport, document_id: int, report_id: int, qdrant_client: QdrantClient) -> None:
+async def process_mineru_report(report_obj: MinerUReport, report: Report, checkpoint: ProcessingCheckpoint, qdrant_client: QdrantClient, s3_client: S3Client, db: Session) -> None:
+    await process_checkpointed_report("mineru", mineru_get_texts_and_labels, report_obj, report, checkpoint, qdrant_client, s3_client, db)
 
-    data, embedding_data, labels = await run_in_threadpool(mineru_get_texts_and_labels, report)
 
-    # result = "".join([f"\n\n{labels[i]}\nSTART\n{el}\nEND\n\n" for i, el in enumerate(texts)])
-    # print(result)
+REPORT_PREPARERS = {
+    "pager": get_texts_and_labels,
+    "mineru": mineru_get_texts_and_labels,
+}
 
-    # print(len(texts), len(labels))
+async def process_report_pages(pipeline: str, report_obj: ReportJson | MinerUReport, pages: set[int], report: Report, point_ids: list[str], qdrant_client: QdrantClient) -> None:
+    # only the given pages are embedded, points of the other pages are carried over from the previous report
+    with track_stage(pipeline, "prepare"):
+        data, embedding_data, labels, point_pages = await executors["cpu"].run(REPORT_PREPARERS[pipeline], report_obj, pages)
+    if not embedding_data:
+        return
 
-    with torch.inference_mode():
-        embeddings = await run_in_threadpool(ml_models["embedding_model"].encode, embedding_data, batch_size=1)
+    with track_stage(pipeline, "encode"):
+        async with admission_limiters["embedding"].acquire(shed=False):
+            embeddings = await run_inference(ml_models["embedding_model"].encode, embedding_data, batch_size=1)
+    batch_sizes.labels("processing_encode").observe(len(embedding_data))
 
-    points = await run_in_threadpool(get_points, data, labels, embeddings, document_id, report_id)
+    points = await executors["cpu"].run(get_points, data, labels, embeddings, report.document_id, report.id, point_pages)
+    # recorded before the upsert, a failed reindex drops exactly the points it wrote
+    point_ids.extend(str(point.id) for point in points)
 
-    await qdrant_client.upsert(
-        collection_name=collection_name,
-        points=points,
-        wait=True
-    )
+    with track_stage(pipeline, "upsert"):
+        for start in range(0, len(points), config.checkpoint_upsert_batch_size):
+            await qdrant_client.upsert(
+                collection_name=collection_name,
+                points=points[start:start + config.checkpoint_upsert_batch_size],
+                wait=True
+            )
+    points_processed.labels(pipeline, "upsert").inc(len(points))
+    add_run_count("point_count", len(points))
 
     del embeddings
-    gc.collect()
-    torch.cuda.empty_cache()
-
-
-FONT_SIZE = 9
-
-def outline_pager_report(report: ReportJson, report_name: str, document_obj: id, document_type) -> bytes:
-
-    unique_labels = sorted({
-        region.label
+    await executors["cpu"].run(release_memory)
+
+def get_pager_outline_regions(report: ReportJson) -> list[tuple[int, list[tuple[int, int, int, int, str]]]]:
+    # plain tuples for the pdf process pool instead of the whole report
+    return [
+        (page.number, [
+            (region.segment.x_top_left, region.segment.y_top_left, region.segment.width, region.segment.height, region.label)
+            for region in page.regions
+        ])
         for page in report.pages
-        for region in page.regions
-    })
-
-    generated_colors = generate_distinct_colors(len(unique_labels))
-
-    label_colors = {
-        label: generated_colors[i]
-        for i, label in enumerate(unique_labels)
-    }
-
-    document = pymupdf.open(stream=document_obj, filetype=document_type)
-
-    for page in report.pages:
-        page_number = page.number
-
-        if page_number >= len(document):
-            logging.info(f"Skipping page {page_number}: page not found in PDF, report {report_name}")
-            continue
-
-        document_page = document[page_number]
-
-        shape = document_page.new_shape()
-
-        for region in page.regions:
-            segment = region.segment
-
-            x = segment.x_top_left
-            y = segment.y_top_left
-            w = segment.width
-            h = segment.height
-
-            label = region.label
-            color = label_colors[label]
-
-            rect = pymupdf.Rect(x, y, x + w, y + h)
-
-            shape.draw_rect(rect)
-
-            shape.finish(
-                color=color,
-                fill=color,
-                fill_opacity=0.15,
-                width=1,
-            )
-
-            text_width = pymupdf.get_text_length(label, fontsize=FONT_SIZE)
-            text_height = FONT_SIZE
-            padding = 3
-
-            rect_x0 = x
-            rect_y0 = y - text_height - (padding * 2)
-            rect_x1 = rect_x0 + text_width + (padding * 2)
-            rect_y1 = y
-
-            rect = pymupdf.Rect(rect_x0, rect_y0, rect_x1, rect_y1)
-
-            shape.draw_rect(rect)
-
-            shape.finish(
-                color=color,
-                fill=color,
-                fill_opacity=1.0,
-                width=1,
-            )
-
-            text_x = rect_x0 + padding
-            text_y = rect_y1 - padding - 1
-
-            shape.insert_text(
-                (text_x, text_y),
-                label,
-                fontsize=FONT_SIZE,
-                color=(0, 0, 0),
-            )
-
-        shape.commit(overlay=True)
-
-    updated_document_obj = document.tobytes(incremental=False)
-    document.close()
-
-    return updated_document_obj
-
-def outline_mineru_report(report: MinerUReport, report_name: str, document_obj: id, document_type) -> bytes:
-
-    pages_data = json.loads(report.model_output)
-
-    unique_labels = sorted({
-        item.get("label", "unknown")
-        for page in pages_data
-        for item in page.get("layout_dets", [])
-    })
-
-    generated_colors = generate_distinct_colors(len(unique_labels))
-
-    label_colors = {
-        label: generated_colors[i]
-        for i, label in enumerate(unique_labels)
-    }
-
-    document = pymupdf.open(stream=document_obj, filetype=document_type)
-
-    for page_data in pages_data:
-
-        page_info = page_data["page_info"]
-
-        page_number = page_info["page_no"]
-
-        if page_number >= len(document):
-            logging.info(f"Skipping page {page_number}: page not found in PDF, report {report_name}")
-            continue
-
-        page = document[page_number]
-
-        source_width = page_info["width"]
-        source_height = page_info["height"]
-
-        pdf_width = page.rect.width
-        pdf_height = page.rect.height
-
-        scale_x = pdf_width / source_width
-        scale_y = pdf_height / source_height
-
-        shape = page.new_shape()
-
-        for item in page_data.get("layout_dets", []):
-
-            label = item.get("label")
-
-            if label == "ocr_text":
-                continue
-
-            bbox = item.get("bbox")
-
-            if not bbox or len(bbox) != 4:
-                continue
-
-            x0, y0, x1, y1 = bbox
-
-            x0 *= scale_x
-            x1 *= scale_x
-            y0 *= scale_y
-            y1 *= scale_y
-
-            rect = pymupdf.Rect(x0, y0, x1, y1)
-
-            shape.draw_rect(rect)
-
-            color = label_colors[label]
-
-            shape.finish(
-                color=color,
-                fill=color,
-                fill_opacity=0.15,
-                width=1,
-            )
-
-            text_width = pymupdf.get_text_length(label, fontsize=FONT_SIZE)
-            text_height = FONT_SIZE
-            padding = 3
-
-            rect_x0 = x0
-            rect_y0 = y0 - text_height - (padding * 2)
-            rect_x1 = rect_x0 + text_width + (padding * 2)
-            rect_y1 = y0
-
-            rect = pymupdf.Rect(rect_x0, rect_y0, rect_x1, rect_y1)
-
-            shape.draw_rect(rect)
-
-            shape.finish(
-                color=color,
-                fill=color,
-                fill_opacity=1,
-                width=1,
-            )
-
-            text_x = rect_x0 + padding
-            text_y = rect_y1 - padding - 1
-
-            shape.insert_text(
-                (text_x, text_y),
-                label,
-                fontsize=FONT_SIZE,
-                color=(0, 0, 0),
-            )
-
-        shape.commit(overlay=True)
-
-    updated_document_obj = document.tobytes(incremental=False)
-    document.close()
+    ]
 
-    return updated_document_obj
\ No newline at end of file
+def get_mineru_outline_data(report: MinerUReport) -> str:
+    # the outline only reads the layout of the model output
+    return report.model_output
@@ -0,0 +1,189 @@
+import logging
+import time
+from typing import Any
+from PIL.Image import Image as PILImage
+from qdrant_client import models
+import torch
+
+from app.core.config import config
+from app.core.admission import admission_limiters
+from app.core.executors import executors
+from app.core.memory import release_memory
+from app.core.metrics import batch_sizes, points_processed
+from app.core.ml_models import ml_models
+from app.utility.report_utility import base64_to_pil
+
+def get_rerank_fragments(points: list[models.ScoredPoint]) -> list[Any]:
+    fragments = []
+    for item in points:
+        data = item.payload.get("data", "")
+        if isinstance(data, dict):
+            if "image" not in data:
+                fragments.append(data.get("text", ""))
+            elif "text" not in data:
+                fragments.append(base64_to_pil(data.get("image", "")))
+            else:
+                fragments.append({
+                    "text": data.get("text", ""),
+                    "image": base64_to_pil(data.get("image", ""))
+                })
+        elif isinstance(data, list):
+            intermediate_form = {}
+            for index, element in enumerate(data):
+                if "image_url" in element:
+                    base64_image = element["image_url"]["url"]
+                    intermediate_form["image"] = base64_to_pil(base64_image)
+                if "text" in element:
+                    if "text" not in intermediate_form:
+                        intermediate_form["text"] = []
+                    intermediate_form["text"].append(element["text"])
+            fragments.append(intermediate_form)
+        else:
+            fragments.append(data)
+
+    return fragments
+
+def has_image(fragment: Any) -> bool:
+    if isinstance(fragment, PILImage):
+        return True
+    return isinstance(fragment, dict) and "image" in fragment
+
+def get_fragment_cost(fragment: Any) -> int:
+    if isinstance(fragment, str):
+        return len(fragment)
+    if isinstance(fragment, PILImage):
+        return fragment.width * fragment.height
+
+    cost = 0
+    text = fragment.get("text", "")
+    if isinstance(text, list):
+        text = "".join(text)
+    cost += len(text)
+    if "image" in fragment:
+        cost += fragment["image"].width * fragment["image"].height
+    return cost
+
+def get_rerank_candidate_count(scores: list[float]) -> int:
+    # candidates far below the best dense score almost never make it to the top after reranking
+    threshold = scores[0] - config.rerank_score_window
+    count = sum(1 for score in scores if score >= threshold)
+    count = min(count, config.rerank_max_candidates)
+    return max(count, min(config.rerank_min_candidates, len(scores)))
+
+def is_clearly_separated(scores: list[float]) -> bool:
+    return len(scores) < 2 or scores[0] - scores[1] >= config.rerank_skip_margin
+
+def rank_pairs(pairs: list[tuple[str, Any]], deadline: float | None) -> list[tuple[int, float]]:
+    text_indices = [i for i, (_, fragment) in enumerate(pairs) if not has_image(fragment)]
+    image_indices = [i for i, (_, fragment) in enumerate(pairs) if has_image(fragment)]
+
+    # similar sized inputs in one batch keep padding low,
+    # text goes first because it is cheap and usually decides the ranking
+    groups = [
+        (sorted(text_indices, key=lambda i: get_fragment_cost(pairs[i][1])), config.rerank_text_batch_size),
+        (sorted(image_indices, key=lambda i: get_fragment_cost(pairs[i][1])), config.rerank_image_batch_size),
+    ]
+
+    scored = []
+    for indices, batch_size in groups:
+        for start in range(0, len(indices), batch_size):
+            if deadline is not None and time.monotonic() > deadline:
+                logging.info(f"Rerank time budget exceeded, {len(scored)} of {len(pairs)} candidates scored")
+                return scored
+
+            batch = indices[start:start + batch_size]
+            batch_sizes.labels("rerank").observe(len(batch))
+            with torch.inference_mode():
+                scores = ml_models["reranker_model"].predict([pairs[i] for i in batch], batch_size=len(batch))
+            scored.extend(zip(batch, [float(score) for score in scores]))
+
+    return scored
+
+def rank_fragments(query: str, fragments: list[Any], deadline: float | None) -> list[tuple[int, float]]:
+    return rank_pairs([(query, fragment) for fragment in fragments], deadline)
+
+def get_deadline(time_budget: float | None) -> float | None:
+    if time_budget is None:
+        time_budget = config.rerank_time_budget_seconds
+    return time.monotonic() + time_budget if time_budget > 0 else None
+
+def order_reranked_points(points: list[models.ScoredPoint], scored: list[tuple[int, float]], top_k: int) -> list[models.ScoredPoint]:
+    scored.sort(key=lambda item: item[1], reverse=True)
+    points_processed.labels("rerank", "scored").inc(len(scored))
+
+    # whatever was not scored keeps the dense order after the reranked candidates
+    order = [index for index, _ in scored]
+    scored_indices = set(order)
+    order.extend(index for index in range(len(points)) if index not in scored_indices)
+
+    return [points[index] for index in order[:top_k]]
+
+async def rerank_points(text: str, points: list[models.ScoredPoint], top_k: int = 10, time_budget: float | None = None) -> list[models.ScoredPoint]:
+    scores = [point.score for point in points]
+
+    if is_clearly_separated(scores):
+        logging.info("Skipping rerank, top dense scores are clearly separated")
+        return points[:top_k]
+
+    candidate_count = get_rerank_candidate_count(scores)
+    candidates = points[:candidate_count]
+
+    fragments = await executors["cpu"].run(get_rerank_fragments, candidates)
+    deadline = get_deadline(time_budget)
+
+    async with admission_limiters["reranker"].acquire():
+        scored = await executors["inference"].run(rank_fragments, text, fragments, deadline)
+
+    top_ranked = order_reranked_points(points, scored, top_k)
+
+    del fragments
+    await executors["cpu"].run(release_memory)
+
+    return top_ranked
+
+async def rerank_points_batch(texts: list[str], points_lists: list[list[models.ScoredPoint]], top_k: int = 10) -> list[list[models.ScoredPoint] | Exception]:
+    # the candidates of all questions share one call to the model, each question gets its ranking or its own error back
+    results: list[list[models.ScoredPoint] | Exception] = []
+    pairs = []
+    owners = []
+    for question_index, (text, points) in enumerate(zip(texts, points_lists)):
+        scores = [point.score for point in points]
+        if is_clearly_separated(scores):
+            results.append(points[:top_k])
+            continue
+        try:
+            fragments = await executors["cpu"].run(get_rerank_fragments, points[:get_rerank_candidate_count(scores)])
+        except Exception as e:
+            logging.exception(f"Error while preparing rerank candidates of batch question {question_index} \n {e}")
+            results.append(e)
+            continue
+        results.append([])
+        for point_index, fragment in enumerate(fragments):
+            pairs.append((text, fragment))
+            owners.append((question_index, point_index))
+
+    if not pairs:
+        return results
+
+    # the budget of a single rerank for every question that is reranked
+    reranked = {question_index for question_index, _ in owners}
+    time_budget = config.rerank_time_budget_seconds * len(reranked)
+    try:
+        async with admission_limiters["reranker"].acquire():
+            scored = await executors["inference"].run(rank_pairs, pairs, get_deadline(time_budget))
+    except Exception as e:
+        for question_index in reranked:
+            results[question_index] = e
+        return results
+
+    scored_by_question = {question_index: [] for question_index in reranked}
+    for pair_index, score in scored:
+        question_index, point_index = owners[pair_index]
+        scored_by_question[question_index].append((point_index, score))
+    for question_index, question_scored in scored_by_question.items():
+        results[question_index] = order_reranked_points(points_lists[question_index], question_scored, top_k)
+
+    del pairs
+    await executors["cpu"].run(release_memory)
+
+    return results
@@ -0,0 +1,354 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import re
+import pymupdf
+from pymupdf import Page, Document as PyMuPDFDoc
+from PIL import Image, ImageFile
+
+from app.models.report_models import PyMuPdfPage, PyMuPdfPartialPage, PyMuPdfPartialReportJson, PyMuPdfReportJson
+from app.utility.report_utility import generate_distinct_colors, safe_open_image
+
+# jobs of the pdf process pool, its spawned workers import this module and nothing of the ml stack
+# they only take and return plain data and pydantic models
+
+def get_page_text(page: Page):
+    text = page.get_text(sort=True)
+    text = re.sub(' +', ' ', text)
+    lines = [line for line in text.splitlines() if line.strip()]
+    cleaned_text = "\n".join(lines)
+
+    return cleaned_text
+
+# def get_page_images(page: Page, pymupdf_doc: PyMuPDFDoc) -> list[str]: 
+#     base64_images = []
+
+#     image_list = page.get_images(full=True) 
+
+#     for img in image_list: 
+#         xref = img[0] 
+
+#         base_image = pymupdf_doc.extract_image(xref) 
+
+#         image_bytes = base_image["image"] 
+#         image_ext = base_image["ext"] 
+
+#         base64_string = base64.b64encode(image_bytes).decode("utf-8") 
+#         data_uri = f"data:image/{image_ext};base64,{base64_string}" 
+        
+#         base64_images.append(data_uri) 
+    
+#     return base64_images
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+def get_page_images(page: Page, pymupdf_doc: PyMuPDFDoc) -> list[str]: 
+    base64_images = []
+    image_list = page.get_images(full=True) 
+
+    for img in image_list: 
+        xref = img[0] 
+        base_image = pymupdf_doc.extract_image(xref) 
+        
+        image_bytes = base_image["image"] 
+
+        image = safe_open_image(image_bytes)
+
+        if image is None:
+            continue
+
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        width, height = image.size
+
+        # Skip extreme aspect ratios
+        aspect_ratio = max(width / height, height / width)
+        if aspect_ratio >= 200:
+            continue
+
+        if width > 512 or height > 512:
+            image.thumbnail((512, 512), Image.Resampling.LANCZOS)
+            
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        
+        image_bytes = buffer.getvalue()
+
+        base64_string = base64.b64encode(image_bytes).decode("utf-8") 
+        data_uri = f"data:image/jpeg;base64,{base64_string}" 
+        
+        base64_images.append(data_uri) 
+    
+    return base64_images
+
+def pymupdf_full_extract(file_content: bytes, mime_type: str, document_name: str) -> tuple[PyMuPdfReportJson, bytes]:
+    pymupdf_doc = pymupdf.open(stream=file_content, filetype=mime_type)
+
+    pages_data  = []
+    for  page in pymupdf_doc:
+        page_text = get_page_text(page)
+        page_images = get_page_images(page, pymupdf_doc)
+        pages_data.append(PyMuPdfPage(page_number=page.number, text=page_text, images=page_images))
+
+    pymupdf_doc.close()
+
+    report_data = PyMuPdfReportJson(
+        document_name=document_name,
+        total_pages=len(pages_data),
+        pages=pages_data
+    )
+
+    return report_data, report_data.model_dump_json(indent=2).encode("utf-8")
+
+def get_pages_start_end(document_id: int, start: int, end: int, total_pages: int, num_of_images_input: int = 30):
+    # All page ids mentioned are based on the order in the raw document.
+    # context_start_end: page start/end id of context in qa generation
+    # num_of_images_input: the number of input images, 30 images in cut-off paradigm
+    # total_pages: total pages in the raw document
+    # img_start, img_end: input page start/end id
+    raw_start_page, raw_end_page = start, end
+    raw_pages_len = raw_end_page - raw_start_page
+    img_start = max(0, raw_start_page - (num_of_images_input - raw_pages_len)//2)
+    img_end = img_start + num_of_images_input
+    if img_end >= total_pages:
+        img_end = total_pages
+        img_start = max(0, img_end - num_of_images_input)
+    logging.info(f"Document {document_id}: start  {start}, end {end}, page number {total_pages}")
+    logging.info(f"result is [{img_start}, {img_end}]")
+    return img_start, img_end
+
+def pymupdf_partial_render(file_content: bytes, mime_type: str, document_name: str, document_id: int, start: int, end: int) -> tuple[bytes, int]:
+    pymupdf_doc = pymupdf.open(stream=file_content, filetype=mime_type)
+
+    part_start, part_end = get_pages_start_end(document_id, start, end, pymupdf_doc.page_count)
+
+    pages_data  = []
+    for page in pymupdf_doc.pages(start=part_start, stop=part_end):
+        pix = page.get_pixmap()
+        image_bytes = pix.tobytes("png")
+        page_data = f"data:image/png;base64,{base64.b64encode(image_bytes).decode("utf-8")}"
+        pages_data.append(PyMuPdfPartialPage(page_number=page.number, image=page_data))
+
+    report_data = PyMuPdfPartialReportJson(
+        document_name=document_name,
+        total_pages=pymupdf_doc.page_count,
+        pages=pages_data
+    )
+
+    pymupdf_doc.close()
+
+    return report_data.model_dump_json(indent=2).encode("utf-8"), len(pages_data)
+
+def get_page_fingerprints(file_content: bytes, mime_type: str, dpi: int) -> list[str]:
+    # text and a coarse rendering, a change in either can change what the parsers return for the page
+    document = pymupdf.open(stream=file_content, filetype=mime_type)
+    fingerprints = []
+    for page in document:
+        digest = hashlib.sha256()
+        digest.update(page.get_text("text").encode("utf-8"))
+        digest.update(page.get_pixmap(dpi=dpi).samples)
+        fingerprints.append(digest.hexdigest())
+    document.close()
+    return fingerprints
+
+def select_pages(file_content: bytes, mime_type: str, pages: list[int]) -> bytes:
+    document = pymupdf.open(stream=file_content, filetype=mime_type)
+    document.select(pages)
+    # objects only used by the dropped pages are left out of the upload
+    content = document.tobytes(garbage=3, deflate=True)
+    document.close()
+    return content
+
+FONT_SIZE = 9
+
+def outline_pager_report(pages: list[tuple[int, list[tuple[int, int, int, int, str]]]], report_name: str, document_obj: bytes, document_type: str) -> bytes:
+
+    unique_labels = sorted({
+        label
+        for _, regions in pages
+        for *_, label in regions
+    })
+
+    generated_colors = generate_distinct_colors(len(unique_labels))
+
+    label_colors = {
+        label: generated_colors[i]
+        for i, label in enumerate(unique_labels)
+    }
+
+    document = pymupdf.open(stream=document_obj, filetype=document_type)
+
+    for page_number, regions in pages:
+
+        if page_number >= len(document):
+            logging.info(f"Skipping page {page_number}: page not found in PDF, report {report_name}")
+            continue
+
+        document_page = document[page_number]
+
+        shape = document_page.new_shape()
+
+        for x, y, w, h, label in regions:
+            color = label_colors[label]
+
+            rect = pymupdf.Rect(x, y, x + w, y + h)
+
+            shape.draw_rect(rect)
+
+            shape.finish(
+                color=color,
+                fill=color,
+                fill_opacity=0.15,
+                width=1,
+            )
+
+            text_width = pymupdf.get_text_length(label, fontsize=FONT_SIZE)
+            text_height = FONT_SIZE
+            padding = 3
+
+            rect_x0 = x
+            rect_y0 = y - text_height - (padding * 2)
+            rect_x1 = rect_x0 + text_width + (padding * 2)
+            rect_y1 = y
+
+            rect = pymupdf.Rect(rect_x0, rect_y0, rect_x1, rect_y1)
+
+            shape.draw_rect(rect)
+
+            shape.finish(
+                color=color,
+                fill=color,
+                fill_opacity=1.0,
+                width=1,
+            )
+
+            text_x = rect_x0 + padding
+            text_y = rect_y1 - padding - 1
+
+            shape.insert_text(
+                (text_x, text_y),
+                label,
+                fontsize=FONT_SIZE,
+                color=(0, 0, 0),
+            )
+
+        shape.commit(overlay=True)
+
+    updated_document_obj = document.tobytes(incremental=False)
+    document.close()
+
+    return updated_document_obj
+
+def outline_mineru_report(model_output: str, report_name: str, document_obj: bytes, document_type: str) -> bytes:
+
+    pages_data = json.loads(model_output)
+
+    unique_labels = sorted({
+        item.get("label", "unknown")
+        for page in pages_data
+        for item in page.get("layout_dets", [])
+    })
+
+    generated_colors = generate_distinct_colors(len(unique_labels))
+
+    label_colors = {
+        label: generated_colors[i]
+        for i, label in enumerate(unique_labels)
+    }
+
+    document = pymupdf.open(stream=document_obj, filetype=document_type)
+
+    for page_data in pages_data:
+
+        page_info = page_data["page_info"]
+
+        page_number = page_info["page_no"]
+
+        if page_number >= len(document):
+            logging.info(f"Skipping page {page_number}: page not found in PDF, report {report_name}")
+            continue
+
+        page = document[page_number]
+
+        source_width = page_info["width"]
+        source_height = page_info["height"]
+
+        pdf_width = page.rect.width
+        pdf_height = page.rect.height
+
+        scale_x = pdf_width / source_width
+        scale_y = pdf_height / source_height
+
+        shape = page.new_shape()
+
+        for item in page_data.get("layout_dets", []):
+
+            label = item.get("label")
+
+            if label == "ocr_text":
+                continue
+
+            bbox = item.get("bbox")
+
+            if not bbox or len(bbox) != 4:
+                continue
+
+            x0, y0, x1, y1 = bbox
+
+            x0 *= scale_x
+            x1 *= scale_x
+            y0 *= scale_y
+            y1 *= scale_y
+
+            rect = pymupdf.Rect(x0, y0, x1, y1)
+
+            shape.draw_rect(rect)
+
+            color = label_colors[label]
+
+            shape.finish(
+                color=color,
+                fill=color,
+                fill_opacity=0.15,
+                width=1,
+            )
+
+            text_width = pymupdf.get_text_length(label, fontsize=FONT_SIZE)
+            text_height = FONT_SIZE
+            padding = 3
+
+            rect_x0 = x0
+            rect_y0 = y0 - text_height - (padding * 2)
+            rect_x1 = rect_x0 + text_width + (padding * 2)
+            rect_y1 = y0
+
+            rect = pymupdf.Rect(rect_x0, rect_y0, rect_x1, rect_y1)
+
+            shape.draw_rect(rect)
+
+            shape.finish(
+                color=color,
+                fill=color,
+                fill_opacity=1,
+                width=1,
+            )
+
+            text_x = rect_x0 + padding
+            text_y = rect_y1 - padding - 1
+
+            shape.insert_text(
+                (text_x, text_y),
+                label,
+                fontsize=FONT_SIZE,
+                color=(0, 0, 0),
+            )
+
+        shape.commit(overlay=True)
+
+    updated_document_obj = document.tobytes(incremental=False)
+    document.close()
+
+    return updated_document_obj
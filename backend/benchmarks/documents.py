@@ -0,0 +1,74 @@
+import io
+import random
+import pymupdf
+from PIL import Image, ImageDraw
+
+WORDS = (
+    "revenue margin growth quarter segment customer product market region cost capital "
+    "board policy risk audit asset liability equity cash flow forecast contract supplier "
+    "employee report statement period increase decrease operating net total annual"
+).split()
+
+def get_paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def get_image_bytes(rng: random.Random, width: int, height: int) -> bytes:
+    # shapes instead of noise, noise does not compress and inflates every report
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(20, width // 2)), min(height, y0 + rng.randrange(20, height // 2))
+        draw.rectangle([x0, y0, x1, y1], fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def text_heavy_pdf(pages: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    document = pymupdf.open()
+    for _ in range(pages):
+        page = document.new_page()
+        y = 50
+        while y < page.rect.height - 100:
+            rect = pymupdf.Rect(50, y, page.rect.width - 50, y + 90)
+            page.insert_textbox(rect, get_paragraph(rng, 60), fontsize=10)
+            y += 100
+    content = document.tobytes()
+    document.close()
+    return content
+
+def image_heavy_pdf(pages: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    document = pymupdf.open()
+    for _ in range(pages):
+        page = document.new_page()
+        page.insert_textbox(pymupdf.Rect(50, 40, page.rect.width - 50, 90), get_paragraph(rng, 20), fontsize=10)
+        for row in range(2):
+            for column in range(2):
+                x = 50 + column * 260
+                y = 110 + row * 330
+                page.insert_image(pymupdf.Rect(x, y, x + 240, y + 240), stream=get_image_bytes(rng, 480, 480))
+                page.insert_textbox(pymupdf.Rect(x, y + 250, x + 240, y + 310), get_paragraph(rng, 12), fontsize=9)
+    content = document.tobytes()
+    document.close()
+    return content
+
+def scanned_pdf(pages: int, seed: int = 0) -> bytes:
+    # every page is a single raster of rendered text, there is no text layer to extract
+    source = pymupdf.open(stream=text_heavy_pdf(pages, seed), filetype="pdf")
+    document = pymupdf.open()
+    for source_page in source:
+        pixmap = source_page.get_pixmap(dpi=150, colorspace=pymupdf.csGRAY)
+        page = document.new_page(width=source_page.rect.width, height=source_page.rect.height)
+        page.insert_image(page.rect, stream=pixmap.tobytes("png"))
+    source.close()
+    content = document.tobytes()
+    document.close()
+    return content
+
+DOCUMENT_KINDS = {
+    "text_heavy": text_heavy_pdf,
+    "image_heavy": image_heavy_pdf,
+    "scanned": scanned_pdf,
+}
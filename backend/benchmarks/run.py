@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+# the stand-ins replace every external service, they have to be configured before the app reads its settings,
+# spawned executor workers import this module again and inherit the directory through the environment
+if "document_index_benchmark_dir" not in os.environ:
+    os.environ["document_index_benchmark_dir"] = tempfile.mkdtemp(prefix="document_index_benchmark_")
+os.environ["db_url"] = f"sqlite:///{os.environ['document_index_benchmark_dir']}/benchmark.db"
+os.environ["s3_bucket_name"] = "benchmark"
+os.environ["open_ai_api_key"] = "benchmark"
+os.environ["open_ai_model_name"] = "benchmark"
+os.environ["llm_cache_enabled"] = "False"
+os.environ["reconcile_interval_seconds"] = "0"
+
+import psutil
+import torch
+from openai import AsyncOpenAI
+from qdrant_client import AsyncQdrantClient
+
+from app.core.config import config
+from app.core.executors import start_executors, stop_executors
+from app.core.ml_models import load_models, ml_models, model_state
+from app.core.qdrant import collection_name, init_qdrant
+from app.db.schema import Base, Document, ProcessingRun, SessionLocal, User, engine
+from app.models.auth_models import UserData
+from app.services.document_service import get_points_filter, library_points_based_search, report_points_based_search, s3_upload_document
+from app.services.document_service import mineru_process_document, pager_process_document, pymupdf_full_process_document, pymupdf_partial_process_document
+from app.services.llm_service import get_completion
+from app.services.processing_run_service import get_percentiles
+from benchmarks.documents import DOCUMENT_KINDS, WORDS
+from benchmarks.stand_ins import InMemoryS3Client, StubEmbeddingModel, StubRerankerModel, create_parser_app, start_server
+
+PIPELINES = ["pager", "pymupdf_full", "pymupdf_partial", "mineru"]
+
+class PeakMemorySampler:
+    # rss is sampled because the peak of a single scenario is lost in ru_maxrss once a bigger one ran
+
+    def __init__(self, interval_seconds: float = 0.01):
+        self.interval_seconds = interval_seconds
+        self.process = psutil.Process()
+        self.peak_rss_bytes = 0
+        self.stopped = threading.Event()
+
+    def get_rss(self) -> int:
+        # pdf work runs in executor processes, their memory is part of the cost
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss
+
+    def sample(self):
+        while not self.stopped.is_set():
+            self.peak_rss_bytes = max(self.peak_rss_bytes, self.get_rss())
+            self.stopped.wait(self.interval_seconds)
+
+    def __enter__(self):
+        self.peak_rss_bytes = self.get_rss()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+async def process_document(pipeline: str, document: Document, pages: int, qdrant_client: AsyncQdrantClient, s3_client: InMemoryS3Client, db) -> int:
+    if pipeline == "pager":
+        return await pager_process_document(document, qdrant_client, s3_client, db)
+    if pipeline == "pymupdf_full":
+        return await pymupdf_full_process_document(document, qdrant_client, s3_client, db)
+    if pipeline == "pymupdf_partial":
+        return await pymupdf_partial_process_document(document, 0, pages, s3_client, db)
+    return await mineru_process_document(document, qdrant_client, s3_client, db)
+
+def get_stage_seconds(run: ProcessingRun | None) -> dict[str, float]:
+    stage_seconds = {}
+    for stage in (run.stages if run is not None else []):
+        stage_seconds[stage["stage"]] = stage_seconds.get(stage["stage"], 0.0) + stage["seconds"]
+    return stage_seconds
+
+async def benchmark_ingestion(args, user_data: UserData, qdrant_client: AsyncQdrantClient, s3_client: InMemoryS3Client, db) -> tuple[dict, dict[int, str]]:
+    results = {}
+    searchable_reports = {}
+    for kind in args.kinds:
+        content = DOCUMENT_KINDS[kind](args.pages, args.seed)
+        for pipeline in args.pipelines:
+            name = f"{pipeline}_{kind}"
+            document_id = s3_upload_document(content, str(uuid4()), "pdf", name, user_data, s3_client, db)
+            document = db.get(Document, document_id)
+
+            logging.info(f"Benchmarking {pipeline} on {kind} document with {args.pages} pages")
+            with PeakMemorySampler() as sampler:
+                start = time.perf_counter()
+                report_id = await process_document(pipeline, document, args.pages, qdrant_client, s3_client, db)
+                seconds = time.perf_counter() - start
+
+            points = (await qdrant_client.count(collection_name=collection_name, count_filter=get_points_filter([report_id]), exact=True)).count
+            if points > 0:
+                searchable_reports[report_id] = name
+
+            run = db.query(ProcessingRun).filter(ProcessingRun.document_id == document_id).order_by(ProcessingRun.id.desc()).first()
+            pages = run.page_count if run is not None and run.page_count else args.pages
+            results[name] = {
+                "pipeline": pipeline,
+                "kind": kind,
+                "input_bytes": len(content),
+                "pages": pages,
+                "points": points,
+                "seconds": seconds,
+                "pages_per_second": pages / seconds,
+                "points_per_second": points / seconds,
+                "peak_rss_bytes": sampler.peak_rss_bytes,
+                "stage_seconds": get_stage_seconds(run)
+            }
+    return results, searchable_reports
+
+async def benchmark_search(args, searchable_reports: dict[int, str], qdrant_client: AsyncQdrantClient, open_ai_client: AsyncOpenAI, db) -> dict:
+    rng = random.Random(args.seed)
+    report_ids = list(searchable_reports.keys())
+    latencies = {"report": [], "library": [], "llm": []}
+    if not report_ids:
+        return {}
+
+    with PeakMemorySampler() as sampler:
+        for index in range(args.queries):
+            query = " ".join(rng.choice(WORDS) for _ in range(6))
+
+            start = time.perf_counter()
+            await report_points_based_search(query, report_ids[index % len(report_ids)], None, qdrant_client)
+            latencies["report"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            points = await library_points_based_search(query, report_ids, None, qdrant_client)
+            latencies["library"].append(time.perf_counter() - start)
+
+            messages = [
+                {"role": "system", "content": "Answer using the evidence."},
+                {"role": "user", "content": query + "\n" + "\n".join(str(point.payload.get("data", ""))[:500] for point in points.points)}
+            ]
+            start = time.perf_counter()
+            await get_completion(messages, open_ai_client, db, use_cache=False)
+            latencies["llm"].append(time.perf_counter() - start)
+
+    return {
+        "queries": args.queries,
+        "latency_seconds": {name: get_percentiles(values) for name, values in latencies.items()},
+        "peak_rss_bytes": sampler.peak_rss_bytes
+    }
+
+def get_comparable_metrics(result: dict) -> dict[str, tuple[float, bool]]:
+    # metric name -> (value, higher is better)
+    metrics = {}
+    for name, scenario in result["ingestion"].items():
+        metrics[f"ingestion.{name}.pages_per_second"] = (scenario["pages_per_second"], True)
+        metrics[f"ingestion.{name}.points_per_second"] = (scenario["points_per_second"], True)
+        metrics[f"ingestion.{name}.peak_rss_bytes"] = (scenario["peak_rss_bytes"], False)
+    for name, percentiles in result["search"].get("latency_seconds", {}).items():
+        for percentile in ["p50", "p95", "p99"]:
+            if percentiles.get(percentile) is not None:
+                metrics[f"search.{name}.{percentile}"] = (percentiles[percentile], False)
+    return metrics
+
+def compare_with_baseline(result: dict, baseline: dict, tolerance: float) -> dict:
+    current = get_comparable_metrics(result)
+    previous = get_comparable_metrics(baseline)
+    comparison = {"tolerance": tolerance, "regressions": [], "improvements": [], "missing": []}
+
+    for name, (baseline_value, higher_is_better) in previous.items():
+        if name not in current:
+            comparison["missing"].append(name)
+            continue
+        value = current[name][0]
+        if baseline_value == 0:
+            continue
+        change = (value - baseline_value) / baseline_value
+        worse = -change if higher_is_better else change
+        entry = {"metric": name, "baseline": baseline_value, "current": value, "change": change}
+        if worse > tolerance:
+            comparison["regressions"].append(entry)
+        elif worse < -tolerance:
+            comparison["improvements"].append(entry)
+
+    return comparison
+
+async def run(args) -> dict:
+    Base.metadata.create_all(engine)
+    start_executors()
+
+    parser_server, parser_url = start_server(create_parser_app(args.parser_delay))
+    config.pager_url = parser_url
+    config.mineru_url = parser_url
+
+    if args.models == "stub":
+        ml_models["embedding_model"] = StubEmbeddingModel()
+        ml_models["reranker_model"] = StubRerankerModel()
+    else:
+        await load_models()
+        if not model_state["ready"]:
+            raise RuntimeError("Configured models could not be loaded")
+
+    qdrant_client = AsyncQdrantClient(location=":memory:")
+    await init_qdrant(qdrant_client)
+    s3_client = InMemoryS3Client()
+    open_ai_client = AsyncOpenAI(api_key="benchmark", base_url=f"{parser_url}/v1", max_retries=0)
+    db = SessionLocal()
+
+    try:
+        user = User(name="benchmark", password="-")
+        db.add(user)
+        db.commit()
+        user_data = UserData(user_id=user.id, username=user.name)
+
+        ingestion, searchable_reports = await benchmark_ingestion(args, user_data, qdrant_client, s3_client, db)
+        search = await benchmark_search(args, searchable_reports, qdrant_client, open_ai_client, db)
+    finally:
+        db.close()
+        await open_ai_client.close()
+        await qdrant_client.close()
+        parser_server.should_exit = True
+        stop_executors()
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "cuda": torch.cuda.is_available(),
+            "models": args.models,
+            "inference_backend": config.inference_backend,
+            "inference_quantization": config.inference_quantization
+        },
+        "parameters": {
+            "pages": args.pages,
+            "kinds": args.kinds,
+            "pipelines": args.pipelines,
+            "queries": args.queries,
+            "seed": args.seed,
+            "parser_delay": args.parser_delay
+        },
+        "ingestion": ingestion,
+        "search": search
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline ingestion and search benchmark with local stand-ins for every external service")
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic document")
+    parser.add_argument("--kinds", nargs="+", choices=list(DOCUMENT_KINDS.keys()), default=list(DOCUMENT_KINDS.keys()))
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=PIPELINES)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models", choices=["stub", "configured"], default="stub", help="hashing stand-ins or the models from the settings")
+    parser.add_argument("--parser-delay", type=float, default=0.0, help="seconds per page the fake parsers wait before answering")
+    parser.add_argument("--output", help="write the result json here instead of stdout")
+    parser.add_argument("--baseline", help="compare with a previous result and fail on regressions")
+    parser.add_argument("--save-baseline", help="also write the result as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change allowed before a metric counts as a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(run(args))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            result["comparison"] = compare_with_baseline(result, json.load(file), args.tolerance)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            file.write(output)
+
+    if result.get("comparison", {}).get("regressions"):
+        for regression in result["comparison"]["regressions"]:
+            print(f"Regression in {regression['metric']}: {regression['baseline']:.4g} -> {regression['current']:.4g}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+import pymupdf
+import torch
+import uvicorn
+from fastapi import FastAPI, Form, UploadFile
+from PIL.Image import Image as PILImage
+
+from app.core.qdrant import FULL_VECTOR_SIZE
+
+class InMemoryS3Client:
+    # the subset of the boto3 client the services use
+
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, **kwargs) -> None:
+        self.objects[Key] = Fileobj.read()
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        return {"Body": BytesIO(self.objects[Key]), "ContentLength": len(self.objects[Key])}
+
+    def delete_objects(self, Bucket: str, Delete: dict) -> dict:
+        for item in Delete["Objects"]:
+            self.objects.pop(item["Key"], None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod: str, Params: dict, ExpiresIn: int) -> str:
+        return f"memory://{Params['Bucket']}/{Params['Key']}"
+
+    def close(self) -> None:
+        pass
+
+def get_words(value: Any) -> list[str]:
+    if isinstance(value, str):
+        return re.findall(r"\w+", value.lower())
+    if isinstance(value, dict):
+        return [word for item in value.values() for word in get_words(item)]
+    if isinstance(value, list):
+        return [word for item in value for word in get_words(item)]
+    return []
+
+def get_images(value: Any) -> list[PILImage]:
+    if isinstance(value, PILImage):
+        return [value]
+    if isinstance(value, dict):
+        return [image for item in value.values() for image in get_images(item)]
+    if isinstance(value, list):
+        return [image for item in value for image in get_images(item)]
+    return []
+
+def get_bucket(token: str) -> tuple[int, float]:
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest[:4], "little") % FULL_VECTOR_SIZE, 1.0 if digest[4] % 2 else -1.0
+
+class StubEmbeddingModel:
+    # hashed bag of words, deterministic and free of model weights,
+    # so the benchmark measures the pipeline around the model and runs anywhere
+
+    def embed(self, value: Any) -> torch.Tensor:
+        vector = torch.zeros(FULL_VECTOR_SIZE)
+        for word in get_words(value):
+            index, sign = get_bucket(word)
+            vector[index] += sign
+        for image in get_images(value):
+            index, sign = get_bucket(hashlib.blake2b(image.resize((8, 8)).tobytes(), digest_size=8).hexdigest())
+            vector[index] += sign
+        return torch.nn.functional.normalize(vector, dim=0)
+
+    def encode(self, inputs: Any, batch_size: int = 32, convert_to_tensor: bool = True, **kwargs) -> torch.Tensor:
+        if isinstance(inputs, list):
+            return torch.stack([self.embed(item) for item in inputs]) if inputs else torch.zeros((0, FULL_VECTOR_SIZE))
+        return self.embed(inputs)
+
+class StubRerankerModel:
+
+    def predict(self, pairs: list[tuple[str, Any]], batch_size: int = 32, **kwargs) -> list[float]:
+        scores = []
+        for query, fragment in pairs:
+            query_words = set(get_words(query))
+            fragment_words = set(get_words(fragment))
+            scores.append(len(query_words & fragment_words) / (len(query_words) or 1))
+        return scores
+
+def get_page_blocks(page: pymupdf.Page) -> list[dict]:
+    blocks = []
+    for block in page.get_text("dict")["blocks"]:
+        bbox = [int(value) for value in block["bbox"]]
+        if block["type"] == 0:
+            text = " ".join(span["text"] for line in block["lines"] for span in line["spans"]).strip()
+            if text:
+                blocks.append({"kind": "text", "bbox": bbox, "text": text})
+        elif block["type"] == 1:
+            blocks.append({"kind": "image", "bbox": bbox, "image": base64.b64encode(block["image"]).decode("utf-8")})
+    return blocks
+
+def pager_report(content: bytes) -> dict:
+    pages = []
+    with pymupdf.open(stream=content, filetype="pdf") as document:
+        for page in document:
+            regions = []
+            for block in get_page_blocks(page):
+                x0, y0, x1, y1 = block["bbox"]
+                segment = {"x_top_left": x0, "y_top_left": y0, "width": x1 - x0, "height": y1 - y0}
+                if block["kind"] == "text":
+                    regions.append({"segment": segment, "text": block["text"], "label": "text"})
+                else:
+                    regions.append({"segment": segment, "text": "", "label": "figure", "base64": block["image"]})
+            pages.append({"regions": regions, "number": page.number, "width": page.rect.width, "height": page.rect.height})
+    return {"pages": pages}
+
+def mineru_report(content: bytes) -> dict:
+    content_list, images, model_output = [], {}, []
+    with pymupdf.open(stream=content, filetype="pdf") as document:
+        for page in document:
+            layout_dets = []
+            for index, block in enumerate(get_page_blocks(page)):
+                if block["kind"] == "text":
+                    content_list.append({"type": "text", "text": block["text"], "bbox": block["bbox"], "page_idx": page.number})
+                    layout_dets.append({"label": "text", "bbox": block["bbox"]})
+                else:
+                    name = f"{page.number}_{index}.png"
+                    images[name] = f"data:image/png;base64,{block['image']}"
+                    content_list.append({"type": "image", "img_path": f"images/{name}", "image_caption": [], "image_footnote": [], "bbox": block["bbox"], "page_idx": page.number})
+                    layout_dets.append({"label": "image", "bbox": block["bbox"]})
+            model_output.append({
+                "page_info": {"page_no": page.number, "width": page.rect.width, "height": page.rect.height},
+                "layout_dets": layout_dets
+            })
+    return {"content_list": json.dumps(content_list), "images": images, "model_output": json.dumps(model_output)}
+
+def create_parser_app(parser_delay_seconds: float) -> FastAPI:
+    # one app stands in for pager, MinerU and the OpenAI compatible llm server
+    app = FastAPI()
+
+    async def simulate_parsing(content: bytes) -> None:
+        if parser_delay_seconds > 0:
+            with pymupdf.open(stream=content, filetype="pdf") as document:
+                pages = document.page_count
+            await asyncio.sleep(parser_delay_seconds * pages)
+
+    @app.post("/")
+    async def pager(file: UploadFile, process: str = Form("")) -> dict:
+        content = await file.read()
+        await simulate_parsing(content)
+        return pager_report(content)
+
+    @app.post("/file_parse")
+    async def mineru(files: UploadFile) -> dict:
+        content = await files.read()
+        await simulate_parsing(content)
+        return {"results": {Path(files.filename).stem: mineru_report(content)}}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions() -> dict:
+        return {
+            "id": "benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "benchmark",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Benchmark answer."}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }
+
+    return app
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(app: FastAPI) -> tuple[uvicorn.Server, str]:
+    port = get_free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
@@ -26,5 +26,7 @@ export type PaginationDocuments = {
     page: number
     page_size: number
     total_items: number
+    total_is_approximate: boolean
+    next_after_id: number | null
     documents: Array<DocumentItem>
 }
\ No newline at end of file